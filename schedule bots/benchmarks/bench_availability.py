@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# bench_availability.py - Проверки свободного времени: выборка дня из SQLite против индекса и карты занятости в памяти
+
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DATE = "2025-06-01"
+BOOKINGS_PER_DAY = (50, 200, 500)
+QUERIES = 2000
+
+
+def fill_day(count):
+    """Заполняет день count короткими непересекающимися бронированиями"""
+    from db.connection import connection
+    with connection() as conn:
+        conn.execute("DELETE FROM reservations")
+        step = (20 * 60 - 5 * 60) // count
+        conn.executemany("""
+            INSERT INTO reservations (user_id, username, author_name, event_name, date, time, duration)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [(i, f"user{i}", "Автор", "Событие", DATE,
+               f"{(300 + i * step) // 60:02d}:{(300 + i * step) % 60:02d}", max(1, step - 1))
+              for i in range(count)])
+
+
+def main():
+    # Работаем во временном каталоге, чтобы не трогать рабочую базу
+    workdir = tempfile.mkdtemp(prefix="bench_availability_")
+    os.chdir(workdir)
+
+    from db.connection import connection
+    from db.db import init_db
+    from db.availability import AvailabilityIndex
+    from db.timeslots import date_to_day
+
+    init_db()
+    rnd = random.Random(0)
+    queries = [(start, start + rnd.choice((15, 30, 60, 90)))
+               for start in (rnd.randrange(300, 1200) for _ in range(QUERIES))]
+
+    def load_day(date):
+        with connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT start_minute, end_minute FROM reservations
+                WHERE day = ? AND start_minute IS NOT NULL ORDER BY start_minute
+            """, (date_to_day(date),))
+            return cursor.fetchall()
+
+    def scan(start, end):
+        return not any(start < booked_end and end > booked_start for booked_start, booked_end in load_day(DATE))
+
+    def stepping_nearest(after, duration):
+        """Старый поиск ближайшего времени: шаг 15 минут и проверка каждого бронирования"""
+        booked = load_day(DATE)
+        for slot in range(after, 20 * 60, 15):
+            if not any(slot < booked_end and slot + duration > booked_start for booked_start, booked_end in booked):
+                return slot
+        return None
+
+    print(f"Запросов на размер дня: {QUERIES}")
+    for count in BOOKINGS_PER_DAY:
+        fill_day(count)
+        index = AvailabilityIndex()
+
+        # Индекс и линейный просмотр должны отвечать одинаково
+        assert all(scan(s, e) == index.day(DATE).is_free(s, e) for s, e in queries[:200])
+
+        old = timeit.timeit(lambda: [scan(s, e) for s, e in queries], number=1)
+        new = timeit.timeit(lambda: [index.day(DATE).is_free(s, e) for s, e in queries], number=1)
+        steps = timeit.timeit(lambda: [stepping_nearest(s, 45) for s, _ in queries], number=1)
+        gaps = timeit.timeit(lambda: [index.day(DATE).next_free(s, 45, step=15, origin=s) for s, _ in queries],
+                             number=1)
+
+        print(f"Бронирований в дне: {count}")
+        print(f"  выборка дня + перебор:  {old / QUERIES * 1e6:8.1f} мкс/запрос")
+        print(f"  карта дня, is_free:     {new / QUERIES * 1e6:8.1f} мкс/запрос (x{old / new:.0f})")
+        print(f"  перебор с шагом 15 мин: {steps / QUERIES * 1e6:8.1f} мкс/запрос")
+        print(f"  карта дня, next_free:   {gaps / QUERIES * 1e6:8.1f} мкс/запрос (x{steps / gaps:.0f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# bench_backlog_drain.py - Разбор накопленной за ночь очереди: по одному в порядке прихода против плана bots.backlog
+
+import os
+import random
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+UPDATES = 10_000
+WORKERS = 8  # шарды ВК-бота / параллельные пользователи
+VIEW_COST = 0.001  # время обработки просмотра (ответ из кэша), секунды
+WRITE_COST = 0.002  # шаг бронирования: запрос к базе и ответ
+SEED = 21
+
+
+def user_script(rng):
+    """Сообщения одного пользователя за ночь: (текст, payload)"""
+    taps = rng.choice((1, 1, 1, 2, 5))  # нетерпеливые жмут кнопку несколько раз
+    kind = rng.random()
+    if kind < 0.4:
+        day = rng.randint(1, 28)
+        return [("📆 Общее расписание", {})] * taps + [("", {"button": f"mo_{rng.randint(1, 12)}"}),
+                                                        ("", {"button": f"day_{day:02d}"})]
+    if kind < 0.8:
+        month, day, hour = rng.randint(1, 12), rng.randint(1, 28), rng.randint(9, 19)
+        return [("📌 Бронь", {})] * taps + [
+            ("", {"button": "month_period_1_4"}), ("", {"button": f"select_month_{month}_2026"}),
+            ("", {"button": f"select_day_{day}"}), ("", {"button": "hour_period_9_12"}),
+            ("", {"button": f"hour_{hour}"}), ("", {"button": f"minute_{rng.choice(('00', '30'))}"}),
+            ("", {"button": "duration_60"}), ("Иван", {}), ("Репетиция", {})]
+    return [("📅 Мои бронирования", {})] * taps + [("", {"button": f"cancel_confirm_{rng.randint(1, 500)}"})]
+
+
+def synthetic_backlog():
+    """UPDATES сообщений от разных пользователей, перемешанных с сохранением порядка каждого"""
+    from bots.vkBot import BacklogMessage
+
+    rng = random.Random(SEED)
+    scripts, total = [], 0
+    while total < UPDATES:
+        script = user_script(rng)[:UPDATES - total]
+        scripts.append(script)
+        total += len(script)
+    positions = [0] * len(scripts)
+    pending = [user_id for user_id, script in enumerate(scripts) for _ in script]
+    rng.shuffle(pending)
+    messages = []
+    for message_id, user_id in enumerate(pending, 1):
+        text, payload = scripts[user_id][positions[user_id]]
+        positions[user_id] += 1
+        messages.append(BacklogMessage(user_id + 1, message_id, text, payload))
+    return messages
+
+
+class Replay:
+    """Обработчик-заглушка: тратит время по виду сообщения и запоминает, когда закончил каждого пользователя"""
+
+    def __init__(self, messages):
+        self.writers = {m.user_id for m in messages if not m.is_view()}
+        self.finished = {}
+        self.handled = 0
+        self.started = None
+        self._lock = threading.Lock()
+
+    def __call__(self, message):
+        time.sleep(VIEW_COST if message.is_view() else WRITE_COST)
+        with self._lock:
+            self.handled += 1
+            self.finished[message.user_id] = time.perf_counter() - self.started
+
+    def report(self, name, elapsed):
+        writes_done = max(t for user_id, t in self.finished.items() if user_id in self.writers)
+        print(f"{name:>22}: обработано {self.handled:>5}, очередь разобрана за {elapsed:6.2f} с, "
+              f"все бронирования — за {writes_done:6.2f} с")
+
+
+def sequential(messages):
+    """Как раньше в Telegram: по одному в порядке прихода"""
+    replay = Replay(messages)
+    replay.started = time.perf_counter()
+    for message in messages:
+        replay(message)
+    replay.report("по одному", time.perf_counter() - replay.started)
+
+
+def sharded(messages, planned):
+    from bots import backlog
+    from bots.dispatcher import ShardedDispatcher
+
+    replay = Replay(messages)
+    dispatcher = ShardedDispatcher(replay, WORKERS, name="bench")
+    dispatcher.start()
+    replay.started = time.perf_counter()
+    if planned:
+        groups, _ = backlog.plan(messages, lambda m: m.user_id, lambda m: m.key(), lambda m: m.is_view())
+        for user_id, user_messages in groups:
+            for message in user_messages:
+                dispatcher.submit(user_id, message)
+    else:
+        for message in messages:
+            dispatcher.submit(message.user_id, message)
+    dispatcher.stop(timeout=600)
+    replay.report("план + шарды" if planned else "шарды без плана", time.perf_counter() - replay.started)
+
+
+def main():
+    from bots import backlog
+
+    messages = synthetic_backlog()
+    groups, dropped = backlog.plan(messages, lambda m: m.user_id, lambda m: m.key(), lambda m: m.is_view())
+    print(f"Накопленная очередь: {len(messages)} сообщений; план: {backlog.summary(groups, dropped)}")
+    print(f"Потоков: {WORKERS}, просмотр {VIEW_COST * 1000:.0f} мс, шаг бронирования {WRITE_COST * 1000:.0f} мс")
+    sequential(messages)
+    sharded(messages, planned=False)
+    sharded(messages, planned=True)
+
+
+if __name__ == "__main__":
+    main()
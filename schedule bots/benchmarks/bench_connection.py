@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# bench_connection.py - Накладные расходы на соединение с БД: новое соединение на вызов против пула
+
+import os
+import sqlite3
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CALLS = 2000
+
+
+def old_style_query(date):
+    """Так работали помощники до пула: connect → запрос → close на каждый вызов"""
+    conn = sqlite3.connect('reservations.db')
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, date, time, duration FROM reservations WHERE date = ?", (date,))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+def main():
+    # Работаем во временном каталоге, чтобы не трогать рабочую базу
+    workdir = tempfile.mkdtemp(prefix="bench_conn_")
+    os.chdir(workdir)
+
+    from db.connection import connection, close_all
+    from db.db import init_db, save_reservation
+
+    init_db()
+    for i in range(50):
+        save_reservation(i, f"user{i}", "Автор", "Событие", "2025-05-01", f"{5 + i % 15:02d}:00", 60)
+
+    def pooled_query(date):
+        with connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, date, time, duration FROM reservations WHERE date = ?", (date,))
+            return cursor.fetchall()
+
+    old = timeit.timeit(lambda: old_style_query("2025-05-01"), number=CALLS)
+    new = timeit.timeit(lambda: pooled_query("2025-05-01"), number=CALLS)
+    close_all()
+
+    print(f"Вызовов: {CALLS}")
+    print(f"connect на каждый вызов: {old / CALLS * 1e6:8.1f} мкс/вызов")
+    print(f"пул соединений:          {new / CALLS * 1e6:8.1f} мкс/вызов")
+    print(f"Ускорение: x{old / new:.1f}")
+
+
+if __name__ == "__main__":
+    main()
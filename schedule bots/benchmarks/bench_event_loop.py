@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# bench_event_loop.py - Задержка цикла событий: синхронные запросы к базе из корутин против AsyncRepository
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+HANDLERS = 200  # одновременных "обработчиков"
+# Параллельный писатель (как ВК-бот в том же процессе): держит блокировку записи
+WRITER_HOLD = 0.02
+WRITER_PAUSE = 0.02
+DATES = [f"2025-06-{day:02d}" for day in range(1, 31)]
+
+
+def make_requests(seed):
+    """Одинаковый набор действий пользователей для обоих прогонов"""
+    rnd = random.Random(seed)
+    requests = []
+    for i in range(HANDLERS):
+        date = rnd.choice(DATES)
+        minute = rnd.randrange(5 * 60, 20 * 60, 15)
+        requests.append((i, date, f"{minute // 60:02d}:{minute % 60:02d}", rnd.choice((30, 60, 90))))
+    return requests
+
+
+async def blocking_handler(user_id, date, time_str, duration):
+    # Так работали обработчики: синхронные вызовы прямо в корутине
+    from db.db import add_reservation, get_reservations_for_user
+    from db.occupancy import get_month_occupancy
+    get_month_occupancy(2025, 6)
+    add_reservation(user_id, "user", "Автор", "Событие", date, time_str, duration)
+    get_reservations_for_user(user_id)
+
+
+async def async_handler(user_id, date, time_str, duration):
+    from db.repository import repository
+    await repository.month_occupancy(2025, 6)
+    await repository.add_reservation(user_id, "user", "Автор", "Событие", date, time_str, duration)
+    await repository.get_reservations_for_user(user_id)
+
+
+async def run(handler, requests, lag_name):
+    from metrics import watch_event_loop, histogram
+    watcher = asyncio.create_task(watch_event_loop(lag_name, interval=0.001))
+    await asyncio.sleep(0.01)
+    started = time.perf_counter()
+    # Пользователи приходят не одновременно, а потоком
+    tasks = []
+    for request in requests:
+        tasks.append(asyncio.create_task(handler(*request)))
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    watcher.cancel()
+    return elapsed, histogram(lag_name)
+
+
+def concurrent_writer(stop):
+    """Периодически держит транзакцию записи, заставляя остальных ждать busy_timeout"""
+    from db.connection import transaction, close_connection
+    while not stop.is_set():
+        with transaction() as conn:
+            conn.execute("UPDATE reservations SET event_name = event_name WHERE id = -1")
+            time.sleep(WRITER_HOLD)
+        time.sleep(WRITER_PAUSE)
+    close_connection()
+
+
+def main():
+    # Работаем во временном каталоге, чтобы не трогать рабочую базу
+    workdir = tempfile.mkdtemp(prefix="bench_event_loop_")
+    os.chdir(workdir)
+
+    from db.connection import connection
+    from db.db import init_db
+    from db.repository import repository
+    from metrics import report
+
+    init_db()
+
+    results = {}
+    for name, handler in (("sync", blocking_handler), ("async", async_handler)):
+        with connection() as conn:
+            conn.execute("DELETE FROM reservations")
+        stop = threading.Event()
+        writer = threading.Thread(target=concurrent_writer, args=(stop,))
+        writer.start()
+        results[name] = asyncio.run(run(handler, make_requests(1), f"lag.{name}"))
+        stop.set()
+        writer.join()
+    repository.close()
+
+    print(f"Обработчиков: {HANDLERS}, параллельный писатель держит блокировку {WRITER_HOLD * 1000:g} мс "
+          f"каждые {(WRITER_HOLD + WRITER_PAUSE) * 1000:g} мс")
+    for name, (elapsed, lag) in results.items():
+        print(f"{name:>5}: всего {elapsed:.2f} с; задержка цикла p50≤{lag.percentile(50) * 1000:g} мс, "
+              f"p99≤{lag.percentile(99) * 1000:g} мс, max {lag.max * 1000:.1f} мс")
+    print()
+    print(report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# bench_group_commit.py - Бронирований в секунду: транзакция на каждое бронирование против групповой фиксации
+
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+THREADS = 16
+BOOKINGS_PER_THREAD = 250
+DATES = [f"2025-{month:02d}-{day:02d}" for month in range(1, 13) for day in range(1, 29)]
+DURATIONS = [15, 30, 60]
+
+
+def make_bookings(thread_no):
+    rnd = random.Random(thread_no)
+    bookings = []
+    for i in range(BOOKINGS_PER_THREAD):
+        minute = rnd.randrange(5 * 60, 20 * 60, 15)
+        bookings.append((thread_no, f"t{thread_no}", "Автор", f"Событие {i}", rnd.choice(DATES),
+                         f"{minute // 60:02d}:{minute % 60:02d}", rnd.choice(DURATIONS)))
+    return bookings
+
+
+def book_direct(*booking):
+    """Как было до писателя: своя транзакция BEGIN IMMEDIATE в каждом потоке"""
+    from db.connection import transaction
+    from db.db import _add_reservation
+    from db.events import publish
+    with transaction() as conn:
+        result, changes = _add_reservation(conn.cursor(), *booking)
+    for change in changes:
+        publish(change)
+    return result
+
+
+def book_group(*booking):
+    from db.db import _add_reservation
+    from db.writer import writer
+    return writer.execute(_add_reservation, *booking)
+
+
+def worker(book, bookings, counts, barrier):
+    from db.connection import close_connection
+    barrier.wait()
+    for booking in bookings:
+        counts["ok" if book(*booking) else "conflict"] += 1
+    close_connection()
+
+
+def run(book):
+    from db.connection import connection
+
+    with connection() as conn:
+        conn.execute("DELETE FROM reservations")
+
+    counts = [{"ok": 0, "conflict": 0} for _ in range(THREADS)]
+    barrier = threading.Barrier(THREADS + 1)
+    threads = [threading.Thread(target=worker, args=(book, make_bookings(i), counts[i], barrier))
+               for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return elapsed, sum(c["ok"] for c in counts), sum(c["conflict"] for c in counts)
+
+
+def main():
+    # Работаем во временном каталоге, чтобы не трогать рабочую базу
+    workdir = tempfile.mkdtemp(prefix="bench_group_commit_")
+    os.chdir(workdir)
+
+    import db.connection
+    from db.db import init_db
+    from db.writer import writer
+
+    init_db()
+    total = THREADS * BOOKINGS_PER_THREAD
+    print(f"Потоков: {THREADS}, бронирований: {total}")
+
+    # При synchronous = FULL каждая фиксация ждет fsync, и выигрыш от группировки заметнее
+    for synchronous in ("NORMAL", "FULL"):
+        db.connection.PRAGMAS = tuple(
+            f"PRAGMA synchronous = {synchronous}" if pragma.startswith("PRAGMA synchronous") else pragma
+            for pragma in db.connection.PRAGMAS)
+        db.connection.close_all()
+        writer.close()
+
+        print(f"\nsynchronous = {synchronous}")
+        for name, book in (("по одной", book_direct), ("группами", book_group)):
+            batches, requests = writer.batches, writer.requests
+            elapsed, ok, conflicts = run(book)
+            line = f"{name:>9}: {elapsed:.2f} с, {total / elapsed:,.0f} бронирований/с (успешно {ok}, конфликтов {conflicts})"
+            if writer.batches > batches:
+                line += f", средний пакет {(writer.requests - requests) / (writer.batches - batches):.1f}"
+            print(line)
+    writer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# bench_import_time.py - Время импорта модулей по python -X importtime и проверка бюджетов запуска
+#
+# Каждый сценарий запускается в отдельном процессе в пустом каталоге: так заодно
+# проверяется, что импорт не создает базу (никакого I/O при импорте). Если медиана
+# сценария выходит за бюджет, скрипт завершается с кодом 1.
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+REPEATS = 5
+
+# Сценарий -> (код, бюджет в мс). "до первого опроса" — то, что процесс импортирует,
+# прежде чем боты начнут получать сообщения (main + warmup.warm_imports)
+SCENARIOS = {
+    "bots": ("import bots", 5),
+    "clear_db": ("import clear_db", 40),
+    "db.repository": ("import db.repository", 120),
+    "bots.vkBot": ("import bots.vkBot", 350),
+    "bots.tgBot": ("import bots.tgBot", 450),
+    "main": ("import main", 150),
+    "до первого опроса": ("import main, warmup; warmup.warm_imports()", 700),
+}
+
+
+def parse(stderr):
+    """Модули верхнего уровня из вывода -X importtime: {имя: накопленное время, мкс}"""
+    result = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not name.startswith("  "):  # отступ — вложенный импорт
+            result[name.strip()] = int(cumulative)
+    return result
+
+
+def run(code, cwd, env):
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                               cwd=cwd, env=env, capture_output=True, text=True, check=True)
+    return parse(completed.stderr)
+
+
+def measure(code, cwd, env, startup):
+    """Медиана суммарного времени импортов сценария без импортов запуска интерпретатора, мс"""
+    totals = []
+    for _ in range(REPEATS):
+        modules = run(code, cwd, env)
+        totals.append(sum(us for name, us in modules.items() if name not in startup) / 1000)
+    return statistics.median(totals)
+
+
+def main():
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    # Как в рабочем окружении: байткод кэшируется, иначе замер покажет компиляцию
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+
+    failed = []
+    with tempfile.TemporaryDirectory() as cwd:
+        startup = set(run("pass", cwd, env))
+        print(f"{'сценарий':>18}  {'медиана, мс':>11}  {'бюджет, мс':>10}")
+        for name, (code, budget) in SCENARIOS.items():
+            run(code, cwd, env)  # первый запуск пишет __pycache__
+            elapsed = measure(code, cwd, env, startup)
+            status = "ok" if elapsed <= budget else "ПРЕВЫШЕН"
+            print(f"{name:>18}  {elapsed:11.1f}  {budget:10d}  {status}")
+            if elapsed > budget:
+                failed.append(name)
+        created = os.listdir(cwd)
+        if created:
+            print(f"Импорт создал файлы в рабочем каталоге: {created}")
+            failed.append("I/O при импорте")
+
+    if failed:
+        print(f"Бюджет не выдержан: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
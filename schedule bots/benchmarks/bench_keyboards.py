@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# bench_keyboards.py - Сборка клавиатур ВК на каждый ответ против готового JSON из bots.vkKeyboards
+
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+REPLIES = 50_000
+
+
+def build_main():
+    """Как раньше в VkBot.get_main_keyboard + send_message"""
+    from vk_api.keyboard import VkKeyboard, VkKeyboardColor
+
+    keyboard = VkKeyboard(one_time=False)
+    keyboard.add_button('📆 Общее расписание', color=VkKeyboardColor.PRIMARY)
+    keyboard.add_button('📅 Мои бронирования', color=VkKeyboardColor.PRIMARY)
+    keyboard.add_line()
+    keyboard.add_button('📌 Бронь', color=VkKeyboardColor.POSITIVE)
+    keyboard.add_button('ℹ️ О боте', color=VkKeyboardColor.SECONDARY)
+    return keyboard.get_keyboard()
+
+
+def build_minutes(prefix):
+    from vk_api.keyboard import VkKeyboard, VkKeyboardColor
+
+    keyboard = VkKeyboard(inline=True)
+    for i, minute in enumerate(["00", "15", "30", "45"]):
+        if i % 2 == 0 and i != 0:
+            keyboard.add_line()
+        keyboard.add_button(minute, color=VkKeyboardColor.PRIMARY, payload={"button": f"{prefix}_{minute}"})
+    return keyboard.get_keyboard()
+
+
+def build_month(year, month):
+    from bots.vkKeyboards import MONTH_NAMES
+    from vk_api.keyboard import VkKeyboard, VkKeyboardColor
+
+    keyboard = VkKeyboard(inline=True)
+    for i, m in enumerate((5, 6, 7, 8)):
+        y = year + 1 if m < month else year
+        label = f"{MONTH_NAMES[m - 1]} ({y})" if y > year else MONTH_NAMES[m - 1]
+        keyboard.add_button(label, color=VkKeyboardColor.PRIMARY,
+                            payload={"button": f"select_month_{m}_{y}"})
+        if i % 2 == 1 and i != 3:
+            keyboard.add_line()
+    return keyboard.get_keyboard()
+
+
+def measure(fn):
+    started = time.perf_counter()
+    for _ in range(REPLIES):
+        fn()
+    return (time.perf_counter() - started) / REPLIES * 1e6
+
+
+def main():
+    from bots import vkKeyboards
+
+    cases = [
+        ("главное меню", build_main, lambda: vkKeyboards.MAIN),
+        ("минуты", lambda: build_minutes("minute"), lambda: vkKeyboards.minutes("minute")),
+        ("месяцы периода", lambda: build_month(2025, 6), lambda: vkKeyboards.month_choice((5, 6, 7, 8), 2025, 6)),
+    ]
+    print(f"Ответов: {REPLIES}")
+    for name, build, cached in cases:
+        assert build() == cached()
+        print(f"{name:>15}: сборка {measure(build):.1f} мкс, фабрика {measure(cached):.2f} мкс")
+
+
+if __name__ == "__main__":
+    main()
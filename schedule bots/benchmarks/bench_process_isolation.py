@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# bench_process_isolation.py - Задержка цикла событий Telegram-бота, пока ВК-бот занят отрисовкой:
+# ВК в потоках того же процесса (общий GIL) против ВК в отдельном процессе (BOT_PROCESSES)
+
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DURATION = 5.0  # секунд на прогон
+VK_WORKERS = 4  # шарды ВК-бота
+TG_RATE = 200  # сообщений Telegram в секунду
+RESERVATIONS = 40  # записей в отрисовываемом расписании
+
+
+def render_schedule(seed):
+    """Чистый Python, как отрисовка расписания и клавиатуры ВК: строки и JSON"""
+    lines = []
+    for i in range(RESERVATIONS):
+        start = (9 * 60 + (seed + i * 15) % 600)
+        lines.append(f"{start // 60:02d}:{start % 60:02d} - {(start + 90) // 60:02d}:{(start + 90) % 60:02d} "
+                     f"| Мероприятие {i} | Автор {seed % 97}")
+    buttons = [[{"action": {"type": "text", "label": f"{day:02d}", "payload": json.dumps({"button": f"day_{day}"})}}
+                for day in range(week * 7 + 1, week * 7 + 8)] for week in range(4)]
+    return len("\n".join(lines)) + len(json.dumps({"inline": True, "buttons": buttons}, ensure_ascii=False))
+
+
+def vk_shard(stop, counter, lock):
+    rendered = 0
+    while not stop.is_set():
+        render_schedule(rendered)
+        rendered += 1
+    with lock:
+        counter.value += rendered
+
+
+def vk_process(stop, counter, lock):
+    """ВК-бот в своем процессе: те же шарды-потоки, но свой GIL"""
+    shards = [threading.Thread(target=vk_shard, args=(stop, counter, lock)) for _ in range(VK_WORKERS)]
+    for shard in shards:
+        shard.start()
+    for shard in shards:
+        shard.join()
+
+
+async def telegram(lag_name):
+    """Цикл событий Telegram-бота: короткие обработчики с частотой TG_RATE и замер задержки цикла"""
+    from metrics import histogram, watch_event_loop
+
+    handled = 0
+    latency = histogram(f"{lag_name}.handler")
+
+    async def handler(sent):
+        nonlocal handled
+        render_schedule(handled)
+        latency.observe(time.perf_counter() - sent)
+        handled += 1
+
+    watcher = asyncio.create_task(watch_event_loop(lag_name, interval=0.001))
+    tasks = []
+    deadline = time.perf_counter() + DURATION
+    while time.perf_counter() < deadline:
+        tasks.append(asyncio.create_task(handler(time.perf_counter())))
+        await asyncio.sleep(1 / TG_RATE)
+    await asyncio.gather(*tasks)
+    watcher.cancel()
+    return handled, histogram(lag_name), latency
+
+
+def run(name, in_process):
+    context = multiprocessing.get_context("spawn")
+    stop = context.Event()
+    counter = context.Value("q", 0, lock=False)
+    lock = context.Lock()
+    if in_process:
+        vk = context.Process(target=vk_process, args=(stop, counter, lock))
+    else:
+        vk = threading.Thread(target=vk_process, args=(stop, counter, lock))
+    vk.start()
+    time.sleep(0.5)  # процесс ВК успевает запуститься
+    started = time.perf_counter()
+    try:
+        handled, lag, latency = asyncio.run(telegram(name))
+    finally:
+        stop.set()
+        vk.join()
+    elapsed = time.perf_counter() - started
+    print(f"\n{name}: Telegram обработал {handled} сообщений ({handled / elapsed:.0f}/с), "
+          f"ВК отрисовал {counter.value / elapsed:.0f} расписаний/с")
+    print(f"  {lag.summary()}")
+    print(f"  {latency.summary()}")
+    return lag
+
+
+def main():
+    print(f"{DURATION:g} с, Telegram {TG_RATE} сообщений/с, ВК {VK_WORKERS} шарда без пауз")
+    shared = run("один процесс", in_process=False)
+    isolated = run("процессы", in_process=True)
+    print(f"\nЗадержка цикла Telegram p99: {shared.percentile(99) * 1000:g} мс -> {isolated.percentile(99) * 1000:g} мс, "
+          f"max: {shared.max * 1000:.1f} мс -> {isolated.max * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# bench_router.py - Стоимость выбора маршрута ВК-бота на типичной смеси событий
+
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+EVENTS = 200_000
+
+# Записанная смесь: (доля, состояние, текст, payload) — бронирование, просмотр и правка
+MIX = [
+    (10, None, "📌 Бронь", {}),
+    (6, None, "📆 Общее расписание", {}),
+    (6, None, "📅 Мои бронирования", {}),
+    (2, None, "начать", {}),
+    (8, "month_period_selection", "Май-Август (5-8)", {"button": "month_period_5_8"}),
+    (8, "month_selection", "Июнь", {"button": "select_month_6_2025"}),
+    (8, "day_selection", "15", {}),
+    (8, "hour_period_selection", "9-12", {"button": "hour_period_9_12"}),
+    (8, "hour_selection", "10", {"button": "hour_10"}),
+    (8, "minute_selection", "30", {"button": "minute_30"}),
+    (6, "duration_selection", "60", {"button": "duration_60"}),
+    (6, "author_name", "Иван", {}),
+    (6, "event_name", "Лекция", {}),
+    (4, "select_month", "Июнь", {"button": "mo_06"}),
+    (4, "select_day", "15", {"button": "day_15"}),
+    (3, "schedule_month_period", "1-4", {"action": "schedule_month_period", "period": "1_4"}),
+    (3, "view_reservations", "Изменить", {"button": "edit_booking_42"}),
+    (2, "view_reservations", "Отменить", {"button": "cancel_confirm_42"}),
+    (2, "edit_selection", "Время", {"button": "edit_time"}),
+    (2, "edit_hour_selection", "10", {"button": "edit_hour_10"}),
+    (2, "edit_minute_selection", "15", {"button": "edit_minute_15"}),
+    (1, "start", "что-то", {}),
+]
+
+
+def recorded_events():
+    rnd = random.Random(1)
+    weights = [item[0] for item in MIX]
+    return [item[1:] for item in rnd.choices(MIX, weights=weights, k=EVENTS)]
+
+
+def linear_longest(prefixes, button):
+    """Как в цепочке if/elif: перебор префиксов через startswith"""
+    best = None
+    for prefix in prefixes:
+        if button.startswith(prefix) and (best is None or len(prefix) > len(best)):
+            best = prefix
+    return best
+
+
+def measure(fn, items):
+    started = time.perf_counter()
+    for item in items:
+        fn(*item)
+    return (time.perf_counter() - started) / len(items) * 1e9
+
+
+def main():
+    from bots.router import PrefixTrie
+    from bots.vkBot import router
+
+    events = recorded_events()
+    resolve_ns = measure(lambda state, text, payload: router.resolve(1, text, payload, state), events)
+
+    # Только поиск параметризованной кнопки: префиксное дерево против перебора
+    buttons = [(payload["button"],) for _, _, payload in events if "button" in payload]
+    prefixes = ["month_period_", "mo_", "day_", "edit_hour_period_", "edit_hour_", "edit_minute_",
+                "edit_duration_", "edit_month_period_", "edit_select_month_", "hour_period_", "hour_",
+                "minute_", "suggest_", "duration_", "select_month_", "day_period_", "select_day_",
+                "cancel_confirm_", "confirm_cancel_", "edit_booking_"]
+    trie = PrefixTrie()
+    for prefix in prefixes:
+        trie.add(prefix, prefix)
+    trie_ns = measure(trie.longest, buttons)
+    linear_ns = measure(lambda button: linear_longest(prefixes, button), buttons)
+
+    print(f"Событий: {len(events)}, из них с кнопкой: {len(buttons)}")
+    print(f"router.resolve: {resolve_ns:.0f} нс/событие")
+    print(f"Поиск префикса кнопки: дерево {trie_ns:.0f} нс, перебор {len(prefixes)} префиксов {linear_ns:.0f} нс")
+
+
+if __name__ == "__main__":
+    main()
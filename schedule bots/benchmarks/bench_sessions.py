@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# bench_sessions.py - Память под состояния пользователей: обычные словари против SessionStore
+
+import os
+import random
+import sys
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+USERS = 200_000  # разных пользователей за "несколько недель"
+EVENTS_PER_USER = 5
+LIMIT = 5_000
+
+
+def simulate(states, data):
+    rnd = random.Random(1)
+    samples = []
+    for user_id in range(USERS):
+        for _ in range(EVENTS_PER_USER):
+            states[user_id] = rnd.choice(("month_selection", "day_selection", "hour_selection"))
+            data.setdefault(user_id, {}).update({"month": "06", "year": "2025", "time": "10:00"})
+        if user_id % (USERS // 10) == 0:
+            samples.append(tracemalloc.get_traced_memory()[0])
+    return samples
+
+
+def run(name, states, data):
+    tracemalloc.start()
+    samples = simulate(states, data)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    trend = " → ".join(f"{sample / 2 ** 20:.1f}" for sample in samples)
+    print(f"{name:>18}: сейчас {current / 2 ** 20:.1f} МБ, пик {peak / 2 ** 20:.1f} МБ; по ходу: {trend}")
+
+
+def main():
+    from bots.sessions import SessionStore
+
+    print(f"Пользователей: {USERS}, событий на пользователя: {EVENTS_PER_USER}")
+    run("словари", {}, {})
+    # Без записи в базу: измеряется только память
+    store = SessionStore("vk_sessions", limit=LIMIT, persist=False)
+    run(f"SessionStore({LIMIT})", store.states, store.data)
+    print(store.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# bench_vk_execute.py - Отправка ответов ВК-бота по одному и пачками через execute (локальный фейковый VK API)
+
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+USERS = 50
+MESSAGES_PER_STEP = 2  # например, список бронирований и меню
+STEPS = 2
+LATENCY = 0.05  # задержка ответа "VK", секунды
+
+
+class FakeVk(BaseHTTPRequestHandler):
+    """Отвечает как api.vk.com: messages.send возвращает id, execute — массив id"""
+
+    ids = itertools.count(1)
+    http_requests = 0
+    api_calls = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        method = self.path.rsplit("/", 1)[-1]
+        body = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+        time.sleep(LATENCY)
+        with FakeVk.lock:
+            FakeVk.http_requests += 1
+            if method == "execute":
+                calls = len(re.findall(r"API\.[\w.]+\(", body["code"][0]))
+                FakeVk.api_calls += calls
+                response = [next(FakeVk.ids) for _ in range(calls)]
+            else:
+                FakeVk.api_calls += 1
+                response = next(FakeVk.ids)
+        data = json.dumps({"response": response}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_call(url):
+    """Аналог VkApi.method, только с адресом фейкового сервера"""
+    from vk_api.exceptions import ApiError
+
+    http = requests.Session()
+
+    def call(method, params, raw=False):
+        response = http.post(f"{url}/method/{method}", params).json()
+        if "error" in response:
+            raise ApiError(None, method, params, raw, response["error"])
+        return response if raw else response["response"]
+    return call
+
+
+def run(name, url, batch):
+    from bots.outbox import Outbox
+
+    FakeVk.http_requests = FakeVk.api_calls = 0
+    outbox = Outbox(make_call(url), batch=batch, name=f"bench-{name}")
+    started = time.perf_counter()
+    for step in range(STEPS):
+        for user_id in range(USERS):
+            for i in range(MESSAGES_PER_STEP):
+                outbox.send("messages.send", {"user_id": user_id, "message": f"шаг {step}, сообщение {i}",
+                                              "random_id": next(FakeVk.ids)}, user_id=user_id)
+    outbox.close(timeout=600)
+    elapsed = time.perf_counter() - started
+    stats = outbox.stats()
+    print(f"{name:>10}: {stats['sent']} сообщений за {elapsed:.2f} с, "
+          f"HTTP-запросов {FakeVk.http_requests}, вызовов API {FakeVk.api_calls}")
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeVk)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+
+    print(f"Пользователей: {USERS}, шагов: {STEPS}, сообщений на шаг: {MESSAGES_PER_STEP}, "
+          f"задержка VK: {LATENCY * 1000:.0f} мс")
+    run("по одному", url, batch=1)
+    run("execute", url, batch=25)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
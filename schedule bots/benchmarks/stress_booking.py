@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# stress_booking.py - Нагрузочная проверка add_reservation из нескольких потоков
+
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+THREADS = 8
+ATTEMPTS_PER_THREAD = 300
+DATES = ["2025-06-01", "2025-06-02"]
+DURATIONS = [15, 30, 60, 90, 120]
+
+
+def worker(thread_no, results, barrier):
+    from db.db import add_reservation
+    from db.connection import close_connection
+
+    rnd = random.Random(thread_no)
+    barrier.wait()  # стартуем одновременно, чтобы потоки конкурировали за одни и те же интервалы
+    for attempt in range(ATTEMPTS_PER_THREAD):
+        date = rnd.choice(DATES)
+        minute = rnd.randrange(5 * 60, 20 * 60, 15)
+        result = add_reservation(thread_no, f"t{thread_no}", "Автор", f"Событие {attempt}",
+                                 date, f"{minute // 60:02d}:{minute % 60:02d}", rnd.choice(DURATIONS))
+        results[thread_no]["ok" if result else ("conflict" if result.conflict else "error")] += 1
+    close_connection()
+
+
+def find_overlaps(conn):
+    """Все пары пересекающихся бронирований (должно быть пусто)"""
+    return conn.execute("""
+        SELECT a.id, b.id FROM reservations a
+        JOIN reservations b ON a.day = b.day AND a.id < b.id
+        WHERE a.start_minute < b.end_minute AND a.end_minute > b.start_minute
+    """).fetchall()
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix="stress_booking_")
+    os.chdir(workdir)
+    # Проверка ниже ищет любые пересечения, то есть рассчитана на одно место
+    os.environ["CAPACITY"] = "1"
+
+    from db.db import init_db
+    from db.connection import get_connection
+
+    init_db()
+
+    results = [{"ok": 0, "conflict": 0, "error": 0} for _ in range(THREADS)]
+    barrier = threading.Barrier(THREADS)
+    threads = [threading.Thread(target=worker, args=(i, results, barrier)) for i in range(THREADS)]
+
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    total = {key: sum(r[key] for r in results) for key in ("ok", "conflict", "error")}
+    overlaps = find_overlaps(get_connection())
+    stored = get_connection().execute("SELECT COUNT(*) FROM reservations").fetchone()[0]
+
+    print(f"Потоков: {THREADS}, попыток: {THREADS * ATTEMPTS_PER_THREAD}, время: {elapsed:.2f} с")
+    print(f"Успешно: {total['ok']}, конфликтов: {total['conflict']}, ошибок: {total['error']}")
+    print(f"Записей в базе: {stored}, пересечений: {len(overlaps)}")
+
+    if overlaps or stored != total["ok"] or total["error"]:
+        print("❌ Нарушена атомарность бронирования")
+        sys.exit(1)
+    print("✅ Пересечений нет")
+
+
+if __name__ == "__main__":
+    main()
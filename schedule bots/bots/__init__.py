@@ -1,5 +1,24 @@
 # bots/__init__.py
-from .tgBot import main as run_telegram_bot
-from .vkBot import VkBot
+# Фронтенды загружаются при первом обращении (PEP 562): импорт bots или одного
+# из его модулей не тянет за собой telegram.ext и vk_api другого бота
+import importlib
 
-__all__ = ['run_telegram_bot', 'VkBot']
\ No newline at end of file
+_LAZY = {
+    'run_telegram_bot': ('.tgBot', 'main'),
+    'VkBot': ('.vkBot', 'VkBot'),
+}
+
+__all__ = ['run_telegram_bot', 'VkBot']
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module, attr = _LAZY[name]
+    value = getattr(importlib.import_module(module, __name__), attr)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,55 @@
+from collections import OrderedDict
+
+# Сколько пользователей Telegram обрабатывать одновременно при разборе накопленной очереди
+DRAIN_CONCURRENCY = 32
+
+# Сколько обновлений забирать у Telegram за один getUpdates (больше 100 API не отдает)
+DRAIN_BATCH = 100
+
+# Сколько последних сообщений одного пользователя ВК брать из истории диалога
+DRAIN_HISTORY = 20
+
+
+def collapse(items, key):
+    """Убирает подряд идущие повторы: пять нажатий «📌 Бронь» подряд — одно нажатие.
+
+    key возвращает None для всего, что не нажатие кнопки или меню: такой
+    текст — ответ внутри диалога (имя автора и название события могут
+    совпасть), он не схлопывается никогда.
+    """
+    result = []
+    last = None
+    for item in items:
+        current = key(item)
+        if current is None or current != last:
+            result.append(item)
+        last = current
+    return result
+
+
+def plan(items, user_of, key_of, is_view):
+    """План разбора накопленной очереди.
+
+    Обновления группируются по пользователям (порядок внутри пользователя
+    сохраняется), повторы нажатий схлопываются (collapse), а пользователи, у которых
+    есть что-то кроме просмотра (бронирование, правка, отмена), идут первыми:
+    их изменения попадут в базу раньше, чем будут отрисованы расписания.
+    Возвращает ([(user_id, [обновления]), ...], число отброшенных повторов).
+    """
+    by_user = OrderedDict()
+    for item in items:
+        by_user.setdefault(user_of(item), []).append(item)
+
+    writes, views = [], []
+    dropped = 0
+    for user_id, user_items in by_user.items():
+        kept = collapse(user_items, key_of)
+        dropped += len(user_items) - len(kept)
+        (views if all(is_view(item) for item in kept) else writes).append((user_id, kept))
+    return writes + views, dropped
+
+
+def summary(groups, dropped):
+    """Строка для лога: сколько пользователей и обновлений в плане"""
+    updates = sum(len(items) for _, items in groups)
+    return f"{len(groups)} пользователей, {updates} обновлений, схлопнуто повторов: {dropped}"
@@ -0,0 +1,93 @@
+import logging
+import queue
+import threading
+import time
+
+from db.connection import close_connection
+from metrics import histogram
+
+logger = logging.getLogger(__name__)
+
+# Размер очереди одного шарда; при переполнении чтение long poll ждет
+SHARD_QUEUE_SIZE = 1000
+
+# Раз в столько событий состояние очередей пишется в лог
+STATS_LOG_EVERY = 1000
+
+
+class ShardedDispatcher:
+    """Параллельная обработка событий по шардам пользователей.
+
+    Событие пользователя попадает в очередь шарда hash(user_id) % shards, а
+    каждый шард обслуживает один поток. Поэтому события одного
+    пользователя обрабатываются строго по порядку, а разные пользователи —
+    параллельно: медленный ответ одному не задерживает остальных.
+
+    Время ожидания в очереди пишется в гистограмму <name>.queue_wait,
+    время обработки — в <name>.shard<i>; глубина очередей — в stats().
+    """
+
+    def __init__(self, handler, shards, name="vk", queue_size=SHARD_QUEUE_SIZE):
+        self.handler = handler
+        self.name = name
+        self._queues = [queue.Queue(queue_size) for _ in range(shards)]
+        self._threads = []
+        self._max_depth = [0] * shards
+        self._processed = [0] * shards
+        self._submitted = 0
+        self._queue_wait = histogram(f"{name}.queue_wait")
+        self._latency = [histogram(f"{name}.shard{i}") for i in range(shards)]
+
+    def start(self):
+        for i, shard_queue in enumerate(self._queues):
+            thread = threading.Thread(target=self._worker, args=(i, shard_queue),
+                                      name=f"{self.name}-shard-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def shard_of(self, user_id):
+        return hash(user_id) % len(self._queues)
+
+    def submit(self, user_id, event):
+        """Ставит событие в очередь шарда пользователя (ждет, если очередь полна)"""
+        shard = self.shard_of(user_id)
+        shard_queue = self._queues[shard]
+        shard_queue.put((event, time.perf_counter()))
+        self._max_depth[shard] = max(self._max_depth[shard], shard_queue.qsize())
+
+        self._submitted += 1
+        if self._submitted % STATS_LOG_EVERY == 0:
+            logger.info(f"Очереди {self.name}: {self.stats()}")
+
+    def stop(self, timeout=5.0):
+        """Дообрабатывает поставленные события и останавливает потоки"""
+        for shard_queue in self._queues:
+            shard_queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def stats(self):
+        """Текущая и максимальная глубина очереди и число событий по шардам"""
+        return [{"depth": q.qsize(), "max_depth": self._max_depth[i], "processed": self._processed[i]}
+                for i, q in enumerate(self._queues)]
+
+    def _worker(self, shard, shard_queue):
+        latency = self._latency[shard]
+        while True:
+            item = shard_queue.get()
+            if item is None:
+                break
+            event, enqueued = item
+            started = time.perf_counter()
+            self._queue_wait.observe(started - enqueued)
+            try:
+                self.handler(event)
+            except Exception as e:
+                logger.error(f"Ошибка при обработке события в шарде {shard}: {e}")
+            finally:
+                latency.observe(time.perf_counter() - started)
+                self._processed[shard] += 1
+        # Соединение с базой у каждого потока свое (db.connection)
+        close_connection()
+
@@ -0,0 +1,321 @@
+import heapq
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+from requests.exceptions import RequestException
+from vk_api.exceptions import ApiError, ApiHttpError
+from vk_api.utils import sjson_dumps
+
+from metrics import histogram
+
+logger = logging.getLogger(__name__)
+dead_letter_logger = logging.getLogger(f"{__name__}.dead_letter")
+
+# Лимит VK для сообщества — 20 запросов в секунду; держимся чуть ниже
+SEND_RATE = 18
+SEND_BURST = 18
+
+# Повторы: не больше MAX_ATTEMPTS попыток, пауза растет от BACKOFF_BASE до BACKOFF_MAX
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+# Коды ошибок VK, после которых имеет смысл повторить запрос:
+# 1 — неизвестная ошибка, 6 — слишком много запросов в секунду, 9 — flood control,
+# 10 — внутренняя ошибка сервера
+RETRYABLE_API_ERRORS = {1, 6, 9, 10}
+
+# Сколько запросов объединять в один вызов execute (больше 25 обращений к API VK не допускает)
+BATCH_LIMIT = 25
+
+# Сколько последних недоставленных запросов держать в памяти для разбора
+DEAD_LETTERS_KEPT = 100
+
+
+class TokenBucket:
+    """Ограничитель частоты: не больше rate запросов в секунду, всплеск до capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Забирает токен; если их нет — ждет, сколько нужно"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class _Request:
+    __slots__ = ("method", "params", "user_id", "fallback", "attempts", "enqueued")
+
+    def __init__(self, method, params, user_id, fallback=None):
+        self.method = method
+        self.params = params
+        self.user_id = user_id
+        self.fallback = fallback
+        self.attempts = 0
+        self.enqueued = time.perf_counter()
+
+
+def is_retryable(error):
+    if isinstance(error, ApiError):
+        return error.code in RETRYABLE_API_ERRORS
+    return isinstance(error, (ApiHttpError, RequestException, ConnectionError, TimeoutError))
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+    """Экспоненциальная пауза со случайным разбросом (full jitter)"""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def execute_code(batch):
+    """VKScript для execute: вызывает методы пачки по порядку и возвращает массив результатов.
+
+    Вызов выполняется, только если предыдущий вызов того же пользователя
+    в пачке удался; иначе его результат — null, и запрос уйдет позже.
+    """
+    lines = []
+    last = {}  # user_id -> переменная с результатом его предыдущего вызова
+    for i, request in enumerate(batch):
+        call = f"API.{request.method}({sjson_dumps(request.params)})"
+        previous = last.get(request.user_id) if request.user_id is not None else None
+        if previous is None:
+            lines.append(f"var r{i} = {call};")
+        else:
+            lines.append(f"var r{i} = null;")
+            lines.append(f"if ({previous}) {{ r{i} = {call}; }}")
+        if request.user_id is not None:
+            last[request.user_id] = f"r{i}"
+    lines.append(f"return [{', '.join(f'r{i}' for i in range(len(batch)))}];")
+    return "\n".join(lines)
+
+
+class Outbox:
+    """Очередь исходящих запросов к VK API с отдельным потоком отправки.
+
+    Обработчики вызывают send() и сразу возвращаются. Поток отправки
+    выдерживает частоту SEND_RATE (TokenBucket), а неудачные запросы
+    повторяет с экспоненциальной паузой — не больше MAX_ATTEMPTS раз.
+    Пока запрос пользователя ждет повтора, следующие запросы этого
+    пользователя ждут за ним, чтобы сообщения не перепутались. Запрос,
+    который так и не удалось отправить, пишется в лог <module>.dead_letter.
+
+    Накопившиеся запросы (до batch штук) уходят одним вызовом execute —
+    один HTTP-запрос и один токен частоты на всю пачку. Если сам execute
+    не удался, запросы пачки отправляются по одному.
+    """
+
+    def __init__(self, call, rate=SEND_RATE, burst=SEND_BURST, max_attempts=MAX_ATTEMPTS,
+                 batch=BATCH_LIMIT, name="vk-outbox"):
+        self.call = call  # call(method, params, raw=False) — например VkApi.method
+        self.name = name
+        self.max_attempts = max_attempts
+        self.batch = max(1, min(batch, BATCH_LIMIT))
+        self.bucket = TokenBucket(rate, burst)
+        self.dead_letters = deque(maxlen=DEAD_LETTERS_KEPT)
+        self._intake = queue.SimpleQueue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats = {"sent": 0, "retried": 0, "dead": 0, "calls": 0, "batches": 0}
+        self._wait = histogram(f"{name}.wait")
+        self._latency = histogram(f"{name}.call")
+        self._batch_size = histogram(f"{name}.batch")
+        # Дальше — состояние потока отправки, другие потоки его не трогают
+        self._ready = deque()
+        self._delayed = []  # куча (срок, номер, _Request)
+        self._blocked = {}  # user_id -> (запрос на повторе, deque запросов, ждущих его)
+        self._sequence = 0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def send(self, method, params, user_id=None, fallback=None):
+        """Ставит запрос в очередь; user_id задает порядок доставки.
+
+        fallback — (method, params) запроса, который уйдет вместо этого,
+        если этот так и не удалось выполнить.
+        """
+        self._ensure_started()
+        self._intake.put(_Request(method, params, user_id, fallback))
+
+    def close(self, timeout=10.0):
+        """Дожидается отправки очереди (включая повторы) и останавливает поток"""
+        if self._thread is not None and self._thread.is_alive():
+            self._intake.put(None)
+            self._thread.join(timeout)
+
+    def stats(self):
+        return dict(self._stats, queued=self._intake.qsize(), delayed=len(self._delayed))
+
+    def _run(self):
+        stopping = False
+        while not (stopping and not self._ready and not self._delayed):
+            timeout = None
+            if self._delayed:
+                timeout = max(0.0, self._delayed[0][0] - time.monotonic())
+            if not self._ready:
+                try:
+                    request = self._intake.get(timeout=timeout)
+                except queue.Empty:
+                    request = False
+                if request is None:
+                    stopping = True
+                elif request:
+                    self._ready.append(request)
+            # Забираем все, что пришло, без ожидания
+            while True:
+                try:
+                    request = self._intake.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                else:
+                    self._ready.append(request)
+
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                self._ready.appendleft(heapq.heappop(self._delayed)[2])
+
+            batch = self._take_batch()
+            if len(batch) > 1:
+                self._deliver_batch(batch)
+            elif batch:
+                self._deliver(batch[0])
+
+    def _take_batch(self):
+        batch = []
+        while self._ready and len(batch) < self.batch:
+            request = self._ready.popleft()
+            if not self._hold(request):
+                batch.append(request)
+        return batch
+
+    def _hold(self, request):
+        # Предыдущий запрос пользователя ждет повтора — этот отправим после него
+        blocked = self._blocked.get(request.user_id)
+        if blocked is None or blocked[0] is request:
+            return False
+        blocked[1].append(request)
+        return True
+
+    def _observe_wait(self, request):
+        if request.enqueued is not None:
+            self._wait.observe(time.perf_counter() - request.enqueued)
+            request.enqueued = None
+
+    def _deliver(self, request):
+        self.bucket.acquire()
+        self._observe_wait(request)
+        self._stats["calls"] += 1
+        started = time.perf_counter()
+        try:
+            self.call(request.method, request.params)
+        except Exception as e:
+            self._latency.observe(time.perf_counter() - started)
+            self._failed(request, e)
+        else:
+            self._latency.observe(time.perf_counter() - started)
+            self._succeeded(request)
+
+    def _deliver_batch(self, batch):
+        self.bucket.acquire()
+        for request in batch:
+            self._observe_wait(request)
+        self._stats["calls"] += 1
+        started = time.perf_counter()
+        try:
+            response = self.call("execute", {"code": execute_code(batch)}, raw=True)
+            results = response["response"]
+            if len(results) != len(batch):
+                raise ValueError(f"execute вернул {len(results)} результатов вместо {len(batch)}")
+        except Exception as e:
+            self._latency.observe(time.perf_counter() - started)
+            logger.warning(f"execute на {len(batch)} запросов не выполнен ({e}), отправляем по одному")
+            for request in batch:
+                if not self._hold(request):
+                    self._deliver(request)
+            return
+        self._latency.observe(time.perf_counter() - started)
+        self._stats["batches"] += 1
+        self._batch_size.observe(len(batch))
+
+        # Ошибки вызовов внутри execute идут в execute_errors по порядку, их результат — false
+        errors = iter(response.get("execute_errors", ()))
+        skipped = []
+        for request, result in zip(batch, results):
+            if result is None:
+                skipped.append(request)
+            elif result is False:
+                error = next(errors, {"error_code": 1, "error_msg": "нет описания ошибки в execute_errors"})
+                self._failed(request, ApiError(None, request.method, request.params, False, error))
+            else:
+                self._succeeded(request)
+
+        # Не выполнены, потому что не удался предыдущий запрос того же пользователя
+        requeue = [request for request in skipped if not self._hold(request)]
+        self._ready.extendleft(reversed(requeue))
+
+    def _succeeded(self, request):
+        request.attempts += 1
+        self._stats["sent"] += 1
+        self._release(request.user_id)
+
+    def _failed(self, request, error):
+        request.attempts += 1
+        if is_retryable(error) and request.attempts < self.max_attempts:
+            delay = backoff_delay(request.attempts)
+            logger.warning(f"{request.method} для {request.user_id} не выполнен ({error}), "
+                           f"попытка {request.attempts}, повтор через {delay:.1f} с")
+            self._stats["retried"] += 1
+            self._sequence += 1
+            heapq.heappush(self._delayed, (time.monotonic() + delay, self._sequence, request))
+            if request.user_id is not None:
+                self._blocked.setdefault(request.user_id, (request, deque()))
+            return
+        if request.fallback is not None:
+            logger.warning(f"{request.method} для {request.user_id} не выполнен ({error}), "
+                           f"отправляем {request.fallback[0]}")
+            self._release(request.user_id)
+            self._ready.appendleft(_Request(*request.fallback, request.user_id))
+            return
+        self._dead_letter(request, error)
+        self._release(request.user_id)
+
+    def _release(self, user_id):
+        # Запрос пользователя завершен — его отложенные запросы идут первыми, по порядку
+        blocked = self._blocked.pop(user_id, None)
+        if blocked:
+            self._ready.extendleft(reversed(blocked[1]))
+
+    def _dead_letter(self, request, error):
+        self._stats["dead"] += 1
+        self.dead_letters.append((time.time(), request.method, request.params, repr(error)))
+        dead_letter_logger.error(json.dumps({
+            "method": request.method,
+            "user_id": request.user_id,
+            "attempts": request.attempts,
+            "error": repr(error),
+            "params": request.params,
+        }, ensure_ascii=False, default=str))
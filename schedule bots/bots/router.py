@@ -0,0 +1,179 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Маршрут действует в любом состоянии пользователя
+ANY_STATE = None
+
+
+class Message:
+    """Входящее сообщение, как его видит обработчик маршрута.
+
+    button — значение payload["button"] (если есть), arg — часть кнопки
+    после совпавшего префикса.
+    """
+
+    __slots__ = ("user_id", "text", "payload", "state", "button", "arg")
+
+    def __init__(self, user_id, text, payload, state, button=None, arg=None):
+        self.user_id = user_id
+        self.text = text
+        self.payload = payload
+        self.state = state
+        self.button = button
+        self.arg = arg
+
+
+class PrefixTrie:
+    """Префиксное дерево: поиск самого длинного зарегистрированного префикса за O(len(префикса))"""
+
+    def __init__(self):
+        self._root = {}
+
+    def add(self, prefix, value):
+        node = self._root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[None] = value
+
+    def get(self, prefix):
+        node = self._root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return None
+        return node.get(None)
+
+    def longest(self, key):
+        """(value, длина префикса) для самого длинного префикса key или (None, 0)"""
+        node = self._root
+        found, length = None, 0
+        for i, char in enumerate(key):
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                found, length = node[None], i + 1
+        return found, length
+
+
+class Router:
+    """Таблица маршрутов для входящих сообщений ВК.
+
+    Порядок разбора фиксирован и не зависит от порядка регистрации:
+
+    1. модальные состояния — пока пользователь в таком состоянии, все его
+       сообщения идут одному обработчику;
+    2. текстовые команды — точное совпадение текста;
+    3. payload["action"] — точное совпадение;
+    4. payload["button"] — сначала точное совпадение, затем самый длинный
+       префикс (edit_booking_<id>, confirm_cancel_<id>, ...);
+    5. свободный текст — по текущему состоянию;
+    6. fallback — если у пользователя нет состояния.
+
+    Действия и кнопки ищутся в таблицах (ключ, состояние): маршрут может
+    быть привязан к состояниям, тогда в остальных состояниях кнопка
+    молча игнорируется.
+    """
+
+    def __init__(self):
+        self._modal = {}
+        self._text = {}
+        self._text_ignore_case = {}
+        self._actions = {}
+        self._buttons = {}
+        self._prefixes = PrefixTrie()
+        self._states = {}
+        self._fallback = None
+
+    @staticmethod
+    def _states_of(states):
+        if states is ANY_STATE:
+            return (ANY_STATE,)
+        if isinstance(states, str):
+            return (states,)
+        return tuple(states)
+
+    @classmethod
+    def _add(cls, routes, key, handler, states):
+        for state in cls._states_of(states):
+            if state in routes:
+                raise ValueError(f"Маршрут {key!r} для состояния {state!r} уже зарегистрирован")
+            routes[state] = handler
+
+    def modal(self, state, handler, when=None):
+        """Все сообщения в состоянии state (если when(message) истинно) идут в handler"""
+        self._modal[state] = (handler, when)
+
+    def text(self, text, handler, ignore_case=False):
+        if ignore_case:
+            self._text_ignore_case[text.lower()] = handler
+        else:
+            self._text[text] = handler
+
+    def action(self, action, handler, states=ANY_STATE):
+        self._add(self._actions.setdefault(action, {}), action, handler, states)
+
+    def button(self, button, handler, states=ANY_STATE):
+        self._add(self._buttons.setdefault(button, {}), button, handler, states)
+
+    def prefix(self, prefix, handler, states=ANY_STATE):
+        routes = self._prefixes.get(prefix)
+        if routes is None:
+            routes = {}
+            self._prefixes.add(prefix, routes)
+        self._add(routes, prefix, handler, states)
+
+    def state(self, state, handler):
+        """Обработчик свободного текста в состоянии state"""
+        self._states[state] = handler
+
+    def fallback(self, handler):
+        """Обработчик сообщений пользователей без состояния, не подошедших ни к одному маршруту"""
+        self._fallback = handler
+
+    @staticmethod
+    def _for_state(routes, state):
+        handler = routes.get(state)
+        return handler if handler is not None else routes.get(ANY_STATE)
+
+    def resolve(self, user_id, text, payload, state):
+        """Находит обработчик: (handler, Message) или (None, Message)"""
+        message = Message(user_id, text, payload, state)
+
+        modal = self._modal.get(state)
+        if modal is not None:
+            handler, when = modal
+            if when is None or when(message):
+                return handler, message
+
+        handler = self._text.get(text)
+        if handler is None and self._text_ignore_case:
+            handler = self._text_ignore_case.get(text.lower())
+        if handler is not None:
+            return handler, message
+
+        if payload and "action" in payload:
+            routes = self._actions.get(payload["action"])
+            return (self._for_state(routes, state) if routes else None), message
+
+        if payload and "button" in payload:
+            button = message.button = payload["button"]
+            routes = self._buttons.get(button)
+            if routes is None:
+                routes, length = self._prefixes.longest(button)
+                message.arg = button[length:]
+            return (self._for_state(routes, state) if routes else None), message
+
+        if state is not None:
+            return self._states.get(state), message
+        return self._fallback, message
+
+    def dispatch(self, bot, user_id, text, payload, state):
+        """Вызывает handler(bot, message); возвращает False, если маршрута нет"""
+        handler, message = self.resolve(user_id, text, payload, state)
+        if handler is None:
+            logger.debug(f"[{user_id}] Нет маршрута: состояние {state}, текст {text!r}, payload {payload}")
+            return False
+        handler(bot, message)
+        return True
@@ -0,0 +1,283 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+from db.connection import connection
+from db.migrations import migrate
+from db.writer import writer
+
+logger = logging.getLogger(__name__)
+
+# Потолок памяти: сколько сессий держать одновременно (самые давние вытесняются)
+SESSION_LIMIT = 10000
+# Сессия без активности дольше этого времени (секунды) забывается
+SESSION_TTL = 24 * 60 * 60
+# Как часто измененные сессии пишутся в базу (write-behind)
+SESSION_FLUSH_INTERVAL = 5.0
+
+
+class Session:
+    """Сессия пользователя: состояние диалога и его данные"""
+
+    __slots__ = ("user_id", "state", "data", "touched", "updated_at")
+
+    def __init__(self, user_id, state=None, data=None, updated_at=None):
+        self.user_id = user_id
+        self.state = state
+        self.data = data
+        self.touched = time.monotonic()
+        self.updated_at = updated_at or time.time()
+
+    @property
+    def empty(self):
+        return self.state is None and not self.data
+
+
+def _write_sessions(cursor, table, rows, deleted, expired_before):
+    """Изменение для db.writer: сохраняет и удаляет сессии, чистит просроченные"""
+    cursor.executemany(f"""
+        INSERT INTO {table} (user_id, state, data, updated_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+    """, rows)
+    cursor.executemany(f"DELETE FROM {table} WHERE user_id = ?", [(user_id,) for user_id in deleted])
+    cursor.execute(f"DELETE FROM {table} WHERE updated_at < ?", (expired_before,))
+    return len(rows) + len(deleted), ()
+
+
+class SessionStore:
+    """Ограниченное хранилище сессий с вытеснением по LRU и TTL.
+
+    В памяти не больше limit сессий; сессия, к которой не обращались
+    дольше ttl, забывается. Если persist включен, измененные сессии
+    раз в flush_interval секунд пишутся в таблицу table (через db.writer),
+    а при первом обращении к пользователю после перезапуска сессия
+    подгружается оттуда — начатое бронирование переживает ночную остановку.
+
+    Для кода бота хранилище выглядит как два словаря: states (user_id ->
+    состояние) и data (user_id -> словарь данных).
+    """
+
+    def __init__(self, table, limit=SESSION_LIMIT, ttl=SESSION_TTL, persist=True,
+                 flush_interval=SESSION_FLUSH_INTERVAL):
+        self.table = table
+        self.limit = limit
+        self.ttl = ttl
+        self.persist = persist
+        self.flush_interval = flush_interval
+        self._sessions = OrderedDict()
+        self._dirty = {}  # user_id -> Session; None — удалить из базы
+        self._flushing = {}  # то же для изменений, которые пишутся прямо сейчас
+        self._lock = threading.RLock()
+        self._flusher = None
+        self._stop = threading.Event()
+        self._stats = {"loads": 0, "evictions": 0, "expirations": 0, "flushes": 0}
+        self.states = SessionView(self, "state")
+        self.data = SessionView(self, "data")
+
+    def session(self, user_id):
+        """Сессия пользователя (пустая, если ее не было); обновляет время обращения"""
+        with self._lock:
+            session = self._lookup(user_id)
+            if session is not None:
+                return session
+            pending = self._dirty if user_id in self._dirty else self._flushing
+            if user_id in pending:
+                # Сессия вытеснена, но еще не записана (или удалена) — база ее не знает
+                session = pending[user_id] or Session(user_id)
+                session.touched = time.monotonic()
+                self._sessions[user_id] = session
+                self._evict()
+                return session
+
+        loaded = self._load(user_id) if self.persist else None
+
+        with self._lock:
+            # Пока читали базу, сессию мог создать другой поток
+            session = self._lookup(user_id)
+            if session is None:
+                session = loaded or Session(user_id)
+                self._sessions[user_id] = session
+                self._evict()
+            return session
+
+    def mark_dirty(self, session):
+        if not self.persist:
+            return
+        with self._lock:
+            self._dirty[session.user_id] = session
+        self._ensure_flusher()
+
+    def _lookup(self, user_id):
+        session = self._sessions.get(user_id)
+        if session is None:
+            return None
+        now = time.monotonic()
+        if now - session.touched > self.ttl:
+            self._expire(session)
+            return None
+        session.touched = now
+        self._sessions.move_to_end(user_id)
+        return session
+
+    def _expire(self, session):
+        del self._sessions[session.user_id]
+        self._stats["expirations"] += 1
+        if self.persist:
+            self._dirty[session.user_id] = None
+
+    def _evict(self):
+        # Сначала просроченные (они в начале: порядок — по времени обращения), затем сверх лимита
+        now = time.monotonic()
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.touched <= self.ttl:
+                break
+            self._expire(oldest)
+        while len(self._sessions) > self.limit:
+            # Несохраненные изменения вытесненной сессии остаются в _dirty и будут записаны
+            self._sessions.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _load(self, user_id):
+        migrate()
+        with connection() as conn:
+            row = conn.execute(f"SELECT state, data, updated_at FROM {self.table} WHERE user_id = ?",
+                               (user_id,)).fetchone()
+        if row is None or row[2] < time.time() - self.ttl:
+            return None
+        with self._lock:
+            self._stats["loads"] += 1
+        return Session(user_id, row[0], json.loads(row[1]) if row[1] else None, row[2])
+
+    def _ensure_flusher(self):
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if (self._flusher is None or not self._flusher.is_alive()) and not self._stop.is_set():
+                self._flusher = threading.Thread(target=self._flush_loop, name=f"{self.table}-flush", daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка сохранения сессий {self.table}: {e}")
+
+    def flush(self):
+        """Пишет накопленные изменения сессий в базу одной транзакцией"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            self._flushing = dirty
+        if not dirty:
+            return 0
+
+        rows, deleted, retry = [], [], {}
+        for user_id, session in dirty.items():
+            if session is None or session.empty:
+                deleted.append(user_id)
+                continue
+            try:
+                data = json.dumps(session.data, ensure_ascii=False, default=str) if session.data else None
+            except RuntimeError:
+                # Словарь меняется в потоке шарда прямо сейчас — запишем в следующий раз
+                retry[user_id] = session
+                continue
+            rows.append((user_id, session.state, data, session.updated_at))
+
+        try:
+            written = writer.execute(_write_sessions, self.table, rows, deleted, time.time() - self.ttl)
+        except Exception:
+            retry = dirty
+            raise
+        finally:
+            with self._lock:
+                for user_id, session in retry.items():
+                    self._dirty.setdefault(user_id, session)
+                self._flushing = {}
+        with self._lock:
+            self._stats["flushes"] += 1
+        return written
+
+    def close(self):
+        """Останавливает фоновую запись и сохраняет оставшиеся изменения.
+
+        После close хранилищем можно пользоваться снова (следующий рабочий
+        день резидентного процесса): поток записи запустится при первом изменении.
+        """
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        if self.persist:
+            self.flush()
+        with self._lock:
+            self._flusher = None
+            self._stop.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, size=len(self._sessions), dirty=len(self._dirty))
+
+
+class SessionView(MutableMapping):
+    """Словарь user_id -> поле сессии (state или data) поверх SessionStore.
+
+    Ключ присутствует, если поле не None. Значение data изменяется на месте
+    (user_data[user_id]["month"] = ...), поэтому любое чтение data помечает
+    сессию измененной.
+    """
+
+    def __init__(self, store, field):
+        self._store = store
+        self._field = field
+        self._mark_on_read = field == "data"
+
+    def __getitem__(self, user_id):
+        session = self._store.session(user_id)
+        value = getattr(session, self._field)
+        if value is None:
+            raise KeyError(user_id)
+        if self._mark_on_read:
+            session.updated_at = time.time()
+            self._store.mark_dirty(session)
+        return value
+
+    def __setitem__(self, user_id, value):
+        session = self._store.session(user_id)
+        setattr(session, self._field, value)
+        session.updated_at = time.time()
+        self._store.mark_dirty(session)
+
+    def __delitem__(self, user_id):
+        session = self._store.session(user_id)
+        if getattr(session, self._field) is None:
+            raise KeyError(user_id)
+        setattr(session, self._field, None)
+        session.updated_at = time.time()
+        self._store.mark_dirty(session)
+
+    def __contains__(self, user_id):
+        return getattr(self._store.session(user_id), self._field) is not None
+
+    def get(self, user_id, default=None):
+        try:
+            return self[user_id]
+        except KeyError:
+            return default
+
+    def __iter__(self):
+        # Только сессии в памяти; перебор идет по снимку
+        with self._store._lock:
+            sessions = list(self._store._sessions.values())
+        return iter([s.user_id for s in sessions if getattr(s, self._field) is not None])
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+# Сессии ВК-бота: user_states и user_data в bots.vkBot
+vk_sessions = SessionStore("vk_sessions")
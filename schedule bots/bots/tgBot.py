@@ -1,11 +1,13 @@
 import logging
 import asyncio
+import re
+import time
 from telegram.ext import (
     Application, CommandHandler, ConversationHandler, MessageHandler, CallbackQueryHandler, filters
 )
 from bots.tgHandlers import (
     start, start_reservation, about, month_callback, day_callback,
-    hour_callback, minute_callback, my_reservations, all_reservations,
+    hour_callback, minute_callback, suggestion_callback, my_reservations, all_reservations,
     get_author_name, get_event_name,
     edit_reservation, edit_month_callback, edit_day_callback, edit_hour_callback, edit_minute_callback,
     edit_author, edit_event, save_edit, DATE, HOUR_SELECTION, MINUTE_SELECTION,
@@ -13,8 +15,13 @@ from bots.tgHandlers import (
     edit_duration, save_duration, book_table, cancel_confirmation, confirm_cancel, select_day_callback, SELECT_MONTH,
     SELECT_DAY, month_for_view_callback, day_for_view_callback,
 )
+from bots import backlog
+from bots.tgPersistence import SQLitePersistence
 from db.db import init_db
-from config import TGTOKEN
+from db.repository import repository
+from db.writer import writer
+from config import TGTOKEN, BACKLOG_DRAIN
+from metrics import report, watch_event_loop
 
 
 logging.basicConfig(
@@ -23,6 +30,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Раз в столько секунд гистограммы задержек пишутся в лог
+METRICS_LOG_INTERVAL = 300
+
+# Обновления-просмотры: при разборе накопленной очереди такие пользователи идут последними
+VIEW_TEXTS = {'📆 Общее расписание', '📅 Мои бронирования', 'ℹ️ О боте', '/start', '/reservations'}
+VIEW_CALLBACK = re.compile(r'^select_(month|day)_\d+$')
+# Кнопки главного меню и команды: их повторы подряд схлопываются при разборе очереди
+MENU_TEXTS = VIEW_TEXTS | {'📌 Бронь', '/book'}
+
 def setup_handlers(app):
     """Настройка всех обработчиков для приложения"""
     # Обработчик бронирования через команду /book
@@ -36,7 +52,8 @@ def setup_handlers(app):
             DATE: [CallbackQueryHandler(month_callback, pattern=r'^month_'),
                    CallbackQueryHandler(day_callback, pattern=r'^day_')],
             HOUR_SELECTION: [CallbackQueryHandler(hour_callback, pattern=r'^hour_')],
-            MINUTE_SELECTION: [CallbackQueryHandler(minute_callback, pattern=r'^minute_')],
+            MINUTE_SELECTION: [CallbackQueryHandler(minute_callback, pattern=r'^minute_'),
+                               CallbackQueryHandler(suggestion_callback, pattern=r'^suggest_')],
             DURATION_SELECTION: [MessageHandler(filters.Regex(r'^\d+$'), save_duration)],
             AUTHOR_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_author_name)],
             EVENT_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_event_name)],
@@ -44,7 +61,9 @@ def setup_handlers(app):
         fallbacks=[CommandHandler("cancel", start),
                    MessageHandler(filters.Regex("^Отмена$"), start)],
         per_chat=True,
-        per_user=True
+        per_user=True,
+        name="booking",
+        persistent=True
     )
 
     view_schedule_handler = ConversationHandler(
@@ -56,7 +75,9 @@ def setup_handlers(app):
         fallbacks=[CommandHandler("cancel", start),
                    MessageHandler(filters.Regex("^Отмена$"), start)],
         per_chat=True,
-        per_user=True
+        per_user=True,
+        name="view_schedule",
+        persistent=True
     )
 
     # Обработчик редактирования бронирования
@@ -96,7 +117,9 @@ def setup_handlers(app):
             MessageHandler(filters.Regex("^Отмена$"), cancel_edit)
         ],
         per_chat=True,
-        per_user=True
+        per_user=True,
+        name="edit_booking",
+        persistent=True
     )
 
     # Добавляем обработчики
@@ -118,26 +141,97 @@ def setup_handlers(app):
     app.add_handler(MessageHandler(filters.Regex(r'^📅 Мои бронирования$'), my_reservations))
     app.add_handler(MessageHandler(filters.Regex(r'^📆 Общее расписание$'), all_reservations))
 
-async def run_bot():
-    """Основная асинхронная функция для запуска бота"""
+def _user_of(update):
+    return update.effective_user.id if update.effective_user else -update.update_id
+
+def _key_of(update):
+    """Какую кнопку нажал пользователь; None для текста, введенного в диалоге (не схлопывается)"""
+    if update.callback_query:
+        return "callback", update.callback_query.data
+    if update.message and update.message.text in MENU_TEXTS:
+        return "text", update.message.text
+    return None
+
+def _is_view(update):
+    if update.callback_query:
+        return bool(VIEW_CALLBACK.match(update.callback_query.data or ""))
+    return update.message is not None and update.message.text in VIEW_TEXTS
+
+async def drain_backlog(app):
+    """Разбирает обновления, накопленные, пока бот был выключен (bots.backlog).
+
+    Обновления забираются пачками по DRAIN_BATCH до пустого ответа (каждый
+    следующий getUpdates подтверждает предыдущую пачку), затем обрабатываются
+    по плану: пользователи параллельно (до DRAIN_CONCURRENCY), обновления
+    одного пользователя — по порядку.
+    """
+    started = time.perf_counter()
+    updates, offset = [], None
+    while True:
+        batch = await app.bot.get_updates(offset=offset, limit=backlog.DRAIN_BATCH, timeout=0)
+        if not batch:
+            break
+        updates.extend(batch)
+        offset = batch[-1].update_id + 1
+    if not updates:
+        return
+
+    groups, dropped = backlog.plan(updates, _user_of, _key_of, _is_view)
+    logger.info(f"Накопленная очередь: {backlog.summary(groups, dropped)}")
+    slots = asyncio.Semaphore(backlog.DRAIN_CONCURRENCY)
+
+    async def drain_user(user_updates):
+        async with slots:
+            for update in user_updates:
+                try:
+                    await app.process_update(update)
+                except Exception as e:
+                    logger.error(f"Ошибка при разборе обновления {update.update_id}: {e}")
+
+    await asyncio.gather(*(drain_user(user_updates) for _, user_updates in groups))
+    logger.info(f"Накопленная очередь разобрана за {time.perf_counter() - started:.2f} с")
+
+async def run_bot(stop=None, ready=None):
+    """Основная асинхронная функция для запуска бота.
+
+    stop — asyncio.Event: когда он установлен, бот перестает принимать
+    обновления, дожидается обработчиков и сохраняет диалоги. ready
+    устанавливается, когда бот разобрал накопленную очередь (BACKLOG_DRAIN,
+    см. drain_backlog) и начал получать обновления. Потоки базы
+    (repository, writer) закрывает вызывающий.
+    """
     init_db()  # Инициализируем базу данных
 
-    app = Application.builder().token(TGTOKEN).build()
+    # Диалоги и user_data переживают перезапуск (см. bots.tgPersistence)
+    app = Application.builder().token(TGTOKEN).persistence(SQLitePersistence()).build()
     setup_handlers(app)
 
     logger.info("Бот запускается...")
     await app.initialize()
     await app.start()
+    if BACKLOG_DRAIN:
+        await drain_backlog(app)
     await app.updater.start_polling()
+    if ready is not None:
+        ready.set()
+
+    # Задержка цикла событий: показывает, не блокируют ли его обработчики
+    lag_watcher = asyncio.create_task(watch_event_loop("tg.event_loop_lag"))
 
     try:
-        # Бесконечный цикл ожидания
-        while True:
+        # Цикл ожидания до сигнала остановки
+        seconds = 0
+        while stop is None or not stop.is_set():
             await asyncio.sleep(1)
+            seconds += 1
+            if seconds % METRICS_LOG_INTERVAL == 0:
+                logger.info(f"Задержки:\n{report()}")
     except asyncio.CancelledError:
         pass
     finally:
         logger.info("Остановка бота...")
+        lag_watcher.cancel()
+        # Сначала перестаем получать обновления, затем ждем обработчики и сохраняем диалоги
         await app.updater.stop()
         await app.stop()
         await app.shutdown()
@@ -149,6 +243,9 @@ def main():
         logger.info("Бот остановлен по запросу пользователя")
     except Exception as e:
         logger.error(f"Ошибка при работе бота: {e}")
+    finally:
+        repository.close()
+        writer.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,13 +1,14 @@
 import re
-import sqlite3
 
-from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 import logging
 from calendar import monthrange
 from telegram.ext import ConversationHandler, CallbackContext
-from db.db import add_reservation, get_reservations_for_user, \
-    update_reservation, get_db_connection, get_reservations_for_date, save_reservation, delete_reservation, \
+from db.db import get_db_connection, get_reservations_for_date, \
     is_time_available, is_valid_time
+from db.repository import repository
+from db.timeslots import time_to_minutes, minutes_to_time
+from bots import tgKeyboards
 from datetime import datetime, timedelta
 
 logging.basicConfig(level=logging.INFO)
@@ -24,15 +25,9 @@ MINUTES = ["00", "15", "30", "45"]
 DAYS = [f"{i:02d}" for i in range(1, 32)]  # Дни месяца от 01 до 31
 
 async def start(update: Update, context: CallbackContext):
-    # Обновленная главная клавиатура с двумя разными кнопками для расписаний
-    keyboard = [
-        ['📆 Общее расписание', '📅 Мои бронирования'],
-        ['📌 Бронь', 'ℹ️ О боте']
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
+    # Главная клавиатура с двумя разными кнопками для расписаний (собрана один раз)
     await update.message.reply_text("Привет! Я бот для управления расписанием. Выберите действие:",
-                                    reply_markup=reply_markup)
+                                    reply_markup=tgKeyboards.MAIN)
 
 async def edit_date(update: Update, context: CallbackContext):
     query = update.callback_query
@@ -41,12 +36,7 @@ async def edit_date(update: Update, context: CallbackContext):
     # Указываем, что редактируем дату
     context.user_data["edit_field"] = "date"
 
-    months_keyboard = [
-        [InlineKeyboardButton(f"{i:02d}", callback_data=f"edit_month_{i:02d}") for i in range(j, j + 4)]
-        for j in range(1, 13, 4)
-    ]
-    reply_markup = InlineKeyboardMarkup(months_keyboard)
-    await query.edit_message_text("📅 Выберите новый месяц:", reply_markup=reply_markup)
+    await query.edit_message_text("📅 Выберите новый месяц:", reply_markup=tgKeyboards.months("edit_month"))
 
     return DATE
 
@@ -54,13 +44,7 @@ async def start_reservation(update: Update, context: CallbackContext):
     """Запускает процесс бронирования, предлагает выбрать месяц."""
     context.user_data["year"] = str(datetime.now().year)  # Устанавливаем текущий год
 
-    months_keyboard = [
-        [InlineKeyboardButton(f"{i:02d}", callback_data=f"month_{i:02d}") for i in range(j, j + 4)]
-        for j in range(1, 13, 4)
-    ]
-
-    reply_markup = InlineKeyboardMarkup(months_keyboard)
-    await update.message.reply_text("📅 Выберите месяц:", reply_markup=reply_markup)
+    await update.message.reply_text("📅 Выберите месяц:", reply_markup=tgKeyboards.months("month"))
     return DATE  # Остаемся в состоянии DATE для выбора месяца
 
 
@@ -78,16 +62,19 @@ async def month_callback(update: Update, context: CallbackContext):
         # Получаем количество дней в месяце
         days_in_month = monthrange(year, month)[1]
 
-        # Генерируем кнопки для дней месяца
-        days_keyboard = [
-            [InlineKeyboardButton(f"{i:02d}", callback_data=f"day_{i:02d}") for i in
-             range(j, min(j + 4, days_in_month + 1))]
-            for j in range(1, days_in_month + 1, 4)
-        ]
-        reply_markup = InlineKeyboardMarkup(days_keyboard)
+        # Занятость всех дней месяца одним запросом; полностью занятые дни помечаем
+        occupancy = await repository.month_occupancy(year, month)
+
+        def day_button(i):
+            if occupancy[i].fully_booked:
+                return f"🔴{i:02d}", f"day_full_{i:02d}"
+            return f"{i:02d}", f"day_{i:02d}"
+
+        # Кнопки дней месяца; одинаковая занятость — та же клавиатура из кэша
+        reply_markup = tgKeyboards.days(tuple(day_button(i) for i in range(1, days_in_month + 1)))
 
         # Отправляем сообщение с выбором дня
-        await query.edit_message_text("📅 Выберите день:", reply_markup=reply_markup)
+        await query.edit_message_text("📅 Выберите день (🔴 — день полностью занят):", reply_markup=reply_markup)
 
     except Exception as e:
         logger.error(f"Ошибка при обработке месяца: {e}")
@@ -98,6 +85,12 @@ async def month_callback(update: Update, context: CallbackContext):
 async def day_callback(update: Update, context: CallbackContext):
     """Обрабатывает выбор дня и отображает расписание для этого дня."""
     query = update.callback_query
+
+    # Полностью занятый день выбрать нельзя, остаемся на выборе дня
+    if query.data.startswith("day_full_"):
+        await query.answer("❌ Этот день уже полностью занят. Выберите другой день.", show_alert=True)
+        return DATE
+
     await query.answer()
 
     # Получаем выбранный день
@@ -145,15 +138,9 @@ async def hour_callback(update: Update, context: CallbackContext):
     hour = query.data.split('_')[1]
     context.user_data["hour"] = hour
 
-    # Создаем клавиатуру для выбора минут в одном ряду
-    keyboard = [[
-        InlineKeyboardButton(minute, callback_data=f"minute_{minute}")
-        for minute in MINUTES
-    ]]
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await query.edit_message_text(f"Выбран час: {hour}. Теперь выберите минуты:", reply_markup=reply_markup)
+    # Клавиатура для выбора минут в одном ряду
+    await query.edit_message_text(f"Выбран час: {hour}. Теперь выберите минуты:",
+                                  reply_markup=tgKeyboards.minutes_row("minute"))
     return MINUTE_SELECTION
 
 async def select_day_callback(update, context):
@@ -193,17 +180,9 @@ async def minute_callback(update: Update, context: CallbackContext):
 
         # Проверяем допустимые значения минут (только 00, 15, 30, 45)
         if minute not in ["00", "15", "30", "45"]:
-            keyboard = [
-                [InlineKeyboardButton("00", callback_data="minute_00"),
-                 InlineKeyboardButton("15", callback_data="minute_15")],
-                [InlineKeyboardButton("30", callback_data="minute_30"),
-                 InlineKeyboardButton("45", callback_data="minute_45")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
             await query.edit_message_text(
                 "❌ Пожалуйста, выберите минуты из предложенных вариантов:",
-                reply_markup=reply_markup
+                reply_markup=tgKeyboards.MINUTES_GRID
             )
             return MINUTE_SELECTION
 
@@ -224,48 +203,31 @@ async def minute_callback(update: Update, context: CallbackContext):
         time = f"{int(hour):02d}:{minute}"
         context.user_data["time"] = time
 
-        # Проверяем доступность времени
-        reservations = get_reservations_for_date(date)
+        # Проверяем доступность времени по индексу занятых интервалов дня
+        reservations = await repository.day_intervals(date)
 
         # Преобразуем время с правильным форматом
         try:
-            start_time = datetime.strptime(time, "%H:%M")
+            start_time = time_to_minutes(time)
             duration = context.user_data.get("duration", 60)
-            end_time = start_time + timedelta(minutes=duration)
+            end_time = start_time + duration
         except ValueError as e:
             logger.error(f"Time format error: {time} - {str(e)}")
             await query.edit_message_text("❌ Ошибка формата времени. Попробуйте еще раз.")
             return MINUTE_SELECTION
 
-        is_available = True
-        for res in reservations:
-            res_time = res[2]  # предполагаем формат "HH:MM"
-
-            # Проверяем формат времени бронирования
-            if not re.match(r'^\d{2}:\d{2}$', res_time):
-                continue
-
-            try:
-                res_start = datetime.strptime(res_time, "%H:%M")
-                res_duration = int(res[3]) if len(res) > 3 else 60
-                res_end = res_start + timedelta(minutes=res_duration)
-
-                if not (end_time <= res_start or start_time >= res_end):
-                    is_available = False
-                    break
-            except ValueError as e:
-                logger.error(f"Invalid reservation time format: {res_time} - {str(e)}")
-                continue
+        is_available = reservations.is_free(start_time, end_time)
 
         if not is_available:
-            nearest_time = find_nearest_available_time(time, duration, reservations)
-            if nearest_time:
-                context.user_data["time"] = nearest_time
+            # Предлагаем несколько ближайших свободных вариантов, в том числе в следующие дни
+            suggestions = await repository.suggest_slots(date, start_time, duration, not_before=datetime.now())
+            if suggestions:
                 await query.edit_message_text(
                     f"⚠️ Время {time} уже занято.\n"
-                    f"🔄 Автоматически выбрано ближайшее доступное время: {nearest_time}\n"
-                    "Теперь укажите длительность мероприятия (в минутах):"
+                    "🔄 Ближайшие свободные варианты:",
+                    reply_markup=suggestions_keyboard(suggestions)
                 )
+                return MINUTE_SELECTION
             else:
                 await query.edit_message_text(
                     f"⚠️ Время {time} уже занято и нет доступных слотов.\n"
@@ -285,6 +247,37 @@ async def minute_callback(update: Update, context: CallbackContext):
         await query.edit_message_text("❌ Произошла ошибка. Пожалуйста, попробуйте еще раз.")
         return MINUTE_SELECTION
 
+def suggestions_keyboard(suggestions):
+    """Кнопки с предложенными вариантами (date, start_minute)"""
+    keyboard = []
+    for date, start in suggestions:
+        time = minutes_to_time(start)
+        day_label = datetime.strptime(date, "%Y-%m-%d").strftime("%d.%m")
+        keyboard.append([InlineKeyboardButton(f"📅 {day_label} в {time}", callback_data=f"suggest_{date}_{time}")])
+    return InlineKeyboardMarkup(keyboard)
+
+async def suggestion_callback(update: Update, context: CallbackContext):
+    """Принимает вариант, предложенный вместо занятого времени"""
+    query = update.callback_query
+    await query.answer()
+
+    _, date, time = query.data.split("_", 2)
+    year, month, day = date.split("-")
+    context.user_data.update({
+        "year": year,
+        "month": month,
+        "day": day,
+        "date": date,
+        "hour": time.split(":")[0],
+        "time": time,
+    })
+
+    await query.edit_message_text(
+        f"✅ Вы выбрали {day}.{month}.{year} в {time}\n"
+        "Теперь укажите длительность мероприятия (в минутах):"
+    )
+    return DURATION_SELECTION
+
 async def get_author_name(update: Update, context: CallbackContext):
     """Запрашивает имя пользователя."""
     author_name = update.message.text.strip()
@@ -311,8 +304,15 @@ async def get_event_name(update: Update, context: CallbackContext):
     if time.count(":") == 2:
         time = ":".join(time.split(":")[:2])
 
-    if add_reservation(user_id, username, author_name, event_name, date, time, duration):
+    result = await repository.add_reservation(user_id, username, author_name, event_name, date, time, duration)
+    if result:
         await update.message.reply_text("✅ Бронирование успешно добавлено!")
+    elif result.conflict:
+        conflict = result.conflict
+        await update.message.reply_text(
+            f"⚠️ Это время пересекается с «{conflict['event_name']}» "
+            f"({format_time_range(conflict['time'], conflict['duration'] or 60)}), попробуйте другое."
+        )
     else:
         await update.message.reply_text("⚠️ Это время уже занято, попробуйте другое.")
 
@@ -351,7 +351,7 @@ def format_reservations_list(reservations):
 
 async def my_reservations(update: Update, context: CallbackContext):
     user_id = update.message.from_user.id
-    bookings = get_reservations_for_user(user_id)
+    bookings = await repository.get_reservations_for_user(user_id)
 
     if bookings:
         text = "Ваши бронирования:\n"
@@ -407,7 +407,7 @@ async def confirm_cancel(update: Update, context: CallbackContext):
     # ✅ Проверяем, что ID бронирования корректный
     print(f"Удаление бронирования ID: {reservation_id}")
 
-    success = delete_reservation(reservation_id)
+    success = await repository.delete_reservation(reservation_id)
 
     if success:
         await query.edit_message_text("✅ Бронирование успешно отменено.")
@@ -419,13 +419,8 @@ async def all_reservations(update: Update, context: CallbackContext):
     """Запрашивает месяц для просмотра общего расписания."""
     context.user_data["view_year"] = str(datetime.now().year)  # Устанавливаем текущий год
 
-    months_keyboard = [
-        [InlineKeyboardButton(f"{i:02d}", callback_data=f"select_month_{i:02d}") for i in range(j, j + 4)]
-        for j in range(1, 13, 4)
-    ]
-
-    reply_markup = InlineKeyboardMarkup(months_keyboard)
-    await update.message.reply_text("📅 Выберите месяц для просмотра расписания:", reply_markup=reply_markup)
+    await update.message.reply_text("📅 Выберите месяц для просмотра расписания:",
+                                    reply_markup=tgKeyboards.months("select_month"))
     return SELECT_MONTH
 
 
@@ -443,16 +438,24 @@ async def month_for_view_callback(update: Update, context: CallbackContext):
         # Получаем количество дней в месяце
         days_in_month = monthrange(year, month)[1]
 
-        # Генерируем кнопки для дней месяца
-        days_keyboard = [
-            [InlineKeyboardButton(f"{i:02d}", callback_data=f"select_day_{i:02d}") for i in
-             range(j, min(j + 4, days_in_month + 1))]
-            for j in range(1, days_in_month + 1, 4)
-        ]
-        reply_markup = InlineKeyboardMarkup(days_keyboard)
+        # Занятость всех дней месяца одним запросом
+        occupancy = await repository.month_occupancy(year, month)
+
+        def day_label(i):
+            if occupancy[i].fully_booked:
+                return f"🔴{i:02d}"
+            if occupancy[i].bookings:
+                return f"🟡{i:02d}"
+            return f"{i:02d}"
+
+        # Кнопки дней месяца (просматривать можно и занятые дни)
+        reply_markup = tgKeyboards.days(tuple((day_label(i), f"select_day_{i:02d}")
+                                              for i in range(1, days_in_month + 1)))
 
         # Отправляем сообщение с выбором дня
-        await query.edit_message_text("📅 Выберите день для просмотра расписания:", reply_markup=reply_markup)
+        await query.edit_message_text("📅 Выберите день для просмотра расписания:\n"
+                                      "🟡 — есть бронирования, 🔴 — день полностью занят",
+                                      reply_markup=reply_markup)
 
     except Exception as e:
         logger.error(f"Ошибка при обработке месяца для просмотра: {e}")
@@ -478,17 +481,6 @@ async def day_for_view_callback(update: Update, context: CallbackContext):
     selected_date = f"{year}-{month}-{day}"
 
     try:
-        # Подключаемся к БД
-        with sqlite3.connect('reservations.db') as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT author_name, event_name, time, duration 
-                FROM reservations 
-                WHERE date = ?
-                ORDER BY time
-            """, (selected_date,))
-            reservations = cursor.fetchall()
-
         # Функция для правильного экранирования MarkdownV2
         def escape_md(text):
             if not text:
@@ -496,80 +488,65 @@ async def day_for_view_callback(update: Update, context: CallbackContext):
             escape_chars = r'_*[]()~`>#+-=|{}.!'
             return re.sub(f'([{re.escape(escape_chars)}])', r'\\\1', str(text))
 
-        # Если бронирований нет
-        if not reservations:
-            await query.edit_message_text(
-                escape_md(f"📅 На {day}.{month}.{year} нет бронирований"),
-                parse_mode="MarkdownV2"
-            )
-            return ConversationHandler.END
-
-        # Формируем список временных слотов
-        time_slots = [
-            "05:00", "05:30", "06:00", "06:30", "07:00", "07:30",
-            "08:00", "08:30", "09:00", "09:30", "10:00", "10:30",
-            "11:00", "11:30", "12:00", "12:30", "13:00", "13:30",
-            "14:00", "14:30", "15:00", "15:30", "16:00", "16:30",
-            "17:00", "17:30", "18:00", "18:30", "19:00", "19:30"
-        ]
-
-        # Собираем информацию о занятости слотов
-        schedule = []
-        for slot in time_slots:
-            slot_time = datetime.strptime(slot, "%H:%M").time()
-            slot_info = {
-                "time": slot,
-                "status": "🟩 СВОБОДНО",
-                "events": []
-            }
-
-            for author, event, time_str, duration in reservations:
-                try:
-                    start = datetime.strptime(time_str, "%H:%M").time()
-                    end = (datetime.combine(datetime.today(), start) +
-                           timedelta(minutes=int(duration or 60))).time()
+        def render(rows):
+            # Если бронирований нет
+            if not rows:
+                return escape_md(f"📅 На {day}.{month}.{year} нет бронирований")
+
+            reservations = [(res[2], res[3], res[7], res[8]) for res in rows]
+
+            # Временные слоты каждые 30 минут с 05:00 до 19:30 (в минутах от полуночи)
+            time_slots = range(5 * 60, 20 * 60, 30)
 
+            # Собираем информацию о занятости слотов
+            schedule = []
+            for slot_time in time_slots:
+                slot_info = {
+                    "time": minutes_to_time(slot_time),
+                    "status": "🟩 СВОБОДНО",
+                    "events": []
+                }
+
+                for author, event, start, end in reservations:
                     if start <= slot_time < end:
                         slot_info["status"] = "🟥 ЗАНЯТО"
                         slot_info["events"].append(
                             escape_md(f"{event} ({author})")
                         )
 
-                except Exception as e:
-                    logger.error(f"Ошибка обработки времени: {e}")
-                    continue
-
-            schedule.append(slot_info)
+                schedule.append(slot_info)
 
-        # Формируем сообщение
-        message_parts = []
-        message_parts.append(escape_md(f"📅 Расписание на {day}.{month}.{year}:"))
-        message_parts.append("")
+            # Формируем сообщение
+            message_parts = []
+            message_parts.append(escape_md(f"📅 Расписание на {day}.{month}.{year}:"))
+            message_parts.append("")
 
-        # Группируем по 2 слота в строку
-        for i in range(0, len(schedule), 2):
-            slot1 = schedule[i]
-            line = f"{escape_md(slot1['time'])} {escape_md(slot1['status'])}"
+            # Группируем по 2 слота в строку
+            for i in range(0, len(schedule), 2):
+                slot1 = schedule[i]
+                line = f"{escape_md(slot1['time'])} {escape_md(slot1['status'])}"
 
-            if i + 1 < len(schedule):
-                slot2 = schedule[i + 1]
-                line += f" \\| {escape_md(slot2['time'])} {escape_md(slot2['status'])}"
+                if i + 1 < len(schedule):
+                    slot2 = schedule[i + 1]
+                    line += f" \\| {escape_md(slot2['time'])} {escape_md(slot2['status'])}"
 
-            message_parts.append(line)
+                message_parts.append(line)
 
-            if slot1['events']:
-                message_parts.append("• " + "\n• ".join(slot1['events']))
+                if slot1['events']:
+                    message_parts.append("• " + "\n• ".join(slot1['events']))
 
-            if i + 1 < len(schedule) and slot2['events']:
-                message_parts.append("• " + "\n• ".join(slot2['events']))
+                if i + 1 < len(schedule) and slot2['events']:
+                    message_parts.append("• " + "\n• ".join(slot2['events']))
 
-        # Отправляем сообщение (не более 4096 символов)
-        full_message = "\n".join(message_parts)
-        if len(full_message) > 4000:  # Оставляем запас
-            full_message = full_message[:4000] + "\n..."  # Обрезаем если слишком длинное
+            # Сообщение не длиннее 4096 символов
+            full_message = "\n".join(message_parts)
+            if len(full_message) > 4000:  # Оставляем запас
+                full_message = full_message[:4000] + "\n..."  # Обрезаем если слишком длинное
+            return full_message
 
+        # Бронирования дня и готовый текст берутся из общего кэша расписаний (в потоке базы)
         await query.edit_message_text(
-            full_message,
+            await repository.rendered_schedule(selected_date, "tg_day_view", render),
             parse_mode="MarkdownV2"
         )
 
@@ -591,16 +568,7 @@ async def edit_reservation(update: Update, context: CallbackContext) -> int:
     # Сохраняем его в user_data
     context.user_data["reservation_id"] = reservation_id
 
-    keyboard = [
-        [InlineKeyboardButton("📅 Изменить дату", callback_data="edit_date")],
-        [InlineKeyboardButton("⏰ Изменить время", callback_data="edit_time")],
-        [InlineKeyboardButton("👤 Изменить имя", callback_data="edit_author")],
-        [InlineKeyboardButton("📌 Изменить событие", callback_data="edit_event")],
-        [InlineKeyboardButton("❌ Отмена", callback_data="edit_cancel")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await query.message.reply_text("Что вы хотите изменить?", reply_markup=reply_markup)
+    await query.message.reply_text("Что вы хотите изменить?", reply_markup=tgKeyboards.EDIT_MENU)
     return EDIT_SELECTION  # Возвращаем состояние выбора редактирования
 
 async def edit_time(update: Update, context: CallbackContext):
@@ -610,13 +578,8 @@ async def edit_time(update: Update, context: CallbackContext):
     # Указываем, что редактируем время
     context.user_data["edit_field"] = "time"
 
-    time_keyboard = [
-        [InlineKeyboardButton(hour, callback_data=f"edit_hour_{hour}") for hour in HOURS[i:i + 4]]
-        for i in range(0, len(HOURS), 4)
-    ]
-    reply_markup = InlineKeyboardMarkup(time_keyboard)
-
-    await query.edit_message_text("⏰ Выберите новый час:", reply_markup=reply_markup)
+    await query.edit_message_text("⏰ Выберите новый час:",
+                                  reply_markup=tgKeyboards.hours("edit_hour", tuple(HOURS)))
     return HOUR_SELECTION
 
 async def edit_month_callback(update: Update, context: CallbackContext):
@@ -629,12 +592,8 @@ async def edit_month_callback(update: Update, context: CallbackContext):
         year = int(datetime.now().year)
         days_in_month = monthrange(year, month)[1]
 
-        days_keyboard = [
-            [InlineKeyboardButton(f"{i:02d}", callback_data=f"edit_day_{i:02d}") for i in
-             range(j, min(j + 4, days_in_month + 1))]
-            for j in range(1, days_in_month + 1, 4)
-        ]
-        reply_markup = InlineKeyboardMarkup(days_keyboard)
+        reply_markup = tgKeyboards.days(tuple((f"{i:02d}", f"edit_day_{i:02d}")
+                                              for i in range(1, days_in_month + 1)))
 
         await query.edit_message_text("📅 Выберите новый день:", reply_markup=reply_markup)
     except Exception as e:
@@ -658,17 +617,8 @@ async def edit_day_callback(update: Update, context: CallbackContext):
     # Логируем выбранную дату
     logger.info(f"Выбрана новая дата: {new_date}")
 
-    # Генерация клавиатуры для выбора часов
-    time_keyboard = []
-    for i in range(0, len(HOURS), 4):
-        row = []
-        for j in range(4):
-            if i + j < len(HOURS):
-                hour = HOURS[i + j]
-                row.append(InlineKeyboardButton(hour, callback_data=f"edit_hour_{hour}"))
-        time_keyboard.append(row)
-
-    reply_markup = InlineKeyboardMarkup(time_keyboard)
+    # Клавиатура для выбора часов
+    reply_markup = tgKeyboards.hours("edit_hour", tuple(HOURS))
 
     # Отправляем сообщение с новой датой и клавиатурой для выбора времени
     await query.edit_message_text(f"Вы выбрали новую дату: {new_date}. Теперь выберите новый час:", reply_markup=reply_markup)
@@ -682,11 +632,8 @@ async def edit_hour_callback(update: Update, context: CallbackContext):
     hour = query.data.split('_')[2]
     context.user_data["edit_hour"] = hour
 
-    keyboard = [[InlineKeyboardButton(minute, callback_data=f"edit_minute_{minute}") for minute in MINUTES]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
     await query.edit_message_text(f"Вы выбрали новый час: {hour}. Теперь выберите новые минуты:",
-                                  reply_markup=reply_markup)
+                                  reply_markup=tgKeyboards.minutes_row("edit_minute"))
     return MINUTE_SELECTION
 
 async def edit_minute_callback(update: Update, context: CallbackContext):
@@ -700,25 +647,19 @@ async def edit_minute_callback(update: Update, context: CallbackContext):
     reservation_id = context.user_data["reservation_id"]
     new_time = context.user_data["new_time"]
 
-    success = True
+    # Если выбрана новая дата — переносим и дату, и время одной транзакцией.
+    # Удалим её после использования, чтобы не мешалась при следующем редактировании
+    new_date = context.user_data.pop("new_date", None)
 
-    # Если выбрана новая дата — обновляем и дату, и время
-    if "new_date" in context.user_data:
-        new_date = context.user_data["new_date"]
+    result = await repository.reschedule_reservation(reservation_id, date=new_date, time=new_time)
 
-        # Обновляем дату
-        if not update_database(reservation_id, "date", new_date):
-            success = False
-
-        # Удалим после использования, чтобы не мешалось при следующем редактировании
-        del context.user_data["new_date"]
-
-    # Обновляем время
-    if not update_database(reservation_id, "time", new_time):
-        success = False
-
-    if success:
+    if result:
         await query.edit_message_text(f"✅ Бронирование успешно обновлено!\nНовое время: {new_time}")
+    elif result.conflict:
+        await query.edit_message_text(
+            f"⚠️ Время {new_time} пересекается с «{result.conflict['event_name']}» "
+            f"({result.conflict['time']}). Попробуйте снова."
+        )
     else:
         await query.edit_message_text("❌ Ошибка при обновлении. Попробуйте снова.")
 
@@ -773,7 +714,7 @@ async def save_edit(update: Update, context: CallbackContext) -> int:
 
     if field:
         # Пытаемся обновить бронирование
-        if update_database(reservation_id, field, new_value):  # Убедитесь, что update_reservation() принимает три аргумента
+        if await repository.update_reservation(reservation_id, field, new_value):
             await update.message.reply_text(f"✅ Изменения сохранены: новое значение - {new_value}")
         else:
             await update.message.reply_text("❌ Ошибка при обновлении. Попробуйте снова.")
@@ -783,34 +724,6 @@ async def save_edit(update: Update, context: CallbackContext) -> int:
     return ConversationHandler.END
 
 
-def update_database(reservation_id, field, new_value):
-    allowed_fields = ["date", "time", "author_name", "event_name"]
-    if field not in allowed_fields:
-        print(f"[DEBUG] Недопустимое поле: {field}")
-        return False
-
-    conn = sqlite3.connect("reservations.db")
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT * FROM reservations WHERE id = ?", (reservation_id,))
-    if not cursor.fetchone():
-        print(f"[DEBUG] Бронь с ID {reservation_id} не найдена")
-        conn.close()
-        return False
-
-    try:
-        query = f"UPDATE reservations SET {field} = ? WHERE id = ?"
-        print(f"[DEBUG] SQL: {query} | values: {new_value}, {reservation_id}")
-        cursor.execute(query, (new_value, reservation_id))
-        conn.commit()
-        return True
-    except Exception as e:
-        print(f"[DEBUG] Ошибка при обновлении: {e}")
-        return False
-    finally:
-        conn.close()
-
-
 async def about(update: Update, context: CallbackContext) -> None:
     about_text = (
         "Здравствуйте, Я — бот для управления вашим расписанием и бронирования столиков. "
@@ -842,7 +755,9 @@ async def save_duration(update: Update, context: CallbackContext):
 
 async def edit_duration(update: Update, context: CallbackContext):
     """Запрашивает новую длительность мероприятия."""
-    await update.callback_query.message.reply_text("Введите новую длительность в минутах:")
+    query = update.callback_query
+    await query.answer()
+    await query.edit_message_text("Введите новую длительность в минутах:")
     return DURATION_SELECTION
 
 async def save_duration_edit(update: Update, context: CallbackContext):
@@ -853,10 +768,13 @@ async def save_duration_edit(update: Update, context: CallbackContext):
         await update.message.reply_text("⚠️ Введите корректное число минут.")
         return DURATION_SELECTION
 
-    reservation_id = context.user_data['edit_reservation_id']
-    update_database(reservation_id, "duration", int(duration))
-
-    await update.message.reply_text("✅ Длительность обновлена!")
+    reservation_id = context.user_data['reservation_id']
+    # False — новая длительность пересекается с другим бронированием (или ошибка базы)
+    if await repository.update_reservation(reservation_id, "duration", int(duration)):
+        await update.message.reply_text("✅ Длительность обновлена!")
+    else:
+        await update.message.reply_text("❌ Не удалось изменить длительность: время пересекается "
+                                        "с другим бронированием. Попробуйте другое значение.")
     return ConversationHandler.END
 
 # Вывод ближайшего свободного времени
@@ -867,47 +785,20 @@ def get_reservations_on_date(date):
 
 
 def find_nearest_available_time(time, duration, reservations):
-    """Находит ближайшее доступное время"""
+    """Находит ближайшее доступное время.
+
+    reservations — занятые интервалы дня (db.availability.DayIntervals).
+    """
     try:
         # Преобразуем входное время
-        current_time = datetime.strptime(time, "%H:%M")
+        current_time = time_to_minutes(time)
         duration = int(duration)
 
-        # Проверяем все возможные временные слоты
-        for minutes_to_add in range(15, 24 * 60, 15):  # проверяем каждые 15 минут в течение 24 часов
-            new_time = current_time + timedelta(minutes=minutes_to_add)
-            new_time_str = new_time.strftime("%H:%M")
-
-            # Проверяем, не выходит ли за границы рабочего дня
-            if new_time.hour >= 20:  # после 20:00 не работаем
-                continue
-
-            new_end = new_time + timedelta(minutes=duration)
-            if new_end.hour >= 20:  # если мероприятие заканчивается после 20:00
-                continue
-
-            # Проверяем доступность
-            is_available = True
-            for res in reservations:
-                res_time = res[2]
-                if not re.match(r'^\d{2}:\d{2}$', res_time):
-                    continue
-
-                try:
-                    res_start = datetime.strptime(res_time, "%H:%M")
-                    res_duration = int(res[3]) if len(res) > 3 else 60
-                    res_end = res_start + timedelta(minutes=res_duration)
-
-                    if not (new_end <= res_start or new_time >= res_end):
-                        is_available = False
-                        break
-                except ValueError:
-                    continue
-
-            if is_available:
-                return new_time_str
-
-        return None
+        # Слоты каждые 15 минут после запрошенного времени; мероприятие
+        # должно закончиться раньше 20:00
+        new_time = reservations.next_free(current_time + 15, duration, step=15,
+                                          limit=20 * 60 - 1, origin=current_time + 15)
+        return minutes_to_time(new_time) if new_time is not None else None
 
     except Exception as e:
         logger.error(f"Error in find_nearest_available_time: {str(e)}", exc_info=True)
@@ -916,34 +807,42 @@ def find_nearest_available_time(time, duration, reservations):
 async def book_table(update: Update, context: CallbackContext):
     """Попытка забронировать столик, если время занято – уведомляем и предлагаем ближайшее свободное"""
     user_id = update.message.from_user.id
+    username = update.message.from_user.username or "Unknown"
+    author_name = update.message.from_user.full_name or "Неизвестный"
     event_name = "Ваше мероприятие"  # Нужно взять из контекста или сообщения пользователя
     date = "2025-04-12"  # Нужно взять из контекста или сообщения пользователя
     time = "14:00"  # Нужно взять из контекста или сообщения пользователя
     duration = 120  # Например, 2 часа
 
-    reservations = get_reservations_on_date(date)
+    reservations = await repository.day_intervals(date)
     nearest_time = find_nearest_available_time(time, duration, reservations)
 
-    requested_start = datetime.strptime(time, "%H:%M")
-    requested_end = requested_start + timedelta(minutes=duration)
+    requested_start = time_to_minutes(time)
+    requested_end = requested_start + duration
 
     # Проверяем, не пересекается ли запрашиваемое время с текущими бронированиями
-    for start_time, booked_duration in reservations:
-        booked_start = datetime.strptime(start_time, "%H:%M")
-        booked_end = booked_start + timedelta(minutes=int(booked_duration))
-
-        if not (requested_end <= booked_start or requested_start >= booked_end):
-            # Время занято, предлагаем ближайшее
-            await update.message.reply_text(
-                f"⚠️ Запрошенное время ({time}) уже занято.\n"
-                f"Ближайшее доступное время: {nearest_time}. Хотите забронировать его?",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("✅ Да, забронировать", callback_data=f"confirm_{date}_{nearest_time}_{duration}")],
-                    [InlineKeyboardButton("❌ Отмена", callback_data="cancel")]
-                ])
-            )
-            return  # Прерываем выполнение функции
-
-    # Если время свободно, бронируем
-    save_reservation(user_id, event_name, date, time, duration)
-    await update.message.reply_text(f"✅ Ваше бронирование подтверждено: {event_name} на {date} с {time} до {nearest_time}")
\ No newline at end of file
+    if not reservations.is_free(requested_start, requested_end):
+        # Время занято, предлагаем ближайшее
+        await update.message.reply_text(
+            f"⚠️ Запрошенное время ({time}) уже занято.\n"
+            f"Ближайшее доступное время: {nearest_time}. Хотите забронировать его?",
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("✅ Да, забронировать", callback_data=f"confirm_{date}_{nearest_time}_{duration}")],
+                [InlineKeyboardButton("❌ Отмена", callback_data="cancel")]
+            ])
+        )
+        return  # Прерываем выполнение функции
+
+    # Если время свободно, бронируем; между проверкой и записью его могли занять
+    result = await repository.add_reservation(user_id, username, author_name, event_name, date, time, duration)
+    if result:
+        await update.message.reply_text(
+            f"✅ Ваше бронирование подтверждено: {event_name} на {date}, {format_time_range(time, duration)}")
+    elif result.conflict:
+        conflict = result.conflict
+        await update.message.reply_text(
+            f"⚠️ Это время пересекается с «{conflict['event_name']}» "
+            f"({format_time_range(conflict['time'], conflict['duration'] or 60)}), попробуйте другое."
+        )
+    else:
+        await update.message.reply_text("⚠️ Это время уже занято, попробуйте другое.")
\ No newline at end of file
@@ -0,0 +1,61 @@
+from functools import lru_cache
+
+from telegram import ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
+
+# Сколько вариантов каждой параметризованной клавиатуры держать в памяти
+KEYBOARD_CACHE_SIZE = 256
+
+MINUTES = ("00", "15", "30", "45")
+
+memoized = lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+
+
+def grid(buttons, width=4):
+    """Inline-клавиатура из пар (текст, callback_data), по width кнопок в строке"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(label, callback_data=data) for label, data in buttons[i:i + width]]
+        for i in range(0, len(buttons), width)
+    ])
+
+
+# Постоянные клавиатуры: разметка PTB неизменяема, поэтому один объект отдается всем
+
+MAIN = ReplyKeyboardMarkup([
+    ['📆 Общее расписание', '📅 Мои бронирования'],
+    ['📌 Бронь', 'ℹ️ О боте']
+], resize_keyboard=True)
+
+MINUTES_GRID = grid([(minute, f"minute_{minute}") for minute in MINUTES], width=2)
+
+EDIT_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📅 Изменить дату", callback_data="edit_date")],
+    [InlineKeyboardButton("⏰ Изменить время", callback_data="edit_time")],
+    [InlineKeyboardButton("👤 Изменить имя", callback_data="edit_author")],
+    [InlineKeyboardButton("📌 Изменить событие", callback_data="edit_event")],
+    [InlineKeyboardButton("⏳ Изменить длительность", callback_data="edit_duration")],
+    [InlineKeyboardButton("❌ Отмена", callback_data="edit_cancel")]
+])
+
+
+@memoized
+def months(prefix):
+    """Месяцы 01-12 по четыре в строке; callback_data {prefix}_{месяц}"""
+    return grid([(f"{i:02d}", f"{prefix}_{i:02d}") for i in range(1, 13)])
+
+
+@memoized
+def minutes_row(prefix):
+    """Минуты одной строкой; callback_data {prefix}_{минуты}"""
+    return grid([(minute, f"{prefix}_{minute}") for minute in MINUTES], width=len(MINUTES))
+
+
+@memoized
+def hours(prefix, available):
+    """Часы по четыре в строке; callback_data {prefix}_{час}"""
+    return grid([(hour, f"{prefix}_{hour}") for hour in available])
+
+
+@memoized
+def days(buttons):
+    """Дни месяца по четыре в строке; buttons — кортеж пар (текст, callback_data)"""
+    return grid(buttons)
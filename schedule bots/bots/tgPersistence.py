@@ -0,0 +1,184 @@
+import asyncio
+import json
+import logging
+import time
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from db.connection import connection
+from db.migrations import migrate
+from db.repository import repository
+from db.writer import writer
+
+logger = logging.getLogger(__name__)
+
+# Как часто PTB передает изменения в persistence (секунды)
+PERSISTENCE_INTERVAL = 10
+# Пауза перед записью: изменения одного прохода PTB уходят в базу одной транзакцией
+WRITE_DELAY = 0.5
+# Повтор неудавшейся записи: через сколько секунд и сколько попыток делает flush при остановке
+WRITE_RETRY_DELAY = 5
+FLUSH_ATTEMPTS = 3
+# Диалоги и данные пользователей старше этого (секунды) не загружаются и удаляются
+PERSISTENCE_TTL = 7 * 24 * 60 * 60
+
+
+def _write_tg_state(cursor, conversations, user_data, expired_before):
+    """Изменение для db.writer: сохраняет накопленные диалоги и user_data"""
+    now = time.time()
+    cursor.executemany("DELETE FROM tg_conversations WHERE name = ? AND key = ?",
+                       [(name, key) for (name, key), state in conversations.items() if state is None])
+    cursor.executemany("""
+        INSERT INTO tg_conversations (name, key, state, updated_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT(name, key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+    """, [(name, key, state, now) for (name, key), state in conversations.items() if state is not None])
+    cursor.executemany("DELETE FROM tg_user_data WHERE user_id = ?",
+                       [(user_id,) for user_id, data in user_data.items() if data is None])
+    cursor.executemany("""
+        INSERT INTO tg_user_data (user_id, data, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+    """, [(user_id, data, now) for user_id, data in user_data.items() if data is not None])
+    cursor.execute("DELETE FROM tg_conversations WHERE updated_at < ?", (expired_before,))
+    cursor.execute("DELETE FROM tg_user_data WHERE updated_at < ?", (expired_before,))
+    return len(conversations) + len(user_data), ()
+
+
+def _load_tg_state(expired_before):
+    migrate()
+    conversations = {}
+    user_data = {}
+    with connection() as conn:
+        for name, key, state in conn.execute(
+                "SELECT name, key, state FROM tg_conversations WHERE updated_at >= ?", (expired_before,)):
+            conversations.setdefault(name, {})[tuple(json.loads(key))] = json.loads(state)
+        for user_id, data in conn.execute(
+                "SELECT user_id, data FROM tg_user_data WHERE updated_at >= ?", (expired_before,)):
+            user_data[user_id] = json.loads(data)
+    return conversations, user_data
+
+
+class SQLitePersistence(BasePersistence):
+    """Хранение состояний ConversationHandler и context.user_data в SQLite.
+
+    Таблицы tg_conversations и tg_user_data читаются одним запросом при
+    первом обращении PTB (в потоке репозитория, не блокируя цикл событий).
+    Изменения, которые PTB передает раз в PERSISTENCE_INTERVAL секунд,
+    копятся в памяти и пишутся через db.writer одной транзакцией на
+    проход. bot_data, chat_data и callback_data не сохраняются.
+    """
+
+    def __init__(self, update_interval=PERSISTENCE_INTERVAL, ttl=PERSISTENCE_TTL):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+                         update_interval=update_interval)
+        self.ttl = ttl
+        self._loaded = None
+        self._load_lock = asyncio.Lock()
+        self._pending_conversations = {}  # (name, key) -> JSON состояния или None (удалить)
+        self._pending_user_data = {}  # user_id -> JSON данных или None (удалить)
+        self._write_task = None
+        self._flushing = False
+
+    async def _load(self):
+        async with self._load_lock:
+            if self._loaded is None:
+                started = time.perf_counter()
+                self._loaded = await repository.run(_load_tg_state, time.time() - self.ttl)
+                conversations, user_data = self._loaded
+                logger.info(f"Загружено диалогов: {sum(map(len, conversations.values()))}, "
+                            f"данных пользователей: {len(user_data)} "
+                            f"за {(time.perf_counter() - started) * 1000:.1f} мс")
+        return self._loaded
+
+    # Чтение (один раз при старте Application)
+
+    async def get_conversations(self, name):
+        conversations, _ = await self._load()
+        return dict(conversations.get(name, {}))
+
+    async def get_user_data(self):
+        _, user_data = await self._load()
+        return dict(user_data)
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    # Изменения: только копятся, запись — пачкой в _write_pending
+
+    async def update_conversation(self, name, key, new_state):
+        self._pending_conversations[(name, json.dumps(list(key)))] = \
+            None if new_state is None else json.dumps(new_state)
+        self._schedule_write()
+
+    async def update_user_data(self, user_id, data):
+        self._pending_user_data[user_id] = json.dumps(data, ensure_ascii=False, default=str)
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id):
+        self._pending_user_data[user_id] = None
+        self._schedule_write()
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    def _schedule_write(self):
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.create_task(self._write_pending(WRITE_DELAY))
+
+    async def _write_pending(self, delay=0):
+        """Пишет накопленные изменения; False, если запись не удалась и они вернулись в очередь"""
+        if delay:
+            await asyncio.sleep(delay)
+        conversations, self._pending_conversations = self._pending_conversations, {}
+        user_data, self._pending_user_data = self._pending_user_data, {}
+        if not conversations and not user_data:
+            return True
+        try:
+            await asyncio.wrap_future(writer.submit(_write_tg_state, conversations, user_data,
+                                                    time.time() - self.ttl))
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка сохранения диалогов Telegram: {e}")
+            # Не потерять изменения: вернем их в очередь, более новые не перезаписываем
+            for key, value in conversations.items():
+                self._pending_conversations.setdefault(key, value)
+            for key, value in user_data.items():
+                self._pending_user_data.setdefault(key, value)
+            if not self._flushing:
+                # Текущая задача еще не завершилась, поэтому _schedule_write здесь не сработает
+                self._write_task = asyncio.create_task(self._write_pending(WRITE_RETRY_DELAY))
+            return False
+
+    async def flush(self):
+        """Вызывается PTB при остановке: дописывает все накопленное (до FLUSH_ATTEMPTS попыток)"""
+        self._flushing = True
+        while self._write_task is not None and not self._write_task.done():
+            await self._write_task
+        for attempt in range(FLUSH_ATTEMPTS):
+            if await self._write_pending(WRITE_DELAY * attempt):
+                return
+        logger.error(f"При остановке не сохранены диалоги Telegram: {len(self._pending_conversations)} "
+                     f"состояний, данные {len(self._pending_user_data)} пользователей")
@@ -1,18 +1,31 @@
 import logging
 import random
+import threading
+import time
 import datetime
-import re
-import sqlite3
 
 from vk_api import VkApi
 from vk_api.longpoll import VkLongPoll, VkEventType
+from vk_api.bot_longpoll import VkBotLongPoll, VkBotEventType
 from vk_api.keyboard import VkKeyboard, VkKeyboardColor
 from datetime import datetime, timedelta
 from calendar import monthrange
 import json
 
 from db.db import init_db, add_reservation, get_reservations_for_user, update_reservation, \
-    get_reservations_for_date, delete_reservation
+    get_reservations_for_date, delete_reservation, reschedule_reservation
+from db.availability import get_day_intervals, suggest_slots
+from db.cache import schedule_cache
+from db.connection import connection
+from db.occupancy import get_day_occupancy, get_month_occupancy
+from db.timeslots import WORKDAY_START, time_to_minutes, minutes_to_time
+from bots import backlog
+from bots.dispatcher import ShardedDispatcher
+from bots.outbox import Outbox, BATCH_LIMIT
+from bots.router import Router
+from bots.sessions import vk_sessions
+from bots import vkKeyboards
+from config import VK_WORKERS, VK_CALLBACK_BUTTONS, VK_GROUP_ID, BACKLOG_DRAIN
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -61,9 +74,57 @@ STATES = {
     'EDIT_TIME_MINUTE_SELECTION': 'edit_time_minute_selection',
 }
 
-# Глобальный словарь для хранения состояния пользователей
-user_states = {}
-user_data = {}
+# callback-кнопкам и messages.edit по conversation_message_id нужна версия API не ниже 5.103
+CALLBACK_API_VERSION = "5.131"
+
+# Состояния и данные пользователей: ограниченное хранилище сессий с сохранением
+# в базу (bots.sessions), снаружи выглядит как два словаря
+user_states = vk_sessions.states
+user_data = vk_sessions.data
+
+# Сообщения-просмотры: при разборе накопленной очереди такие пользователи идут последними.
+# Все payload["action"] — просмотр общего расписания
+VIEW_TEXTS = {"начать", "start", "/start", "ℹ️ о боте", "📅 мои бронирования", "📆 общее расписание"}
+VIEW_BUTTON_PREFIXES = ("show_all_reservations", "main_menu", "mo_", "day_")
+# Тексты главного меню: их повторы подряд схлопываются при разборе очереди
+MENU_TEXTS = VIEW_TEXTS | {"📌 бронь"}
+
+
+class BacklogMessage:
+    """Сообщение из истории диалога, пришедшее, пока бот был выключен"""
+
+    __slots__ = ("user_id", "message_id", "text", "payload")
+
+    def __init__(self, user_id, message_id, text, payload):
+        self.user_id = user_id
+        self.message_id = message_id
+        self.text = text
+        self.payload = payload
+
+    @classmethod
+    def from_api(cls, message):
+        try:
+            payload = json.loads(message["payload"]) if message.get("payload") else {}
+        except ValueError:
+            payload = {}
+        return cls(message["from_id"], message["id"], (message.get("text") or "").strip(), payload)
+
+    def key(self):
+        """Нажатая кнопка или пункт меню; None для текста, введенного в диалоге (не схлопывается)"""
+        if self.payload:
+            return "payload", json.dumps(self.payload, sort_keys=True)
+        if self.text.lower() in MENU_TEXTS:
+            return "text", self.text.lower()
+        return None
+
+    def is_view(self):
+        if self.payload.get("action"):
+            return True
+        button = self.payload.get("button")
+        if button:
+            return str(button).startswith(VIEW_BUTTON_PREFIXES)
+        return self.text.lower() in VIEW_TEXTS
+
 
 class VkBot:
     def __init__(self, token):
@@ -73,72 +134,71 @@ class VkBot:
             print(f"\n🧩 Капча от ВКонтакте: {captcha.get_url()}")
             key = input("Введите капчу: ").strip()
             return captcha.try_again(key)
-        self.vk_session = VkApi(token=token, captcha_handler=captcha_handler)
+        self.callback_buttons = VK_CALLBACK_BUTTONS
+        if self.callback_buttons:
+            self.vk_session = VkApi(token=token, captcha_handler=captcha_handler, api_version=CALLBACK_API_VERSION)
+            self.longpoll = VkBotLongPoll(self.vk_session, VK_GROUP_ID)
+        else:
+            self.vk_session = VkApi(token=token, captcha_handler=captcha_handler)
+            self.longpoll = VkLongPoll(self.vk_session)
         self.vk = self.vk_session.get_api()
-        self.longpoll = VkLongPoll(self.vk_session)
+        self._reply = threading.local()  # как отвечать на событие, которое сейчас обрабатывает поток шарда
+        self._intake_lock = threading.Lock()
+        self._stopping = False
+        self._drained = {}  # user_id -> id последнего сообщения, взятого из истории при запуске
+        self.dispatcher = ShardedDispatcher(self.handle_event, VK_WORKERS)
+        self.outbox = Outbox(self.vk_session.method)
         init_db()  # Инициализация базы данных
         logger.info("VK бот инициализирован")
 
     def send_message(self, user_id, message, keyboard=None):
-        """Отправляет сообщение пользователю"""
-        try:
-            params = {
-                'user_id': user_id,
+        """Ставит сообщение пользователю в очередь отправки (bots.outbox).
+
+        Отправка, ограничение частоты и повторы — в потоке очереди;
+        random_id задается здесь, поэтому повтор не задвоит сообщение.
+        keyboard — готовый JSON (bots.vkKeyboards) или VkKeyboard.
+
+        В ответ на нажатие callback-кнопки первое сообщение с inline-клавиатурой
+        (или без клавиатуры) не отправляется, а заменяет сообщение с кнопками.
+        """
+        params = {
+            'user_id': user_id,
+            'message': message,
+            'random_id': random.randint(1, 2147483647)
+        }
+
+        inline = False
+        if keyboard:
+            keyboard = keyboard if isinstance(keyboard, str) else keyboard.get_keyboard()
+            if getattr(self._reply, "callbacks", False):
+                callback_keyboard = vkKeyboards.callback_variant(keyboard)
+                if callback_keyboard is not None:
+                    keyboard, inline = callback_keyboard, True
+            params['keyboard'] = keyboard
+
+        edit = getattr(self._reply, "edit", None)
+        if edit is not None and (not keyboard or inline):
+            self._reply.edit = None
+            peer_id, conversation_message_id = edit
+            edit_params = {
+                'peer_id': peer_id,
+                'conversation_message_id': conversation_message_id,
                 'message': message,
-                'random_id': random.randint(1, 2147483647)
+                'keyboard': keyboard or vkKeyboards.EMPTY_INLINE
             }
-
-            if keyboard:
-                params['keyboard'] = keyboard.get_keyboard()
-
-            self.vk.messages.send(**params)
-            logger.info(f"Сообщение отправлено пользователю {user_id}: {message}")
-
-        except Exception as e:
-            logger.error(f"Ошибка при отправке сообщения пользователю {user_id}: {e}")
-            # Можно дополнительно отправить сообщение об ошибке пользователю
-            self.send_message(user_id, "❌ Ошибка при отправке сообщения. Попробуйте позже.")
+            # Старое сообщение (больше суток) изменить нельзя — тогда уйдет новое
+            self.outbox.send("messages.edit", edit_params, user_id=user_id, fallback=("messages.send", params))
+        else:
+            self.outbox.send("messages.send", params, user_id=user_id)
+        logger.info(f"Сообщение поставлено в очередь для пользователя {user_id}: {message}")
 
     def get_main_keyboard(self):
-        """Создает основную клавиатуру бота"""
-        keyboard = VkKeyboard(one_time=False)
-
-        keyboard.add_button('📆 Общее расписание', color=VkKeyboardColor.PRIMARY)
-        keyboard.add_button('📅 Мои бронирования', color=VkKeyboardColor.PRIMARY)
-        keyboard.add_line()
-        keyboard.add_button('📌 Бронь', color=VkKeyboardColor.POSITIVE)
-        keyboard.add_button('ℹ️ О боте', color=VkKeyboardColor.SECONDARY)
-
-        return keyboard
-
-    def get_months_keyboard(self, user_id, prefix="month"):
-        """Создает клавиатуру для выбора текущего и следующих трех месяцев"""
-        keyboard = VkKeyboard(inline=True)
-
-        # Получаем текущий месяц
-        current_month = datetime.now().month
-
-        # Список месяцев для отображения
-        months = [(current_month + i - 1) % 12 + 1 for i in range(4)]  # Текущий и 3 следующие месяца
-        months_str = [f"{month:02d}" for month in months]
-
-        # Добавляем кнопки для месяцев
-        button_count = 0  # Счётчик кнопок на текущей клавиатуре
-        for month in months_str:
-            keyboard.add_button(month, color=VkKeyboardColor.PRIMARY, payload={"button": f"{prefix}_{month}"})
-            button_count += 1
-
-            # Если на текущей клавиатуре 5 кнопок, добавляем новую строку
-            if button_count % 5 == 0:
-                keyboard.add_line()
-
-        # Отправляем клавиатуру
-        return keyboard
+        """Основная клавиатура бота (JSON собран один раз при импорте)"""
+        return vkKeyboards.MAIN
 
     def get_days_keyboard(self, user_id, year, month, prefix="day"):
-        """Создает клавиатуру для выбора дня (только будущие дни), одной строкой (до 3 кнопок)"""
+        """Клавиатура выбора дня (только будущие дни, одной строкой) с кнопками навигации"""
         days_in_month = monthrange(year, month)[1]
-        keyboard = VkKeyboard(inline=True)
 
         today = datetime.now()
         current_day = today.day
@@ -156,12 +216,11 @@ class VkBot:
         # Оставляем только первые 3 дня
         days_to_show = days_to_show[:4]
 
-        # Добавляем все кнопки в одну строку
-        for day in days_to_show:
-            keyboard.add_button(f"{day:02d}", color=VkKeyboardColor.PRIMARY,
-                                payload={"button": f"{prefix}_{day:02d}"})
+        # Занятость месяца одним запросом: полностью занятые дни выделяем красным
+        occupancy = get_month_occupancy(year, month)
 
-        return keyboard
+        # Все кнопки в одну строку, полностью занятые дни — красные
+        return vkKeyboards.view_days(prefix, tuple((day, occupancy[day].fully_booked) for day in days_to_show))
 
     def start(self, user_id):
         """Обработчик команды start"""
@@ -187,15 +246,7 @@ class VkBot:
         if user_id not in user_data:
             user_data[user_id] = {}
 
-        keyboard = VkKeyboard(inline=True)
-        keyboard.add_button("Январь-Апрель (1-4)", color=VkKeyboardColor.PRIMARY,
-                            payload={"button": "month_period_1_4"})
-        keyboard.add_button("Май-Август (5-8)", color=VkKeyboardColor.PRIMARY, payload={"button": "month_period_5_8"})
-        keyboard.add_line()
-        keyboard.add_button("Сентябрь-Декабрь (9-12)", color=VkKeyboardColor.PRIMARY,
-                            payload={"button": "month_period_9_12"})
-
-        self.send_message(user_id, "📅 Выберите период месяцев:", keyboard)
+        self.send_message(user_id, "📅 Выберите период месяцев:", vkKeyboards.MONTH_PERIODS)
         user_states[user_id] = STATES['MONTH_PERIOD_SELECTION']
 
     def handle_message(self, user_id, message_text, payload=None):
@@ -264,39 +315,10 @@ class VkBot:
                 "month_period_9_12": [9, 10, 11, 12]
             }
 
-            current_year = datetime.now().year
-            current_month = datetime.now().month
-
-            # Определяем доступные месяцы в выбранном периоде
-            available_months = []
-            for month in period_map[period]:
-                # Если месяц в текущем году уже прошел, предлагаем следующий год
-                if month < current_month:
-                    available_months.append((month, current_year + 1))
-                else:
-                    available_months.append((month, current_year))
-
-            # Создаем клавиатуру с доступными месяцами
-            keyboard = VkKeyboard(inline=True)
-            row_length = 0
-            max_buttons_per_row = 2  # Максимальное количество кнопок в строке
+            now = datetime.now()
 
-            for i, (month, year) in enumerate(available_months):
-                month_name = self.get_month_name(month)
-                if year > current_year:
-                    btn_text = f"{month_name} ({year})"
-                else:
-                    btn_text = month_name
-
-                keyboard.add_button(btn_text, color=VkKeyboardColor.PRIMARY,
-                                    payload={"button": f"select_month_{month}_{year}"})
-                row_length += 1
-
-                # Добавляем новую строку, если достигли максимума кнопок в строке
-                # И это не последняя кнопка
-                if row_length >= max_buttons_per_row and i != len(available_months) - 1:
-                    keyboard.add_line()
-                    row_length = 0
+            # Месяцы периода по два в строке; прошедшие в этом году — на следующий год
+            keyboard = vkKeyboards.month_choice(tuple(period_map[period]), now.year, now.month)
 
             self.send_message(user_id, "Выберите конкретный месяц:", keyboard)
             user_states[user_id] = STATES['MONTH_SELECTION']
@@ -335,29 +357,8 @@ class VkBot:
             self.send_message(user_id, "❌ Ошибка! Попробуйте выбрать месяц еще раз")
 
     def get_months_keyboard(self, user_id, prefix="month"):
-        """Создает клавиатуру для выбора месяцев с учетом текущей даты"""
-        current_date = datetime.now()
-        current_month = current_date.month
-
-        keyboard = VkKeyboard(inline=True)
-
-        # Добавляем месяцы текущего года (начиная с текущего)
-        for month in range(current_month, 13):
-            month_str = f"{month:02d}"
-            keyboard.add_button(month_str, color=VkKeyboardColor.PRIMARY,
-                                payload={"button": f"{prefix}_{month_str}"})
-            if month % 4 == 0:  # 4 кнопки в строке
-                keyboard.add_line()
-
-        # Добавляем месяцы следующего года (до текущего месяца)
-        for month in range(1, current_month):
-            month_str = f"{month:02d}"
-            keyboard.add_button(f"{month_str} (след. год)", color=VkKeyboardColor.SECONDARY,
-                                payload={"button": f"{prefix}_{month_str}"})
-            if (month + 12) % 4 == 0:  # 4 кнопки в строке
-                keyboard.add_line()
-
-        return keyboard
+        """Клавиатура выбора месяцев с учетом текущей даты (кэшируется по месяцу)"""
+        return vkKeyboards.months(prefix, datetime.now().month)
 
     def show_reservations_for_date(self, user_id, date):
         """Показывает все бронирования на указанную дату"""
@@ -383,10 +384,9 @@ class VkBot:
             # Проверяем формат даты
             datetime.strptime(date, "%Y-%m-%d")
 
-            reservations = get_reservations_for_date(date)
-            MAX_SLOTS = 12  # Максимальное количество броней в день
-
-            return len(reservations) >= MAX_SLOTS
+            # День занят, если в нем не осталось свободного окна MIN_FREE_WINDOW минут
+            # (занятость считается по реальным интервалам с учетом CAPACITY)
+            return get_day_occupancy(date).fully_booked
         except Exception as e:
             logger.error(f"Ошибка проверки занятости дня {date}: {e}")
             return True  # В случае ошибки считаем день занятым
@@ -442,34 +442,12 @@ class VkBot:
             date = user_data[user_id]["date"]
             logger.info(f"[{user_id}] Показ периодов для даты: {date}")
 
-            # Получаем и проверяем бронирования
-            reservations = get_reservations_for_date(date)
-            booked_slots = []
-
-            for res in reservations:
-                try:
-                    time_str = res[2]
-                    if not re.match(r'^\d{2}:\d{2}$', time_str):
-                        continue
-
-                    start = datetime.strptime(time_str, "%H:%M")
-                    duration = int(res[3]) if len(res) > 3 and str(res[3]).isdigit() else 60
-                    booked_slots.append((
-                        start.hour * 60 + start.minute,
-                        start.hour * 60 + start.minute + duration
-                    ))
-                except Exception as e:
-                    logger.warning(f"[{user_id}] Пропущено некорректное бронирование: {res} - {e}")
-                    continue
-
-            # Проверяем доступные часы (5:00-19:00)
-            available_hours = []
-            for hour in range(5, 20):
-                start_min = hour * 60
-                end_min = start_min + 60  # Минимальный слот 1 час
+            # Занятые интервалы дня в минутах от полуночи
+            booked_slots = get_day_intervals(date)
 
-                if all(end_min <= bs[0] or start_min >= bs[1] for bs in booked_slots):
-                    available_hours.append(f"{hour:02d}")
+            # Проверяем доступные часы (5:00-19:00), минимальный слот 1 час
+            available_hours = [f"{hour:02d}" for hour in range(5, 20)
+                               if booked_slots.is_free(hour * 60, hour * 60 + 60)]
 
             if not available_hours:
                 self.send_message(user_id,
@@ -477,23 +455,7 @@ class VkBot:
                                   "Попробуйте выбрать другую дату.")
                 return
 
-            # Создаем клавиатуру с правильным форматом (не более 2 кнопок в строке)
-            keyboard = VkKeyboard(inline=True)
-
-            # Первая строка: ранние периоды
-            keyboard.add_button("05:00-08:00", color=VkKeyboardColor.PRIMARY,
-                                payload={"button": "hour_period_5_8"})
-            keyboard.add_button("09:00-12:00", color=VkKeyboardColor.PRIMARY,
-                                payload={"button": "hour_period_9_12"})
-
-            # Вторая строка: поздние периоды
-            keyboard.add_line()
-            keyboard.add_button("13:00-16:00", color=VkKeyboardColor.PRIMARY,
-                                payload={"button": "hour_period_13_16"})
-            keyboard.add_button("17:00-19:00", color=VkKeyboardColor.PRIMARY,
-                                payload={"button": "hour_period_17_19"})
-
-            self.send_message(user_id, f"🕒 Выберите период времени для {date}:", keyboard)
+            self.send_message(user_id, f"🕒 Выберите период времени для {date}:", vkKeyboards.HOUR_PERIODS)
             user_states[user_id] = STATES['HOUR_PERIOD_SELECTION']
 
         except Exception as e:
@@ -527,64 +489,24 @@ class VkBot:
             date = user_data[user_id]["date"]
             duration = user_data[user_id].get("duration", 60)
 
-            # Получаем актуальные бронирования для даты
-            reservations = get_reservations_for_date(date)
-            booked_slots = []
-
-            for res in reservations:
-                try:
-                    time_str = res[2]
-                    res_duration = int(res[3]) if len(res) > 3 else 60
-                    start = datetime.strptime(time_str, "%H:%M")
-                    start_min = start.hour * 60 + start.minute
-                    end_min = start_min + res_duration
-                    booked_slots.append((start_min, end_min))
-                except Exception as e:
-                    logger.warning(f"Пропущено некорректное бронирование: {res} - {e}")
-                    continue
+            # Получаем актуальные занятые интервалы для даты
+            booked_slots = get_day_intervals(date)
 
             # Проверяем доступность каждого часа в периоде
-            available_hours = []
-            for hour in range(start_hour, end_hour + 1):
-                start_min = hour * 60
-                end_min = start_min + duration
-
-                # Проверяем пересечение с существующими бронированиями
-                is_available = True
-                for (booked_start, booked_end) in booked_slots:
-                    if not (end_min <= booked_start or start_min >= booked_end):
-                        is_available = False
-                        break
-
-                if is_available:
-                    available_hours.append(f"{hour:02d}")
+            available_hours = [f"{hour:02d}" for hour in range(start_hour, end_hour + 1)
+                               if booked_slots.is_free(hour * 60, hour * 60 + duration)]
 
             if not available_hours:
                 # Предлагаем ближайшие доступные варианты
-                nearest = self.find_nearest_available_time(date, duration)
-                if nearest:
-                    msg = (f"❌ В выбранном периоде нет свободных часов.\n"
-                           f"🔄 Ближайшее доступное время: {nearest}\n"
-                           f"Хотите забронировать на это время?")
-                    keyboard = VkKeyboard(inline=True)
-                    keyboard.add_button("Да", color=VkKeyboardColor.POSITIVE,
-                                        payload={"button": f"book_nearest_{nearest}"})
-                    keyboard.add_button("Нет", color=VkKeyboardColor.NEGATIVE,
-                                        payload={"button": "cancel_booking"})
-                    self.send_message(user_id, msg, keyboard)
-                else:
+                if not self.send_slot_suggestions(user_id, date, start_hour * 60, duration,
+                                                  "❌ В выбранном периоде нет свободных часов."):
                     self.send_message(user_id,
                                       "❌ К сожалению, на выбранную дату нет свободного времени.\n"
                                       "Пожалуйста, выберите другую дату.")
                 return
 
-            # Создаем клавиатуру с доступными часами
-            keyboard = VkKeyboard(inline=True)
-            for i, hour in enumerate(available_hours):
-                keyboard.add_button(hour, color=VkKeyboardColor.PRIMARY,
-                                    payload={"button": f"hour_{hour}"})
-                if (i + 1) % 3 == 0 and i != len(available_hours) - 1:
-                    keyboard.add_line()
+            # Клавиатура с доступными часами
+            keyboard = vkKeyboards.hours(tuple(available_hours))
 
             self.send_message(user_id, f"🕒 Доступные часы в периоде {start_hour}:00-{end_hour}:00:", keyboard)
             user_states[user_id] = STATES['HOUR_SELECTION']
@@ -632,23 +554,10 @@ class VkBot:
 
         except ValueError as e:
             logger.warning(f"[{user_id}] Ошибка выбора часа: {e}")
-            nearest = self.find_nearest_available_time(
-                user_data[user_id]["date"],
-                user_data[user_id].get("duration", 60)
-            )
-            if nearest:
-                msg = (f"❌ Время {hour_input}:00 недоступно.\n"
-                       f"🔄 Ближайшее свободное время: {nearest}\n"
-                       f"Хотите выбрать его?")
-
-                keyboard = VkKeyboard(inline=True)
-                keyboard.add_button("Да", color=VkKeyboardColor.POSITIVE,
-                                    payload={"button": f"accept_nearest_{nearest.replace(':', '')}"})
-                keyboard.add_button("Нет", color=VkKeyboardColor.NEGATIVE,
-                                    payload={"button": "cancel_time_selection"})
-
-                self.send_message(user_id, msg, keyboard)
-            else:
+            requested = int(hour_input) * 60 if str(hour_input).isdigit() else WORKDAY_START
+            if not self.send_slot_suggestions(user_id, user_data[user_id]["date"], requested,
+                                              user_data[user_id].get("duration", 60),
+                                              f"❌ Время {hour_input}:00 недоступно."):
                 self.send_message(user_id,
                                   "❌ Нет доступного времени. Пожалуйста, выберите другую дату.")
 
@@ -658,44 +567,13 @@ class VkBot:
             self.reset_user_state(user_id)
 
     def create_minutes_keyboard(self, prefix):
-        """Создает клавиатуру для выбора минут"""
-        keyboard = VkKeyboard(inline=True)
-        minutes = ["00", "15", "30", "45"]
-
-        # Добавляем кнопки по 2 в строку
-        for i in range(0, len(minutes), 2):
-            # Первая кнопка в паре
-            keyboard.add_button(minutes[i], color=VkKeyboardColor.PRIMARY,
-                                payload={"button": f"{prefix}_{minutes[i]}"})
-
-            # Вторая кнопка, если есть
-            if i + 1 < len(minutes):
-                keyboard.add_button(minutes[i + 1], color=VkKeyboardColor.PRIMARY,
-                                    payload={"button": f"{prefix}_{minutes[i + 1]}"})
-
-            # Перенос строки, если не последняя пара
-            if i + 2 < len(minutes):
-                keyboard.add_line()
-
-        return keyboard
+        """Клавиатура выбора минут (по две кнопки в строке)"""
+        return vkKeyboards.minutes(prefix)
 
     def is_time_booked(self, date, time, reservation_id=None):
-        """Проверяет, занято ли конкретное время"""
-        conn = sqlite3.connect('reservations.db')
-        cursor = conn.cursor()
-
-        query = "SELECT id FROM reservations WHERE date = ? AND time = ?"
-        params = [date, time]
-
-        if reservation_id:
-            query += " AND id != ?"
-            params.append(reservation_id)
-
-        cursor.execute(query, params)
-        result = cursor.fetchone() is not None
-        conn.close()
-
-        return result
+        """Проверяет, занято ли конкретное время (попадает ли оно в чей-то интервал)"""
+        minute = time_to_minutes(time)
+        return not get_day_intervals(date, exclude_id=reservation_id or None).is_free(minute, minute + 1)
 
     def process_minute_selection(self, user_id, minute):
         """Обрабатывает выбор минут"""
@@ -709,16 +587,9 @@ class VkBot:
             # Проверяем допустимые значения минут
             if minute not in ["00", "15", "30", "45"]:
                 # Показываем клавиатуру снова, если введено недопустимое значение
-                keyboard = VkKeyboard(inline=True)
-                keyboard.add_button("00", color=VkKeyboardColor.PRIMARY, payload={"button": f"minute_00"})
-                keyboard.add_button("15", color=VkKeyboardColor.PRIMARY, payload={"button": f"minute_15"})
-                keyboard.add_line()
-                keyboard.add_button("30", color=VkKeyboardColor.PRIMARY, payload={"button": f"minute_30"})
-                keyboard.add_button("45", color=VkKeyboardColor.PRIMARY, payload={"button": f"minute_45"})
-
                 self.send_message(user_id,
                                   "❌ Пожалуйста, выберите минуты из предложенных вариантов:",
-                                  keyboard)
+                                  vkKeyboards.minutes("minute"))
                 return False
 
             hour = user_data[user_id]["hour"]
@@ -727,33 +598,15 @@ class VkBot:
             user_data[user_id]["time"] = time
 
             duration = user_data[user_id].get("duration", 60)
-            start_time = datetime.strptime(time, "%H:%M")
-            end_time = start_time + timedelta(minutes=duration)
-
-            # Проверка доступности времени
-            reservations = get_reservations_for_date(date)
-            for res in reservations:
-                res_start = datetime.strptime(res[2], "%H:%M")
-                res_end = res_start + timedelta(minutes=int(res[3]))
-
-                if not (end_time <= res_start or start_time >= res_end):
-                    # Найдено пересечение - время занято
-                    nearest_time = self.find_nearest_available_time(time, duration, reservations)
-                    user_data[user_id]["time"] = nearest_time
-                    self.send_message(user_id,
-                                      f"⚠️ Время {time} уже занято.\n"
-                                      f"🔄 Перенесено на {nearest_time}")
-                    self.show_duration_keyboard(user_id)
-                    return True
-            occupied_times = [res[2] for res in reservations]
-
-            if time in occupied_times:
-                nearest_time = self.find_nearest_available_time(time, 60, reservations)
-                user_data[user_id]["time"] = nearest_time
-                self.send_message(user_id,
-                                  f"⚠️ Время {time} уже занято.\n"
-                                  f"🔄 Бронирование автоматически перенесено на ближайшее доступное: {nearest_time}.\n")
-                self.show_duration_keyboard(user_id)
+            start_time = time_to_minutes(time)
+            end_time = start_time + duration
+
+            # Проверка доступности времени по занятым интервалам дня
+            if not get_day_intervals(date).is_free(start_time, end_time):
+                # Найдено пересечение - время занято, предлагаем варианты кнопками
+                if not self.send_slot_suggestions(user_id, date, start_time, duration,
+                                                  f"⚠️ Время {time} уже занято."):
+                    self.send_message(user_id, "❌ Нет доступного времени. Пожалуйста, выберите другую дату.")
             else:
                 self.send_message(user_id, f"✅ Вы выбрали время: {time}.")
                 self.show_duration_keyboard(user_id)
@@ -765,18 +618,42 @@ class VkBot:
             self.send_message(user_id, "❌ Ошибка! Попробуйте выбрать минуты еще раз.")
             return False
 
-    def show_duration_keyboard(self, user_id):
-        """Показывает клавиатуру для выбора длительности"""
-        keyboard = VkKeyboard(inline=True)
-        durations = ["30", "60", "120", "180"]
+    def send_slot_suggestions(self, user_id, date, start, duration, header):
+        """Отправляет ближайшие свободные варианты кнопками; False, если вариантов нет"""
+        suggestions = suggest_slots(date, start, int(duration), not_before=datetime.now())
+        if not suggestions:
+            return False
 
-        for i, duration in enumerate(durations):
-            keyboard.add_button(f"{duration} мин", color=VkKeyboardColor.PRIMARY,
-                                payload={"button": f"duration_{duration}"})
-            if i < len(durations) - 1:
-                keyboard.add_line()  # Каждая кнопка на новой строке
+        keyboard = VkKeyboard(inline=True)
+        for suggested_date, suggested_start in suggestions:
+            time = minutes_to_time(suggested_start)
+            day_label = datetime.strptime(suggested_date, "%Y-%m-%d").strftime("%d.%m")
+            keyboard.add_button(f"📅 {day_label} в {time}", color=VkKeyboardColor.POSITIVE,
+                                payload={"button": f"suggest_{suggested_date}_{time}"})
+            keyboard.add_line()
+        keyboard.add_button("Отмена", color=VkKeyboardColor.NEGATIVE, payload={"action": "main_menu"})
+
+        self.send_message(user_id, f"{header}\n🔄 Ближайшие свободные варианты:", keyboard)
+        return True
+
+    def process_suggestion(self, user_id, button):
+        """Принимает вариант, предложенный вместо занятого времени"""
+        _, date, time = button.split("_", 2)
+        year, month, day = date.split("-")
+        user_data.setdefault(user_id, {}).update({
+            "year": year,
+            "month": month,
+            "day": day,
+            "date": date,
+            "hour": time.split(":")[0],
+            "time": time,
+        })
+        self.send_message(user_id, f"✅ Вы выбрали {day}.{month}.{year} в {time}.")
+        self.show_duration_keyboard(user_id)
 
-        self.send_message(user_id, "Выберите длительность мероприятия:", keyboard)
+    def show_duration_keyboard(self, user_id):
+        """Показывает клавиатуру для выбора длительности"""
+        self.send_message(user_id, "Выберите длительность мероприятия:", vkKeyboards.durations("duration"))
         user_states[user_id] = STATES['DURATION_SELECTION']
 
     def process_duration_input(self, user_id, duration_input):
@@ -824,9 +701,17 @@ class VkBot:
         time = user_data[user_id]['time']
         duration = user_data[user_id].get('duration', 60)
 
-        # Добавляем бронирование
-        if add_reservation(user_id, f"vk{user_id}", author_name, event_name, date, time, duration):
+        # Добавляем бронирование (проверка пересечений и вставка — одна транзакция)
+        result = add_reservation(user_id, f"vk{user_id}", author_name, event_name, date, time, duration)
+        if result:
             self.send_message(user_id, "✅ Бронирование успешно добавлено!", self.get_main_keyboard())
+        elif result.conflict:
+            conflict = result.conflict
+            self.send_message(user_id,
+                              f"⚠️ Это время пересекается с «{conflict['event_name']}» "
+                              f"({self.format_time_range(conflict['time'], conflict['duration'] or 60)}), "
+                              f"попробуйте другое.",
+                              self.get_main_keyboard())
         else:
             self.send_message(user_id, "⚠️ Это время уже занято, попробуйте другое.", self.get_main_keyboard())
 
@@ -888,22 +773,8 @@ class VkBot:
             if user_id not in user_data:
                 user_data[user_id] = {}
 
-            # Создаем клавиатуру с периодами месяцев
-            keyboard = VkKeyboard(inline=True)
-            keyboard.add_button("Январь-Апрель", color=VkKeyboardColor.PRIMARY,
-                                payload={"action": "schedule_month_period", "period": "1_4"})
-            keyboard.add_button("Май-Август", color=VkKeyboardColor.PRIMARY,
-                                payload={"action": "schedule_month_period", "period": "5_8"})
-            keyboard.add_line()
-            keyboard.add_button("Сентябрь-Декабрь", color=VkKeyboardColor.PRIMARY,
-                                payload={"action": "schedule_month_period", "period": "9_12"})
-            keyboard.add_line()
-            keyboard.add_button("Текущий месяц", color=VkKeyboardColor.POSITIVE,
-                                payload={"action": "schedule_current_month"})
-            keyboard.add_button("Главное меню", color=VkKeyboardColor.SECONDARY,
-                                payload={"action": "main_menu"})
-
-            self.send_message(user_id, "📅 Выберите период месяцев для просмотра расписания:", keyboard)
+            self.send_message(user_id, "📅 Выберите период месяцев для просмотра расписания:",
+                              vkKeyboards.SCHEDULE_MONTH_PERIODS)
             user_states[user_id] = STATES['SCHEDULE_MONTH_PERIOD']
 
         except Exception as e:
@@ -919,30 +790,10 @@ class VkBot:
                 return
 
             start_month, end_month = map(int, period.split('_'))
-            current_year = datetime.now().year
-            current_month = datetime.now().month
-
-            keyboard = VkKeyboard(inline=True)
-            for month in range(start_month, end_month + 1):
-                # Для месяцев текущего года
-                if month >= current_month:
-                    month_name = self.get_month_name(str(month).zfill(2))  # Преобразуем в формат "01", "02" и т.д.
-                    keyboard.add_button(month_name, color=VkKeyboardColor.PRIMARY,
-                                        payload={"action": "schedule_select_month",
-                                                 "month": month, "year": current_year})
-                # Для месяцев следующего года
-                else:
-                    month_name = f"{self.get_month_name(str(month).zfill(2))} ({current_year + 1})"
-                    keyboard.add_button(month_name, color=VkKeyboardColor.SECONDARY,
-                                        payload={"action": "schedule_select_month",
-                                                 "month": month, "year": current_year + 1})
-
-                if (month - start_month) % 2 == 1 and month != end_month:
-                    keyboard.add_line()
+            now = datetime.now()
 
-            keyboard.add_line()
-            keyboard.add_button("Назад к периодам", color=VkKeyboardColor.SECONDARY,
-                                payload={"action": "show_all_reservations"})
+            # Месяцы текущего года — синие, уже прошедшие (на следующий год) — серые
+            keyboard = vkKeyboards.schedule_months(start_month, end_month, now.year, now.month)
 
             self.send_message(user_id, "Выберите конкретный месяц:", keyboard)
             user_states[user_id] = STATES['SCHEDULE_MONTH_SELECTION']
@@ -963,29 +814,8 @@ class VkBot:
                 "schedule_year": str(year)
             }
 
-            # Создаем клавиатуру с периодами дней
-            _, num_days = monthrange(year, month)
-            period_size = max(1, num_days // 4)
-            periods = []
-
-            for i in range(4):
-                start_day = i * period_size + 1
-                end_day = (i + 1) * period_size if i < 3 else num_days
-                periods.append((start_day, end_day))
-
-            keyboard = VkKeyboard(inline=True)
-            for i, (start, end) in enumerate(periods):
-                btn_text = f"{start}-{end}" if start != end else f"{start}"
-                keyboard.add_button(btn_text, color=VkKeyboardColor.PRIMARY,
-                                    payload={"action": "schedule_day_period",
-                                             "start": start, "end": end})
-
-                if i % 2 == 1 and i != len(periods) - 1:
-                    keyboard.add_line()
-
-            keyboard.add_line()
-            keyboard.add_button("Назад к месяцам", color=VkKeyboardColor.SECONDARY,
-                                payload={"action": "show_all_reservations"})
+            # Клавиатура с четырьмя периодами дней месяца
+            keyboard = vkKeyboards.schedule_day_periods(year, month)
 
             month_name = self.get_month_name(month)
             self.send_message(user_id,
@@ -1048,31 +878,24 @@ class VkBot:
             year = int(user_data[user_id]["schedule_year"])
             date = f"{year}-{month:02d}-{day:02d}"
 
-            # Получаем бронирования из базы данных
-            conn = sqlite3.connect('reservations.db')
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id, username, author_name, event_name, date, time, duration
-                FROM reservations
-                WHERE date = ?
-                ORDER BY time
-            """, (date,))
-            reservations = cursor.fetchall()
-            conn.close()
-
-            if not reservations:
+            # Получаем бронирования из общего кэша расписаний
+            if not schedule_cache.rows(date):
                 self.send_message(user_id, f"❌ На {day}.{month:02d}.{year} нет бронирований.")
                 return
 
-            # Формируем красивое сообщение
-            message = f"📅 Расписание на {day}.{month:02d}.{year}:\n\n"
-            for i, res in enumerate(reservations, 1):
-                message += (
-                    f"{i}. {res[4]} - {res[2]}: {res[3]}\n"
-                    f"Автор: {res[1]}\n"
-                    f"Время: {res[5]}\n"
-                    f"Длительность: {res[6]} мин\n\n"
-                )
+            def render(reservations):
+                # Формируем красивое сообщение
+                message = f"📅 Расписание на {day}.{month:02d}.{year}:\n\n"
+                for i, res in enumerate(reservations, 1):
+                    message += (
+                        f"{i}. {res[4]} - {res[2]}: {res[3]}\n"
+                        f"Автор: {res[1]}\n"
+                        f"Время: {res[5]}\n"
+                        f"Длительность: {res[6]} мин\n\n"
+                    )
+                return message
+
+            message = schedule_cache.rendered(date, "vk_schedule_list", render)
 
             # Клавиатура для навигации
             keyboard = VkKeyboard(inline=True)
@@ -1103,16 +926,9 @@ class VkBot:
             user_data[user_id]["view_month"] = f"{month:02d}"
             year = int(user_data[user_id].get("view_year", str(datetime.now().year)))
 
-            # Получаем клавиатуру с днями месяца
+            # Клавиатура с днями месяца и кнопками навигации
             keyboard = self.get_days_keyboard(user_id, year, month, "day")
 
-            # Добавляем кнопки навигации
-            keyboard.add_line()
-            keyboard.add_button("Выбрать другой месяц", color=VkKeyboardColor.PRIMARY,
-                                payload={"button": "show_all_reservations"})
-            keyboard.add_button("Главное меню", color=VkKeyboardColor.SECONDARY,
-                                payload={"button": "main_menu"})
-
             month_name = self.get_month_name(month)
             self.send_message(user_id, f"📅 Выберите день ({month_name} {year}):", keyboard)
             user_states[user_id] = STATES['SELECT_DAY']
@@ -1143,51 +959,36 @@ class VkBot:
             except ValueError:
                 raise ValueError("Некорректная дата")
 
-            # Получаем бронирования для выбранной даты
-            reservations = get_reservations_for_date(selected_date)
-
-            # Формируем таблицу с расписанием
-            time_slots = [
-                "05:00", "05:30", "06:00", "06:30", "07:00", "07:30",
-                "08:00", "08:30", "09:00", "09:30", "10:00", "10:30",
-                "11:00", "11:30", "12:00", "12:30", "13:00", "13:30",
-                "14:00", "14:30", "15:00", "15:30", "16:00", "16:30",
-                "17:00", "17:30", "18:00", "18:30", "19:00", "19:30"
-            ]
+            def render(reservations):
+                # Формируем таблицу с расписанием: слоты каждые 30 минут с 05:00 до 19:30
+                time_slots = range(5 * 60, 20 * 60, 30)
 
-            # Создаем словарь занятых слотов
-            occupied_slots = {}
-            for res in reservations:
-                _, _, author, event, _, time_str, duration = res
-                try:
-                    start_time = datetime.strptime(time_str, "%H:%M")
+                # Создаем словарь занятых слотов
+                occupied_slots = {}
+                for res in reservations:
+                    _, _, author, event, _, _, duration, start, end = res
                     duration = int(duration) if duration else 60
-                    end_time = start_time + timedelta(minutes=duration)
-
-                    current_time = start_time
-                    while current_time < end_time:
-                        slot_key = current_time.strftime("%H:%M")
-                        if slot_key not in occupied_slots:
-                            occupied_slots[slot_key] = []
-                        occupied_slots[slot_key].append(
+                    for slot in range(start, end, 30):
+                        occupied_slots.setdefault(slot, []).append(
                             f"{event} ({author}, {duration} мин)"
                         )
-                        current_time += timedelta(minutes=30)
-                except Exception as e:
-                    logger.error(f"Ошибка обработки времени брони {time_str}: {e}")
-                    continue
 
-            # Формируем текст сообщения
-            formatted_date = f"{day}.{month}.{year}"
-            message = f"📅 Расписание на {formatted_date}:\n\n"
+                # Формируем текст сообщения
+                formatted_date = f"{day}.{month}.{year}"
+                message = f"📅 Расписание на {formatted_date}:\n\n"
 
-            for slot in time_slots:
-                if slot in occupied_slots:
-                    message += f"🕒 {slot} - 🟥 ЗАНЯТО\n"
-                    for detail in occupied_slots[slot]:
-                        message += f"   • {detail}\n"
-                else:
-                    message += f"🕒 {slot} - 🟩 СВОБОДНО\n"
+                for slot in time_slots:
+                    slot_str = minutes_to_time(slot)
+                    if slot in occupied_slots:
+                        message += f"🕒 {slot_str} - 🟥 ЗАНЯТО\n"
+                        for detail in occupied_slots[slot]:
+                            message += f"   • {detail}\n"
+                    else:
+                        message += f"🕒 {slot_str} - 🟩 СВОБОДНО\n"
+                return message
+
+            # Бронирования выбранной даты (с интервалами в минутах) и готовый текст — из общего кэша
+            message = schedule_cache.rendered(selected_date, "vk_day_view", render)
 
             # Создаем клавиатуру для навигации
             keyboard = VkKeyboard(inline=True)
@@ -1236,31 +1037,9 @@ class VkBot:
     def find_nearest_available_time(self, date, duration):
         """Находит ближайшее доступное время на выбранную дату"""
         try:
-            reservations = get_reservations_for_date(date)
-            booked_slots = []
-
-            for res in reservations:
-                try:
-                    time_str = res[2]
-                    res_duration = int(res[3]) if len(res) > 3 else 60
-                    start = datetime.strptime(time_str, "%H:%M")
-                    booked_slots.append((
-                        start.hour * 60 + start.minute,
-                        start.hour * 60 + start.minute + res_duration
-                    ))
-                except:
-                    continue
-
-            # Проверяем все возможные часы (с 5:00 до 20:00)
-            for hour in range(5, 21):
-                for minute in [0, 15, 30, 45]:
-                    start_min = hour * 60 + minute
-                    end_min = start_min + duration
-
-                    if all(end_min <= bs[0] or start_min >= bs[1] for bs in booked_slots):
-                        return f"{hour:02d}:{minute:02d}"
-
-            return None
+            # Слоты каждые 15 минут с 05:00, мероприятие должно закончиться до 21:00
+            start = get_day_intervals(date).next_free(WORKDAY_START, int(duration), step=15)
+            return minutes_to_time(start) if start is not None else None
         except Exception as e:
             logger.error(f"Ошибка поиска ближайшего времени: {e}")
             return None
@@ -1300,22 +1079,7 @@ class VkBot:
             'edit_state': 'date_selection'
         })
 
-        # Клавиатура с периодами месяцев (не более 2 кнопок в строке)
-        keyboard = VkKeyboard(inline=True)
-
-        # Используем единый формат для всех периодов
-        keyboard.add_button("Январь-Апрель",
-                            color=VkKeyboardColor.PRIMARY,
-                            payload={"button": "edit_month_period_1_4"})
-        keyboard.add_button("Май-Август",
-                            color=VkKeyboardColor.PRIMARY,
-                            payload={"button": "edit_month_period_5_8"})
-        keyboard.add_line()
-        keyboard.add_button("Сентябрь-Декабрь",
-                            color=VkKeyboardColor.PRIMARY,
-                            payload={"button": "edit_month_period_9_12"})
-
-        self.send_message(user_id, "Выберите период месяцев:", keyboard)
+        self.send_message(user_id, "Выберите период месяцев:", vkKeyboards.EDIT_MONTH_PERIODS)
         user_states[user_id] = STATES['EDIT_DATE_SELECTION']
 
     def process_edit_month_period_selection(self, user_id, period):
@@ -1331,21 +1095,10 @@ class VkBot:
             if period not in period_map:
                 raise ValueError(f"Неверный период месяцев: {period}")
 
-            current_year = datetime.now().year
-            current_month = datetime.now().month
-
-            # Создаем клавиатуру с доступными месяцами
-            keyboard = VkKeyboard(inline=True)
-            for i, month in enumerate(period_map[period]):
-                year = current_year + 1 if month < current_month else current_year
-                month_name = self.get_month_name(month)
-
-                keyboard.add_button(f"{month_name} {year}" if year > current_year else month_name,
-                                    color=VkKeyboardColor.PRIMARY,
-                                    payload={"button": f"edit_select_month_{month}_{year}"})
+            now = datetime.now()
 
-                if i % 2 == 1 and i != len(period_map[period]) - 1:
-                    keyboard.add_line()
+            # Клавиатура с доступными месяцами
+            keyboard = vkKeyboards.edit_month_choice(tuple(period_map[period]), now.year, now.month)
 
             self.send_message(user_id, "Выберите конкретный месяц:", keyboard)
             user_states[user_id] = STATES['EDIT_MONTH_SELECTION']
@@ -1424,11 +1177,10 @@ class VkBot:
             reservation_id = user_data[user_id]["edit_reservation_id"]
 
             # Получаем текущее бронирование
-            conn = sqlite3.connect('reservations.db')
-            cursor = conn.cursor()
-            cursor.execute("SELECT date, time FROM reservations WHERE id = ?", (reservation_id,))
-            result = cursor.fetchone()
-            conn.close()
+            with connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT date, time FROM reservations WHERE id = ?", (reservation_id,))
+                result = cursor.fetchone()
 
             if not result:
                 raise Exception("Бронирование не найдено")
@@ -1446,17 +1198,10 @@ class VkBot:
             })
 
             # Предлагаем изменить дату
-            keyboard = VkKeyboard(inline=True)
-            keyboard.add_button("Изменить дату", color=VkKeyboardColor.PRIMARY,
-                                payload={"button": "edit_time_change_date"})
-            keyboard.add_line()
-            keyboard.add_button("Оставить текущую дату", color=VkKeyboardColor.SECONDARY,
-                                payload={"button": "edit_time_keep_date"})
-
             self.send_message(user_id,
                               f"Текущая дата: {current_date}\n"
                               f"Хотите изменить дату бронирования?",
-                              keyboard)
+                              vkKeyboards.EDIT_TIME_DATE_CHOICE)
             user_states[user_id] = STATES['EDIT_TIME_DATE_CHOICE']
 
         except Exception as e:
@@ -1466,21 +1211,9 @@ class VkBot:
             self.reset_user_state(user_id)
 
     def show_edit_month_periods(self, user_id):
-        """Показывает периоды месяцев для выбора даты (единый формат)"""
+        """Показывает периоды месяцев для выбора даты (та же клавиатура, что и в process_edit_date)"""
         try:
-            keyboard = VkKeyboard(inline=True)
-
-            # Используем тот же формат, что и в process_edit_date
-            keyboard.add_button("Январь-Апрель", color=VkKeyboardColor.PRIMARY,
-                                payload={"button": "edit_month_period_1_4"})
-            keyboard.add_line()
-            keyboard.add_button("Май-Август", color=VkKeyboardColor.PRIMARY,
-                                payload={"button": "edit_month_period_5_8"})
-            keyboard.add_line()
-            keyboard.add_button("Сентябрь-Декабрь", color=VkKeyboardColor.PRIMARY,
-                                payload={"button": "edit_month_period_9_12"})
-
-            self.send_message(user_id, "Выберите период месяцев:", keyboard)
+            self.send_message(user_id, "Выберите период месяцев:", vkKeyboards.EDIT_MONTH_PERIODS)
             user_states[user_id] = STATES['EDIT_DATE_SELECTION']
         except Exception as e:
             logger.error(f"[{user_id}] Ошибка при показе периодов месяцев: {e}")
@@ -1590,39 +1323,12 @@ class VkBot:
             date = user_data[user_id]["new_date"]
             reservation_id = user_data[user_id]["edit_reservation_id"]
 
-            # Get booked time slots (excluding current reservation)
-            conn = sqlite3.connect('reservations.db')
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT time, duration FROM reservations 
-                WHERE date = ? AND id != ?
-            """, (date, reservation_id))
-            booked_slots = cursor.fetchall()
-            conn.close()
-
-            # Create list of booked intervals
-            booked_intervals = []
-            for time, duration in booked_slots:
-                start = datetime.strptime(time, "%H:%M")
-                start_minutes = start.hour * 60 + start.minute
-                end_minutes = start_minutes + int(duration)
-                booked_intervals.append((start_minutes, end_minutes))
-
-            # Check available hours (5:00 - 20:00)
-            available_hours = []
-            for hour in range(5, 20):
-                start_minutes = hour * 60
-                end_minutes = start_minutes + 60  # minimum duration 60 min
-
-                # Check overlap with existing bookings
-                is_available = True
-                for booked_start, booked_end in booked_intervals:
-                    if not (end_minutes <= booked_start or start_minutes >= booked_end):
-                        is_available = False
-                        break
+            # Get booked intervals (excluding current reservation)
+            booked_intervals = get_day_intervals(date, exclude_id=reservation_id)
 
-                if is_available:
-                    available_hours.append(f"{hour:02d}")
+            # Check available hours (5:00 - 20:00), minimum duration 60 min
+            available_hours = [f"{hour:02d}" for hour in range(5, 20)
+                               if booked_intervals.is_free(hour * 60, hour * 60 + 60)]
 
             if not available_hours:
                 self.send_message(user_id, "❌ На выбранную дату нет свободного времени.")
@@ -1630,29 +1336,7 @@ class VkBot:
 
             user_data[user_id]["available_hours"] = available_hours
 
-            # Create keyboard with time periods
-            keyboard = VkKeyboard(inline=True)
-            periods = [
-                ("5:00-8:00", {"button": "edit_time_period_5_8"}),  # Формат edit_time_period_X_Y
-                ("9:00-12:00", {"button": "edit_time_period_9_12"}),
-                ("13:00-16:00", {"button": "edit_time_period_13_16"}),
-                ("17:00-20:00", {"button": "edit_time_period_17_20"})
-            ]
-
-            # Place 2 buttons per row
-            # Добавляем кнопки (по 2 в строку)
-            for i in range(0, len(periods), 2):
-                text1, payload1 = periods[i]
-                keyboard.add_button(text1, color=VkKeyboardColor.PRIMARY, payload=payload1)
-
-                if i + 1 < len(periods):
-                    text2, payload2 = periods[i + 1]
-                    keyboard.add_button(text2, color=VkKeyboardColor.PRIMARY, payload=payload2)
-
-                if i + 2 < len(periods):
-                    keyboard.add_line()
-
-            self.send_message(user_id, f"🕒 Выберите период времени для {date}:", keyboard)
+            self.send_message(user_id, f"🕒 Выберите период времени для {date}:", vkKeyboards.EDIT_TIME_PERIODS)
             user_states[user_id] = STATES['EDIT_TIME_PERIOD_SELECTION']
 
         except Exception as e:
@@ -1666,39 +1350,12 @@ class VkBot:
             date = user_data[user_id]["edit_date"]
             reservation_id = user_data[user_id]["edit_reservation_id"]
 
-            # Получаем занятые слоты времени
-            conn = sqlite3.connect('reservations.db')
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT time, duration FROM reservations 
-                WHERE date = ? AND id != ?
-            """, (date, reservation_id))
-            reservations = cursor.fetchall()
-            conn.close()
-
-            # Формируем список занятых слотов
-            booked_slots = []
-            for time, duration in reservations:
-                start = datetime.strptime(time, "%H:%M")
-                start_minutes = start.hour * 60 + start.minute
-                end_minutes = start_minutes + int(duration)
-                booked_slots.append((start_minutes, end_minutes))
-
-            # Проверяем доступные часы
-            available_hours = []
-            for hour in range(5, 20):
-                start_minutes = hour * 60
-                end_minutes = start_minutes + 60  # минимальная длительность
-
-                # Проверяем пересечение с существующими бронированиями
-                is_available = True
-                for booked_start, booked_end in booked_slots:
-                    if not (end_minutes <= booked_start or start_minutes >= booked_end):
-                        is_available = False
-                        break
+            # Получаем занятые интервалы (кроме редактируемого бронирования)
+            booked_slots = get_day_intervals(date, exclude_id=reservation_id)
 
-                if is_available:
-                    available_hours.append(f"{hour:02d}")
+            # Проверяем доступные часы (минимальная длительность 60 минут)
+            available_hours = [f"{hour:02d}" for hour in range(5, 20)
+                               if booked_slots.is_free(hour * 60, hour * 60 + 60)]
 
             if not available_hours:
                 self.send_message(user_id, "❌ На выбранную дату нет свободного времени.")
@@ -1706,22 +1363,7 @@ class VkBot:
 
             user_data[user_id]["edit_available_hours"] = available_hours
 
-            # Создаем клавиатуру с периодами
-            keyboard = VkKeyboard(inline=True)
-            periods = [
-                ("5-8", "edit_hour_period_5_8"),
-                ("9-12", "edit_hour_period_9_12"),
-                ("13-16", "edit_hour_period_13_16"),
-                ("17-19", "edit_hour_period_17_19")
-            ]
-
-            for i, (text, action) in enumerate(periods):
-                if i % 2 == 0 and i != 0:
-                    keyboard.add_line()
-                keyboard.add_button(text, color=VkKeyboardColor.PRIMARY,
-                                    payload={"button": action})
-
-            self.send_message(user_id, f"🕒 Выберите период времени для {date}:", keyboard)
+            self.send_message(user_id, f"🕒 Выберите период времени для {date}:", vkKeyboards.EDIT_HOUR_PERIODS)
             user_states[user_id] = STATES['EDIT_HOUR_PERIOD_SELECTION']
 
         except Exception as e:
@@ -1932,26 +1574,12 @@ class VkBot:
             reservation_id = user_data[user_id]["edit_reservation_id"]
             new_time = f"{hour}:{minute}"
 
-            # Проверяем доступность времени
-            conn = sqlite3.connect('reservations.db')
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id FROM reservations 
-                WHERE date = ? AND time = ? AND id != ?
-            """, (date, new_time, reservation_id))
-
-            if cursor.fetchone():
-                conn.close()
+            # Проверяем пересечения и обновляем бронирование одной транзакцией
+            result = reschedule_reservation(reservation_id, date=date, time=new_time)
+            if result.conflict:
                 raise ValueError(f"Время {new_time} уже занято")
-
-            # Обновляем бронирование
-            cursor.execute("""
-                UPDATE reservations 
-                SET time = ?
-                WHERE id = ?
-            """, (new_time, reservation_id))
-            conn.commit()
-            conn.close()
+            if not result:
+                raise Exception("Бронирование не найдено")
 
             self.send_message(
                 user_id,
@@ -1980,19 +1608,7 @@ class VkBot:
     def _show_minute_keyboard(self, user_id, message="Выберите минуты:"):
         """Показывает клавиатуру выбора минут"""
         try:
-            keyboard = VkKeyboard(inline=True)
-            minutes = ["00", "15", "30", "45"]
-
-            for i, minute in enumerate(minutes):
-                if i % 2 == 0 and i != 0:
-                    keyboard.add_line()
-                keyboard.add_button(
-                    minute,
-                    color=VkKeyboardColor.PRIMARY,
-                    payload={"button": f"edit_minute_{minute}"}
-                )
-
-            self.send_message(user_id, message, keyboard)
+            self.send_message(user_id, message, vkKeyboards.minutes("edit_minute"))
             user_states[user_id] = STATES['EDIT_MINUTE_SELECTION']
 
         except Exception as e:
@@ -2029,25 +1645,12 @@ class VkBot:
             new_time = f"{hour}:{minute}"
             reservation_id = user_data[user_id]["edit_reservation_id"]
 
-            # Проверяем доступность времени
-            conn = sqlite3.connect('reservations.db')
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id FROM reservations 
-                WHERE date = ? AND time = ? AND id != ?
-            """, (date, new_time, reservation_id))
-            if cursor.fetchone():
-                conn.close()
+            # Проверяем пересечения и обновляем бронирование одной транзакцией
+            result = reschedule_reservation(reservation_id, date=date, time=new_time)
+            if result.conflict:
                 raise Exception("Это время уже занято")
-
-            # Обновляем бронирование
-            cursor.execute("""
-                UPDATE reservations 
-                SET date = ?, time = ?
-                WHERE id = ?
-            """, (date, new_time, reservation_id))
-            conn.commit()
-            conn.close()
+            if not result:
+                raise Exception("Бронирование не найдено")
 
             self.send_message(user_id,
                               f"✅ Время успешно изменено!\n"
@@ -2100,16 +1703,7 @@ class VkBot:
         })
 
         # Показываем клавиатуру с вариантами длительности
-        keyboard = VkKeyboard(inline=True)
-        durations = ["30", "60", "120", "180"]
-
-        for i, duration in enumerate(durations):
-            keyboard.add_button(f"{duration} мин", color=VkKeyboardColor.PRIMARY,
-                                payload={"button": f"edit_duration_{duration}"})
-            if i < len(durations) - 1:
-                keyboard.add_line()  # Каждая кнопка на новой строке
-
-        self.send_message(user_id, "Выберите новую длительность мероприятия:", keyboard)
+        self.send_message(user_id, "Выберите новую длительность мероприятия:", vkKeyboards.durations("edit_duration"))
         user_states[user_id] = STATES['EDIT_SELECTION']
 
     def process_edit_field_input(self, user_id, input_data):
@@ -2174,21 +1768,8 @@ class VkBot:
         user_states[user_id] = STATES['START']
 
     def get_time_keyboard(self):
-        """Создает клавиатуру для выбора времени"""
-        keyboard = VkKeyboard(inline=True)
-        hours = ["09", "10", "11", "12", "13", "14", "15", "16", "17", "18", "19", "20", "21", "22"]
-
-        row = 0
-        for i in range(0, len(hours), 4):
-            for j in range(4):
-                if i + j < len(hours):
-                    keyboard.add_button(hours[i + j], color=VkKeyboardColor.PRIMARY,
-                                        payload={"button": f"hour_{hours[i + j]}:00"})
-            row += 1
-            if row < (len(hours) + 3) // 4:  # Если это не последняя строка
-                keyboard.add_line()
-
-        return keyboard
+        """Клавиатура выбора времени (JSON собран один раз при импорте)"""
+        return vkKeyboards.TIME
 
     def format_time_range(self, start_time, duration):
         """Формирует строку с промежутком времени бронирования."""
@@ -2204,385 +1785,427 @@ class VkBot:
             raise ValueError(
                 f"Ошибка формата времени '{start_time}'. Требуется ЧЧ:ММ (например, 09:00). Оригинальная ошибка: {e}")
 
-    def run(self):
-        """Запускает основной цикл бота"""
-        logger.info("Бот запущен...")
-        for event in self.longpoll.listen():
-            try:
-                if event.type == VkEventType.MESSAGE_NEW and event.to_me:
-                    user_id = event.user_id
-                    text = event.text.strip()
-                    payload = {}
+    def process_edit_time_hour_button(self, user_id, button):
+        """Обрабатывает кнопку часа при изменении времени бронирования"""
+        hour = button.split('_')[-1]
+
+        # Проверяем наличие предыдущих данных
+        if user_id not in user_data:
+            self.send_message(user_id, "❌ Сессия устарела", self.get_main_keyboard())
+            self.reset_user_state(user_id)
+            return
+
+        # Сохраняем данные с проверкой
+        user_data[user_id].update({
+            "edit_hour": hour,
+            "new_date": user_data[user_id].get("edit_date", ""),
+            "edit_reservation_id": user_data[user_id].get("edit_reservation_id", 0)
+        })
 
-                    # Проверяем наличие payload
-                    try:
-                        if hasattr(event, 'payload'):
-                            payload = json.loads(event.payload)
-                    except:
-                        payload = {}
+        # Проверяем что все данные есть
+        if not all(user_data[user_id].get(k) for k in ["edit_hour", "new_date", "edit_reservation_id"]):
+            self.send_message(user_id, "❌ Отсутствуют данные", self.get_main_keyboard())
+            self.reset_user_state(user_id)
+            return
+        self._show_minute_keyboard(user_id, f"Вы выбрали {hour}:__. Теперь выберите минуты:")
 
-                    # Обработка состояний редактирования
-                    if user_states.get(user_id) == STATES['EDIT_DAY_SELECTION'] and text:
-                        self.process_edit_day_selection(user_id, text)
+    def handle_event(self, event):
+        """Обрабатывает одно входящее событие (вызывается из потока шарда)"""
+        try:
+            user_id, text, payload = self.read_event(event)
 
-                    elif user_states.get(user_id) == STATES['EDIT_TIME_DATE_CHOICE']:
-                        if payload and "button" in payload:
-                            button = payload["button"]
-                            if button in ["edit_time_change_date", "edit_time_keep_date"]:
-                                self.process_edit_time_date_choice(user_id, button)
+            # Маршрут выбирается по таблицам router (см. build_router)
+            router.dispatch(self, user_id, text, payload, user_states.get(user_id))
 
-                    elif user_states.get(user_id) == STATES['EDIT_DATE_SELECTION']:
-                        if payload and "button" in payload:
-                            button = payload["button"]
-                            if button in ["edit_month_period_1_4", "edit_month_period_5_8", "edit_month_period_9_12"]:
-                                self.process_edit_date_selection(user_id, button)
-                            else:
-                                logger.error(f"[{user_id}] Получен недопустимый период: {button}")
-                                self.send_message(user_id, "❌ Недопустимый период месяцев",
-                                                  self.get_main_keyboard())
+        except Exception as e:
+            logger.error(f"Ошибка при обработке события: {e}")
+        finally:
+            self._reply.edit = None
+            self._reply.callbacks = False
 
+    def read_event(self, event):
+        """Достает из события (user_id, текст, payload) и запоминает, как на него отвечать"""
+        self._reply.edit = None
+        self._reply.callbacks = False
 
-                    elif user_states.get(user_id) == STATES['EDIT_MONTH_SELECTION']:
+        if isinstance(event, BacklogMessage):
+            # Накопленное сообщение: отвечаем новым сообщением с текстовыми кнопками
+            return event.user_id, event.text, event.payload
 
-                        if payload and "button" in payload:
+        if not self.callback_buttons:
+            # Обычный Long Poll: только текстовые кнопки
+            payload = {}
+            try:
+                if hasattr(event, 'payload'):
+                    payload = json.loads(event.payload)
+            except:
+                payload = {}
+            return event.user_id, event.text.strip(), payload
+
+        if event.type == VkBotEventType.MESSAGE_EVENT:
+            # Нажатие callback-кнопки: текст кнопки лежит в payload (vkKeyboards.callback_variant)
+            obj = event.obj
+            payload = dict(obj.payload or {})
+            text = str(payload.pop("label", "")).strip()
+            # Сразу убираем индикатор загрузки на кнопке; ответ придет правкой этого сообщения
+            self.outbox.send("messages.sendMessageEventAnswer",
+                             {'event_id': obj.event_id, 'user_id': obj.user_id, 'peer_id': obj.peer_id},
+                             user_id=obj.user_id)
+            self._reply.callbacks = True
+            self._reply.edit = (obj.peer_id, obj.conversation_message_id)
+            return obj.user_id, text, payload
+
+        # Новое сообщение через Bots Long Poll: callback-кнопки — только если клиент их поддерживает
+        message = event.message
+        client_info = event.client_info or {}
+        self._reply.callbacks = "callback" in client_info.get("button_actions", ())
+        payload = {}
+        try:
+            if message.get("payload"):
+                payload = json.loads(message["payload"])
+        except ValueError:
+            payload = {}
+        return message.from_id, (message.text or "").strip(), payload
+
+    def fetch_backlog(self):
+        """Сообщения, оставшиеся без ответа, пока бот был выключен: [BacklogMessage, ...].
+
+        Диалоги без ответа сообщества берутся из messages.getConversations
+        (filter=unanswered). Если непрочитанных в диалоге несколько, они
+        читаются из истории — по BATCH_LIMIT диалогов на один execute, не
+        больше DRAIN_HISTORY на пользователя. Нажатия callback-кнопок в
+        историю не попадают и не восстанавливаются.
+        """
+        conversations, offset = [], 0
+        while True:
+            page = self.vk_session.method("messages.getConversations",
+                                          {"filter": "unanswered", "count": 200, "offset": offset})
+            items = page.get("items", [])
+            conversations.extend(item for item in items if item["conversation"]["peer"]["type"] == "user")
+            offset += len(items)
+            if not items or offset >= page.get("count", 0):
+                break
+
+        messages, histories = [], []
+        for item in conversations:
+            unread = item["conversation"].get("unread_count", 1)
+            if unread > 1:
+                histories.append((item["conversation"]["peer"]["id"], min(unread, backlog.DRAIN_HISTORY)))
+            else:
+                messages.append(item["last_message"])
+
+        for i in range(0, len(histories), BATCH_LIMIT):
+            chunk = histories[i:i + BATCH_LIMIT]
+            calls = ",".join(f"API.messages.getHistory({json.dumps({'peer_id': user_id, 'count': count})})"
+                             for user_id, count in chunk)
+            responses = self.vk_session.method("execute", {"code": f"return [{calls}];"})
+            for (user_id, _), history in zip(chunk, responses):
+                unanswered = []
+                # История идет от новых к старым: берем все до последнего ответа сообщества
+                for message in (history or {}).get("items", []):
+                    if message.get("out") or message.get("from_id") != user_id:
+                        break
+                    unanswered.append(message)
+                messages.extend(reversed(unanswered))
+
+        return [BacklogMessage.from_api(message) for message in messages]
+
+    def drain_backlog(self):
+        """Раскладывает накопленные сообщения по шардам до начала чтения long poll.
+
+        План — bots.backlog.plan: повторы схлопнуты, пользователи с
+        бронированиями впереди; шарды обрабатывают пользователей параллельно.
+        Эти же сообщения могут прийти и через long poll (он слушает с момента
+        создания бота), поэтому id взятых запоминаются в _drained.
+        """
+        started = time.perf_counter()
+        messages = self.fetch_backlog()
+        if not messages:
+            return
+        groups, dropped = backlog.plan(messages, lambda m: m.user_id, BacklogMessage.key, BacklogMessage.is_view)
+        logger.info(f"Накопленная очередь: {backlog.summary(groups, dropped)}")
+        for user_id, user_messages in groups:
+            for message in user_messages:
+                self._drained[user_id] = max(self._drained.get(user_id, 0), message.message_id)
+                self.dispatcher.submit(user_id, message)
+        logger.info(f"Накопленная очередь поставлена в шарды за {time.perf_counter() - started:.2f} с")
+
+    def _is_drained(self, user_id, message_id):
+        return message_id is not None and message_id <= self._drained.get(user_id, 0)
 
-                            button = payload["button"]
+    def run(self):
+        """Запускает основной цикл бота.
+
+        Цикл только читает long poll и раскладывает события по шардам
+        (bots.dispatcher): обработка идет в VK_WORKERS потоках. При
+        BACKLOG_DRAIN сначала разбираются сообщения, накопленные за время простоя.
+        """
+        logger.info("Бот запущен" + (" (callback-кнопки)..." if self.callback_buttons else "..."))
+        self.dispatcher.start()
+        if BACKLOG_DRAIN:
+            try:
+                self.drain_backlog()
+            except Exception as e:
+                logger.error(f"Не удалось разобрать накопленные сообщения: {e}")
+        try:
+            for event in self.longpoll.listen():
+                with self._intake_lock:
+                    if self._stopping:
+                        break
+                    if not self.callback_buttons:
+                        if (event.type == VkEventType.MESSAGE_NEW and event.to_me
+                                and not self._is_drained(event.user_id, event.message_id)):
+                            self.dispatcher.submit(event.user_id, event)
+                    elif event.type == VkBotEventType.MESSAGE_NEW and event.from_user:
+                        if not self._is_drained(event.message.from_id, event.message.get("id")):
+                            self.dispatcher.submit(event.message.from_id, event)
+                    elif event.type == VkBotEventType.MESSAGE_EVENT:
+                        self.dispatcher.submit(event.obj.user_id, event)
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Останавливает прием событий и дописывает очереди.
+
+        Можно вызвать из другого потока: поток long poll может еще ждать
+        ответа сервера, но новые события в шарды уже не попадут. Дальше по
+        порядку: дообработка событий шардов, отправка исходящих сообщений,
+        запись сессий в базу.
+        """
+        with self._intake_lock:
+            if self._stopping:
+                return
+            self._stopping = True
+        self.dispatcher.stop()
+        self.outbox.close()
+        vk_sessions.close()
 
-                            if button.startswith("edit_select_month_"):
+# Маршруты входящих сообщений. Обработчик получает бота и bots.router.Message.
 
-                                parts = button.split("_")
+def _button(message):
+    return message.payload.get("button") if message.payload else None
 
-                                if len(parts) >= 5:  # Проверяем, что есть все части
 
-                                    month = parts[3]
+def _on_edit_time_date_choice(bot, message):
+    button = _button(message)
+    if button in ["edit_time_change_date", "edit_time_keep_date"]:
+        bot.process_edit_time_date_choice(message.user_id, button)
 
-                                    year = parts[4]
 
-                                    self.process_edit_month_selection(user_id, {"month": month, "year": year})
+def _on_edit_date_selection(bot, message):
+    button = _button(message)
+    if button is None:
+        return
+    if button in ["edit_month_period_1_4", "edit_month_period_5_8", "edit_month_period_9_12"]:
+        bot.process_edit_date_selection(message.user_id, button)
+    else:
+        logger.error(f"[{message.user_id}] Получен недопустимый период: {button}")
+        bot.send_message(message.user_id, "❌ Недопустимый период месяцев", bot.get_main_keyboard())
 
-                                else:
 
-                                    logger.error(f"[{user_id}] Неверный формат кнопки месяца: {button}")
+def _on_edit_month_selection(bot, message):
+    button = _button(message)
+    if button is None or not button.startswith("edit_select_month_"):
+        return
+    parts = button.split("_")
+    if len(parts) >= 5:  # Проверяем, что есть все части
+        bot.process_edit_month_selection(message.user_id, {"month": parts[3], "year": parts[4]})
+    else:
+        logger.error(f"[{message.user_id}] Неверный формат кнопки месяца: {button}")
+        bot.send_message(message.user_id, "❌ Ошибка выбора месяца. Попробуйте снова.", bot.get_main_keyboard())
 
-                                    self.send_message(user_id, "❌ Ошибка выбора месяца. Попробуйте снова.",
 
-                                                      self.get_main_keyboard())
+def _on_edit_time_period_selection(bot, message):
+    logger.debug(f"[{message.user_id}] Обработка EDIT_TIME_PERIOD_SELECTION, payload: {message.payload}")
+    button = _button(message)
+    if button is not None and button.startswith("edit_time_period_"):
+        bot.process_edit_time_period_selection(message.user_id, message.payload)
 
-                    elif user_states.get(user_id) == STATES['EDIT_TIME_PERIOD_SELECTION']:
-                        logger.debug(f"[{user_id}] Обработка EDIT_TIME_PERIOD_SELECTION, payload: {payload}")
-                        if payload and "button" in payload:
-                            button = payload["button"]
-                            if button.startswith("edit_time_period_"):
-                                self.process_edit_time_period_selection(user_id, payload)
 
-                    elif user_states.get(user_id) == STATES['EDIT_TIME_HOUR_SELECTION']:
-                        if payload and "button" in payload:
-                            button = payload["button"]
-                            if button.startswith("edit_hour_"):
-                                hour = button.split('_')[-1]
+def _on_edit_time_hour_selection(bot, message):
+    button = _button(message)
+    if button is not None and button.startswith("edit_hour_"):
+        bot.process_edit_time_hour_button(message.user_id, button)
 
-                                # Проверяем наличие предыдущих данных
 
-                                if user_id not in user_data:
-                                    self.send_message(user_id, "❌ Сессия устарела", self.get_main_keyboard())
-                                    self.reset_user_state(user_id)
-                                    continue
+def _on_edit_hour_period_selection(bot, message):
+    button = _button(message)
+    if button is not None and button.startswith("edit_hour_period_"):
+        bot.process_edit_hour_period_selection(message.user_id, message.payload)
 
-                                # Сохраняем данные с проверкой
 
-                                user_data[user_id].update({
-                                    "edit_hour": hour,
-                                    "new_date": user_data[user_id].get("edit_date", ""),
-                                    "edit_reservation_id": user_data[user_id].get("edit_reservation_id", 0)
-                                })
+def _on_edit_hour_selection(bot, message):
+    button = _button(message)
+    if button is None:
+        return
+    logger.debug(f"[{message.user_id}] Получена кнопка часа: {button}")
+    if button.startswith("edit_hour_"):
+        try:
+            button.split('_')[2]  # Формат: edit_hour_09
+            bot.process_edit_hour_selection(message.user_id, {"button": button})
+        except IndexError:
+            logger.error(f"Неверный формат кнопки часа: {button}")
+            bot.send_message(message.user_id, "❌ Ошибка формата. Пожалуйста, выберите час снова.")
 
-                                # Проверяем что все данные есть
 
-                                if not all(user_data[user_id].get(k) for k in
-                                           ["edit_hour", "new_date", "edit_reservation_id"]):
-                                    self.send_message(user_id, "❌ Отсутствуют данные", self.get_main_keyboard())
-                                    self.reset_user_state(user_id)
-                                    continue
-                                self._show_minute_keyboard(user_id, f"Вы выбрали {hour}:__. Теперь выберите минуты:")
-
-                    elif user_states.get(user_id) == STATES['EDIT_TIME_MINUTE_SELECTION']:
-                        # Обработка ввода минут текстом
-                        self.process_edit_time_minute_selection(user_id, text)
-
-                    elif user_states.get(user_id) == STATES['EDIT_HOUR_PERIOD_SELECTION']:
-                        if payload and "button" in payload:
-                            button = payload["button"]
-                            if button.startswith("edit_hour_period_"):
-                                self.process_edit_hour_period_selection(user_id, payload)
+def _on_edit_minute_selection(bot, message):
+    button = _button(message)
+    if button is not None and button.startswith("edit_minute_"):
+        bot.process_edit_minute_selection(message.user_id, message.payload)
 
-                    elif user_states.get(user_id) == STATES['EDIT_HOUR_SELECTION']:
-                        if payload and "button" in payload:
-                            button = payload["button"]
-                            logger.debug(f"[{user_id}] Получена кнопка часа: {button}")  # Логирование
-                            if button.startswith("edit_hour_"):
-                                try:
-                                    hour = button.split('_')[2]  # Получаем час из edit_hour_09
-                                    self.process_edit_hour_selection(user_id, {"button": button})
-                                except IndexError:
-                                    logger.error(f"Неверный формат кнопки часа: {button}")
-                                    self.send_message(user_id, "❌ Ошибка формата. Пожалуйста, выберите час снова.")
 
-                    elif user_states.get(user_id) == STATES['EDIT_MINUTE_SELECTION']:
-                        if payload and "button" in payload:
-                            button = payload["button"]
-                            if button.startswith("edit_minute_"):
-                                self.process_edit_minute_selection(user_id, payload)
+def _on_schedule_back_to_day_periods(bot, message):
+    month_data = {
+        "month": user_data[message.user_id]["schedule_month"],
+        "year": user_data[message.user_id]["schedule_year"]
+    }
+    bot.process_schedule_month_selection(message.user_id, month_data)
 
-                    # Обработка текстовых команд
-                    elif text == "начать" or text.lower() == "start" or text == "/start":
-                        self.start(user_id)
 
-                    elif text == "ℹ️ О боте":
-                        self.about(user_id)
+def _on_schedule_back_to_days(bot, message):
+    bot.process_schedule_day_period(message.user_id, {
+        "start": user_data[message.user_id].get("period_start", 1),
+        "end": user_data[message.user_id].get("period_end", 7)
+    })
 
-                    elif text == "📌 Бронь":
-                        self.start_reservation(user_id)
 
-                    elif text == "📅 Мои бронирования":
-                        self.show_my_reservations(user_id)
+def _on_select_day_wrong_state(bot, message):
+    logger.error(f"[{message.user_id}] Неверное состояние для select_day: {message.state}")
+    bot.send_message(message.user_id, "❌ Пожалуйста, выберите период дней сначала.")
 
-                    elif text == "📆 Общее расписание":
-                        self.show_all_reservations(user_id)
 
-                    # Обработка payload с ключом "action"
-                    elif payload and "action" in payload:
-                        action = payload["action"]
+def _on_edit_booking_wrong_state(bot, message):
+    logger.warning(f"[{message.user_id}] Попытка редактирования из неверного состояния: {message.state}")
 
-                        if action == "main_menu":
-                            self.start(user_id)
-
-                        elif action == "show_all_reservations":
-                            self.show_all_reservations(user_id)
-
-                        elif action == "schedule_month_period":
-                            if user_states.get(user_id) == STATES['SCHEDULE_MONTH_PERIOD']:
-                                self.process_schedule_month_period(user_id, payload.get("period"))
-
-                        elif action == "schedule_current_month":
-                            self.process_schedule_month_period(user_id, "current")
-
-                        elif action == "schedule_select_month":
-                            if user_states.get(user_id) == STATES['SCHEDULE_MONTH_SELECTION']:
-                                self.process_schedule_month_selection(user_id, payload)
-
-                        elif action == "schedule_day_period":
-                            if user_states.get(user_id) == STATES['SCHEDULE_DAY_PERIOD']:
-                                self.process_schedule_day_period(user_id, payload)
-
-                        elif action == "schedule_select_day":
-                            if user_states.get(user_id) == STATES['SCHEDULE_DAY_SELECTION']:
-                                self.process_schedule_day_selection(user_id, payload.get("day"))
-
-                        elif action == "schedule_back_to_day_periods":
-                            month_data = {
-                                "month": user_data[user_id]["schedule_month"],
-                                "year": user_data[user_id]["schedule_year"]
-                            }
-                            self.process_schedule_month_selection(user_id, month_data)
-
-                        elif action == "schedule_back_to_days":
-                            self.process_schedule_day_period(user_id, {
-                                "start": user_data[user_id].get("period_start", 1),
-                                "end": user_data[user_id].get("period_end", 7)
-                            })
-
-                    # Обработка payload с ключом "button"
-                    elif payload and "button" in payload:
-                        button = payload["button"]
-
-                        if button.startswith("month_period_"):
-                            if user_states.get(user_id) == STATES['MONTH_PERIOD_SELECTION']:
-                                self.process_month_period_selection(user_id, button)
-
-                        elif button.startswith("mo_"):
-                            if user_states.get(user_id) == STATES['SELECT_MONTH']:
-                                month = button.split("_")[1]
-                                self.process_month_for_view(user_id, month)
-                            elif user_states.get(user_id) == STATES['SELECT_DAY']:
-                                month = button.split("_")[1]
-                                self.process_month_for_view(user_id, month)
-
-                        elif button.startswith("day_"):
-                            if user_states.get(user_id) == STATES['SELECT_DAY']:
-                                day = button.split("_")[1]
-                                self.process_day_for_view(user_id, day)
-
-                        elif button == "show_all_reservations":
-                            self.show_all_reservations(user_id)
-
-                        elif button == "edit_author":
-                            self.process_edit_author(user_id)
-
-                        elif button == "edit_event":
-                            self.process_edit_event(user_id)
-
-                        elif button == "edit_time":
-                            self.process_edit_time(user_id)
-
-                        elif button in ["edit_time_change_date", "edit_time_keep_date"]:
-                            self.process_edit_time_date_choice(user_id, button)
-
-                        elif button.startswith("edit_hour_period_"):
-                            if user_states.get(user_id) == STATES['EDIT_HOUR_PERIOD_SELECTION']:
-                                self.process_edit_hour_period_selection(user_id, payload)
-
-                        elif button.startswith("edit_hour_"):
-                            if user_states.get(user_id) == STATES['EDIT_HOUR_SELECTION']:
-                                hour = button.split('_')[1]
-                                self.process_edit_hour_selection(user_id, hour)
-
-                        elif button.startswith("edit_minute_"):
-                            if user_states.get(user_id) == STATES['EDIT_MINUTE_SELECTION']:
-                                self.process_edit_minute_selection(user_id, payload)
-
-                        elif button == "edit_date_back":
-                            self.process_edit_date(user_id)
-
-                        elif button.startswith("edit_duration_"):
-                            if user_states.get(user_id) == STATES['EDIT_SELECTION']:
-                                duration = button.split("_")[2]
-                                self.process_edit_field_input(user_id, {"button": button})
-
-                        elif button.startswith("edit_month_period_"):
-                            self.process_edit_month_period_selection(user_id, button)
-
-                        elif button.startswith("edit_select_month_"):
-                            parts = button.split("_")
-                            month = parts[3]
-                            year = parts[4]
-                            self.process_edit_month_selection(user_id, {"month": month, "year": year})
-
-                        elif button.startswith("day_"):
-                            day = button.split("_")[1]
-                            self.process_day_selection(user_id, day)
-
-                        elif button.startswith("hour_period_"):
-                            if user_states.get(user_id) == STATES['HOUR_PERIOD_SELECTION']:
-                                self.process_hour_period_selection(user_id, {"button": button})
-
-                        elif button.startswith("hour_"):
-                            hour = button.split("_")[1]
-                            if user_states.get(user_id) == STATES['HOUR_SELECTION']:
-                                self.process_hour_selection(user_id, hour)
-
-                        elif button.startswith("minute_"):
-                            minute = button.split("_")[1]
-                            if user_states.get(user_id) == STATES['MINUTE_SELECTION']:
-                                self.process_minute_selection(user_id, {"button": button})
-
-                        elif button.startswith("duration_"):
-                            duration = button.split("_")[1]
-                            if user_states.get(user_id) == STATES['DURATION_SELECTION']:
-                                self.process_duration_input(user_id, duration)
-
-                        elif button.startswith("select_month_"):
-                            if user_states.get(user_id) == STATES['MONTH_SELECTION']:
-                                parts = button.split("_")
-                                month = parts[2]
-                                year = parts[3]
-                                self.process_month_selection(user_id, {"month": month, "year": year})
-
-                        elif button.startswith("day_period_"):
-                            if user_states.get(user_id) == STATES['DAY_PERIOD_SELECTION']:
-                                self.process_day_period_selection(user_id, button)
-                            else:
-                                logger.error(
-                                    f"[{user_id}] Неверное состояние для day_period: {user_states.get(user_id)}")
-                                self.send_message(user_id, "❌ Пожалуйста, начните процесс бронирования сначала.")
-                                user_states[user_id] = STATES['START']
-
-                        elif button.startswith("select_day_"):
-                            if user_states.get(user_id) == STATES['DAY_SELECTION']:
-                                day = button.split("_")[2]
-                                self.process_day_selection(user_id, day)
-                            else:
-                                logger.error(
-                                    f"[{user_id}] Неверное состояние для select_day: {user_states.get(user_id)}")
-                                self.send_message(user_id, "❌ Пожалуйста, выберите период дней сначала.")
-
-                        elif button.startswith("cancel_confirm_"):
-                            reservation_id = button.split("_")[2]
-                            self.process_cancel_confirmation(user_id, reservation_id)
-
-                        elif button.startswith("confirm_cancel_"):
-                            reservation_id = button.split("_")[2]
-                            self.process_confirm_cancel(user_id, reservation_id)
-
-                        elif button.startswith("edit_booking_"):
-                            if user_states.get(user_id) == STATES['VIEW_RESERVATIONS']:
-                                booking_id = button.split('_')[-1]
-                                self.process_edit_selection(user_id, booking_id)
-                            else:
-                                logger.warning(
-                                    f"[{user_id}] Попытка редактирования из неверного состояния: {user_states.get(user_id)}")
-
-                        elif button == "edit_date":
-                            self.process_edit_date(user_id)
-                        elif button == "edit_time":
-                            self.process_edit_time(user_id)
-                        elif button == "edit_author":
-                            self.process_edit_author(user_id)
-                        elif button == "edit_event":
-                            self.process_edit_event(user_id)
-                        elif button == "edit_duration":
-                            self.process_edit_duration(user_id)
-                        elif button == "edit_cancel":
-                            self.process_cancel_edit(user_id)
-
-                    # Обработка других состояний
-                    elif user_id in user_states:
-                        state = user_states[user_id]
-
-                        if state == STATES['DAY_SELECTION']:
-                            try:
-                                day = int(text)
-                                month = int(user_data[user_id]["month"])
-                                year = int(user_data[user_id]["year"])
-                                date = f"{year}-{month:02d}-{day:02d}"
-                                if not self.is_day_fully_booked(date):
-                                    self.process_day_selection(user_id, text)
-                                else:
-                                    self.send_message(user_id, "❌ Этот день уже занят. Выберите другой день.")
-                            except ValueError:
-                                self.send_message(user_id, "❌ Пожалуйста, введите номер дня (например, 15).")
-
-                        elif state == STATES['VIEW_RESERVATIONS']:
-                            if payload and "button" in payload:
-                                button = payload["button"]
-                                if button.startswith("edit_booking_"):
-                                    booking_id = button.split('_')[-1]
-                                    self.process_edit_selection(user_id, booking_id)
-                                elif button.startswith("cancel_confirm_"):
-                                    booking_id = button.split('_')[-1]
-                                    self.process_cancel_confirmation(user_id, booking_id)
-                            else:
-                                self.send_message(user_id,
-                                                  "Пожалуйста, используйте кнопки для управления бронированиями.")
-
-                        elif state == STATES['DURATION_SELECTION']:
-                            self.process_duration_input(user_id, text)
-
-                        elif state == STATES['AUTHOR_NAME']:
-                            self.process_author_name(user_id, text)
-
-                        elif state == STATES['EVENT_NAME']:
-                            self.process_event_name(user_id, text)
-
-                        elif state == STATES['EDIT_SELECTION']:
-                            if "edit_field" in user_data[user_id]:
-                                self.process_edit_field_input(user_id, text)
 
-                    else:
-                        self.send_message(user_id, "Я не понимаю вашу команду. Используйте кнопки меню.",
-                                          self.get_main_keyboard())
+def _on_day_text(bot, message):
+    user_id = message.user_id
+    try:
+        day = int(message.text)
+        month = int(user_data[user_id]["month"])
+        year = int(user_data[user_id]["year"])
+        date = f"{year}-{month:02d}-{day:02d}"
+        if not bot.is_day_fully_booked(date):
+            bot.process_day_selection(user_id, message.text)
+        else:
+            bot.send_message(user_id, "❌ Этот день уже занят. Выберите другой день.")
+    except ValueError:
+        bot.send_message(user_id, "❌ Пожалуйста, введите номер дня (например, 15).")
+
+
+def _on_edit_field_text(bot, message):
+    if "edit_field" in user_data[message.user_id]:
+        bot.process_edit_field_input(message.user_id, message.text)
+
+
+def build_router():
+    """Собирает таблицы маршрутов ВК-бота"""
+    r = Router()
+
+    # Состояния редактирования: все сообщения идут в обработчик состояния
+    r.modal(STATES['EDIT_DAY_SELECTION'], lambda bot, m: bot.process_edit_day_selection(m.user_id, m.text),
+            when=lambda m: m.text)
+    r.modal(STATES['EDIT_TIME_DATE_CHOICE'], _on_edit_time_date_choice)
+    r.modal(STATES['EDIT_DATE_SELECTION'], _on_edit_date_selection)
+    r.modal(STATES['EDIT_MONTH_SELECTION'], _on_edit_month_selection)
+    r.modal(STATES['EDIT_TIME_PERIOD_SELECTION'], _on_edit_time_period_selection)
+    r.modal(STATES['EDIT_TIME_HOUR_SELECTION'], _on_edit_time_hour_selection)
+    r.modal(STATES['EDIT_TIME_MINUTE_SELECTION'],
+            lambda bot, m: bot.process_edit_time_minute_selection(m.user_id, m.text))
+    r.modal(STATES['EDIT_HOUR_PERIOD_SELECTION'], _on_edit_hour_period_selection)
+    r.modal(STATES['EDIT_HOUR_SELECTION'], _on_edit_hour_selection)
+    r.modal(STATES['EDIT_MINUTE_SELECTION'], _on_edit_minute_selection)
+
+    # Текстовые команды
+    start = lambda bot, m: bot.start(m.user_id)
+    r.text("начать", start)
+    r.text("start", start, ignore_case=True)
+    r.text("/start", start)
+    r.text("ℹ️ О боте", lambda bot, m: bot.about(m.user_id))
+    r.text("📌 Бронь", lambda bot, m: bot.start_reservation(m.user_id))
+    r.text("📅 Мои бронирования", lambda bot, m: bot.show_my_reservations(m.user_id))
+    r.text("📆 Общее расписание", lambda bot, m: bot.show_all_reservations(m.user_id))
+
+    # payload["action"]
+    r.action("main_menu", start)
+    r.action("show_all_reservations", lambda bot, m: bot.show_all_reservations(m.user_id))
+    r.action("schedule_month_period",
+             lambda bot, m: bot.process_schedule_month_period(m.user_id, m.payload.get("period")),
+             states=STATES['SCHEDULE_MONTH_PERIOD'])
+    r.action("schedule_current_month", lambda bot, m: bot.process_schedule_month_period(m.user_id, "current"))
+    r.action("schedule_select_month", lambda bot, m: bot.process_schedule_month_selection(m.user_id, m.payload),
+             states=STATES['SCHEDULE_MONTH_SELECTION'])
+    r.action("schedule_day_period", lambda bot, m: bot.process_schedule_day_period(m.user_id, m.payload),
+             states=STATES['SCHEDULE_DAY_PERIOD'])
+    r.action("schedule_select_day",
+             lambda bot, m: bot.process_schedule_day_selection(m.user_id, m.payload.get("day")),
+             states=STATES['SCHEDULE_DAY_SELECTION'])
+    r.action("schedule_back_to_day_periods", _on_schedule_back_to_day_periods)
+    r.action("schedule_back_to_days", _on_schedule_back_to_days)
+
+    # payload["button"]: точные значения
+    r.button("show_all_reservations", lambda bot, m: bot.show_all_reservations(m.user_id))
+    r.button("edit_date", lambda bot, m: bot.process_edit_date(m.user_id))
+    r.button("edit_date_back", lambda bot, m: bot.process_edit_date(m.user_id))
+    r.button("edit_time", lambda bot, m: bot.process_edit_time(m.user_id))
+    r.button("edit_time_change_date", lambda bot, m: bot.process_edit_time_date_choice(m.user_id, m.button))
+    r.button("edit_time_keep_date", lambda bot, m: bot.process_edit_time_date_choice(m.user_id, m.button))
+    r.button("edit_author", lambda bot, m: bot.process_edit_author(m.user_id))
+    r.button("edit_event", lambda bot, m: bot.process_edit_event(m.user_id))
+    r.button("edit_duration", lambda bot, m: bot.process_edit_duration(m.user_id))
+    r.button("edit_cancel", lambda bot, m: bot.process_cancel_edit(m.user_id))
+
+    # payload["button"]: префиксы с параметром
+    r.prefix("month_period_", lambda bot, m: bot.process_month_period_selection(m.user_id, m.button),
+             states=STATES['MONTH_PERIOD_SELECTION'])
+    r.prefix("select_month_",
+             lambda bot, m: bot.process_month_selection(m.user_id, {"month": m.button.split("_")[2],
+                                                                    "year": m.button.split("_")[3]}),
+             states=STATES['MONTH_SELECTION'])
+    r.prefix("select_day_", lambda bot, m: bot.process_day_selection(m.user_id, m.button.split("_")[2]),
+             states=STATES['DAY_SELECTION'])
+    r.prefix("select_day_", _on_select_day_wrong_state)
+    r.prefix("hour_period_", lambda bot, m: bot.process_hour_period_selection(m.user_id, {"button": m.button}),
+             states=STATES['HOUR_PERIOD_SELECTION'])
+    r.prefix("hour_", lambda bot, m: bot.process_hour_selection(m.user_id, m.button.split("_")[1]),
+             states=STATES['HOUR_SELECTION'])
+    r.prefix("minute_", lambda bot, m: bot.process_minute_selection(m.user_id, {"button": m.button}),
+             states=STATES['MINUTE_SELECTION'])
+    r.prefix("suggest_", lambda bot, m: bot.process_suggestion(m.user_id, m.button))
+    r.prefix("duration_", lambda bot, m: bot.process_duration_input(m.user_id, m.button.split("_")[1]),
+             states=STATES['DURATION_SELECTION'])
+    r.prefix("mo_", lambda bot, m: bot.process_month_for_view(m.user_id, m.button.split("_")[1]),
+             states=(STATES['SELECT_MONTH'], STATES['SELECT_DAY']))
+    r.prefix("day_", lambda bot, m: bot.process_day_for_view(m.user_id, m.button.split("_")[1]),
+             states=STATES['SELECT_DAY'])
+    r.prefix("cancel_confirm_", lambda bot, m: bot.process_cancel_confirmation(m.user_id, m.button.split("_")[2]))
+    r.prefix("confirm_cancel_", lambda bot, m: bot.process_confirm_cancel(m.user_id, m.button.split("_")[2]))
+    r.prefix("edit_booking_", lambda bot, m: bot.process_edit_selection(m.user_id, m.button.split('_')[-1]),
+             states=STATES['VIEW_RESERVATIONS'])
+    r.prefix("edit_booking_", _on_edit_booking_wrong_state)
+    r.prefix("edit_duration_", lambda bot, m: bot.process_edit_field_input(m.user_id, {"button": m.button}),
+             states=STATES['EDIT_SELECTION'])
+    r.prefix("edit_month_period_", lambda bot, m: bot.process_edit_month_period_selection(m.user_id, m.button))
+    r.prefix("edit_select_month_",
+             lambda bot, m: bot.process_edit_month_selection(m.user_id, {"month": m.button.split("_")[3],
+                                                                         "year": m.button.split("_")[4]}))
+
+    # Свободный текст по состоянию
+    r.state(STATES['DAY_SELECTION'], _on_day_text)
+    r.state(STATES['VIEW_RESERVATIONS'], lambda bot, m: bot.send_message(
+        m.user_id, "Пожалуйста, используйте кнопки для управления бронированиями."))
+    r.state(STATES['DURATION_SELECTION'], lambda bot, m: bot.process_duration_input(m.user_id, m.text))
+    r.state(STATES['AUTHOR_NAME'], lambda bot, m: bot.process_author_name(m.user_id, m.text))
+    r.state(STATES['EVENT_NAME'], lambda bot, m: bot.process_event_name(m.user_id, m.text))
+    r.state(STATES['EDIT_SELECTION'], _on_edit_field_text)
+
+    r.fallback(lambda bot, m: bot.send_message(m.user_id, "Я не понимаю вашу команду. Используйте кнопки меню.",
+                                               bot.get_main_keyboard()))
+    return r
+
+
+router = build_router()
 
-            except Exception as e:
-                logger.error(f"Ошибка при обработке события: {e}")
 
 if __name__ == "__main__":
     # Сначала создайте файл config_vk.py с переменной VK_TOKEN
@@ -0,0 +1,216 @@
+import json
+from calendar import monthrange
+from functools import lru_cache
+
+from vk_api.keyboard import VkKeyboard, VkKeyboardColor
+from vk_api.utils import sjson_dumps
+
+# Сколько вариантов каждой параметризованной клавиатуры держать в памяти
+KEYBOARD_CACHE_SIZE = 256
+
+PRIMARY = VkKeyboardColor.PRIMARY
+SECONDARY = VkKeyboardColor.SECONDARY
+POSITIVE = VkKeyboardColor.POSITIVE
+NEGATIVE = VkKeyboardColor.NEGATIVE
+
+MONTH_NAMES = [
+    "Январь", "Февраль", "Март", "Апрель",
+    "Май", "Июнь", "Июль", "Август",
+    "Сентябрь", "Октябрь", "Ноябрь", "Декабрь"
+]
+
+
+def build(rows, inline=True):
+    """Собирает клавиатуру из строк кнопок (текст, цвет, payload) и возвращает готовый JSON"""
+    keyboard = VkKeyboard(one_time=False, inline=inline)
+    for i, row in enumerate(rows):
+        if i:
+            keyboard.add_line()
+        for label, color, payload in row:
+            keyboard.add_button(label, color=color, payload=payload)
+    return keyboard.get_keyboard()
+
+
+def chunks(buttons, size):
+    return [buttons[i:i + size] for i in range(0, len(buttons), size)]
+
+
+memoized = lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+
+
+@memoized
+def callback_variant(keyboard):
+    """Та же inline-клавиатура с callback-кнопками вместо текстовых; для обычной — None.
+
+    Текст кнопки кладется в payload["label"]: при нажатии callback-кнопки
+    VK присылает только payload, а обработчикам нужен и текст.
+    """
+    data = json.loads(keyboard)
+    if not data.get("inline"):
+        return None
+    for row in data["buttons"]:
+        for button in row:
+            action = button["action"]
+            if action["type"] == "text":
+                payload = json.loads(action.get("payload") or "{}")
+                payload["label"] = action["label"]
+                action["type"] = "callback"
+                action["payload"] = sjson_dumps(payload)
+    return sjson_dumps(data)
+
+
+# Постоянные клавиатуры: собираются один раз при импорте
+
+# Пустая inline-клавиатура: убирает кнопки у отредактированного сообщения
+EMPTY_INLINE = sjson_dumps({"inline": True, "buttons": []})
+
+MAIN = build([
+    [("📆 Общее расписание", PRIMARY, None), ("📅 Мои бронирования", PRIMARY, None)],
+    [("📌 Бронь", POSITIVE, None), ("ℹ️ О боте", SECONDARY, None)],
+], inline=False)
+
+MONTH_PERIODS = build([
+    [("Январь-Апрель (1-4)", PRIMARY, {"button": "month_period_1_4"}),
+     ("Май-Август (5-8)", PRIMARY, {"button": "month_period_5_8"})],
+    [("Сентябрь-Декабрь (9-12)", PRIMARY, {"button": "month_period_9_12"})],
+])
+
+HOUR_PERIODS = build([
+    [("05:00-08:00", PRIMARY, {"button": "hour_period_5_8"}),
+     ("09:00-12:00", PRIMARY, {"button": "hour_period_9_12"})],
+    [("13:00-16:00", PRIMARY, {"button": "hour_period_13_16"}),
+     ("17:00-19:00", PRIMARY, {"button": "hour_period_17_19"})],
+])
+
+EDIT_MONTH_PERIODS = build([
+    [("Январь-Апрель", PRIMARY, {"button": "edit_month_period_1_4"}),
+     ("Май-Август", PRIMARY, {"button": "edit_month_period_5_8"})],
+    [("Сентябрь-Декабрь", PRIMARY, {"button": "edit_month_period_9_12"})],
+])
+
+EDIT_TIME_DATE_CHOICE = build([
+    [("Изменить дату", PRIMARY, {"button": "edit_time_change_date"})],
+    [("Оставить текущую дату", SECONDARY, {"button": "edit_time_keep_date"})],
+])
+
+EDIT_TIME_PERIODS = build([
+    [("5:00-8:00", PRIMARY, {"button": "edit_time_period_5_8"}),
+     ("9:00-12:00", PRIMARY, {"button": "edit_time_period_9_12"})],
+    [("13:00-16:00", PRIMARY, {"button": "edit_time_period_13_16"}),
+     ("17:00-20:00", PRIMARY, {"button": "edit_time_period_17_20"})],
+])
+
+EDIT_HOUR_PERIODS = build([
+    [("5-8", PRIMARY, {"button": "edit_hour_period_5_8"}),
+     ("9-12", PRIMARY, {"button": "edit_hour_period_9_12"})],
+    [("13-16", PRIMARY, {"button": "edit_hour_period_13_16"}),
+     ("17-19", PRIMARY, {"button": "edit_hour_period_17_19"})],
+])
+
+# Часы 09-22 по четыре в строке; payload hour_ЧЧ:00
+TIME = build(chunks([(f"{hour:02d}", PRIMARY, {"button": f"hour_{hour:02d}:00"}) for hour in range(9, 23)], 4))
+
+SCHEDULE_MONTH_PERIODS = build([
+    [("Январь-Апрель", PRIMARY, {"action": "schedule_month_period", "period": "1_4"}),
+     ("Май-Август", PRIMARY, {"action": "schedule_month_period", "period": "5_8"})],
+    [("Сентябрь-Декабрь", PRIMARY, {"action": "schedule_month_period", "period": "9_12"})],
+    [("Текущий месяц", POSITIVE, {"action": "schedule_current_month"}),
+     ("Главное меню", SECONDARY, {"action": "main_menu"})],
+])
+
+
+# Параметризованные клавиатуры: зависят только от аргументов, поэтому кэшируются.
+# Если клавиатура зависит от текущей даты, дата передается аргументом.
+
+@memoized
+def minutes(prefix):
+    """Минуты 00/15/30/45 по две в строке; payload {prefix}_{минуты}"""
+    return build(chunks([(minute, PRIMARY, {"button": f"{prefix}_{minute}"})
+                         for minute in ("00", "15", "30", "45")], 2))
+
+
+@memoized
+def durations(prefix):
+    """Длительности по одной в строке; payload {prefix}_{минуты}"""
+    return build([[(f"{duration} мин", PRIMARY, {"button": f"{prefix}_{duration}"})]
+                  for duration in ("30", "60", "120", "180")])
+
+
+@memoized
+def hours(available):
+    """Свободные часы периода, по три в строке"""
+    return build(chunks([(hour, PRIMARY, {"button": f"hour_{hour}"}) for hour in available], 3))
+
+
+@memoized
+def months(prefix, current_month):
+    """Двенадцать месяцев начиная с текущего, строки по кварталам; следующий год — серым"""
+    rows, row = [], []
+    for month in list(range(current_month, 13)) + list(range(1, current_month)):
+        label = f"{month:02d}" if month >= current_month else f"{month:02d} (след. год)"
+        row.append((label, PRIMARY if month >= current_month else SECONDARY, {"button": f"{prefix}_{month:02d}"}))
+        if month % 4 == 0:
+            rows.append(row)
+            row = []
+    return build(rows + ([row] if row else []))
+
+
+@memoized
+def month_choice(months, current_year, current_month):
+    """Месяцы периода для бронирования; прошедшие в этом году — на следующий год"""
+    buttons = []
+    for month in months:
+        year = current_year + 1 if month < current_month else current_year
+        label = f"{MONTH_NAMES[month - 1]} ({year})" if year > current_year else MONTH_NAMES[month - 1]
+        buttons.append((label, PRIMARY, {"button": f"select_month_{month}_{year}"}))
+    return build(chunks(buttons, 2))
+
+
+@memoized
+def edit_month_choice(months, current_year, current_month):
+    """Месяцы периода для новой даты бронирования"""
+    buttons = []
+    for month in months:
+        year = current_year + 1 if month < current_month else current_year
+        label = f"{MONTH_NAMES[month - 1]} {year}" if year > current_year else MONTH_NAMES[month - 1]
+        buttons.append((label, PRIMARY, {"button": f"edit_select_month_{month}_{year}"}))
+    return build(chunks(buttons, 2))
+
+
+@memoized
+def schedule_months(start_month, end_month, current_year, current_month):
+    """Месяцы периода для просмотра расписания и кнопка возврата"""
+    buttons = []
+    for month in range(start_month, end_month + 1):
+        if month >= current_month:
+            buttons.append((MONTH_NAMES[month - 1], PRIMARY,
+                            {"action": "schedule_select_month", "month": month, "year": current_year}))
+        else:
+            buttons.append((f"{MONTH_NAMES[month - 1]} ({current_year + 1})", SECONDARY,
+                            {"action": "schedule_select_month", "month": month, "year": current_year + 1}))
+    return build(chunks(buttons, 2) + [[("Назад к периодам", SECONDARY, {"action": "show_all_reservations"})]])
+
+
+@memoized
+def schedule_day_periods(year, month):
+    """Месяц, разбитый на четыре периода дней, и кнопка возврата"""
+    _, num_days = monthrange(year, month)
+    period_size = max(1, num_days // 4)
+    buttons = []
+    for i in range(4):
+        start = i * period_size + 1
+        end = (i + 1) * period_size if i < 3 else num_days
+        buttons.append((f"{start}-{end}" if start != end else f"{start}", PRIMARY,
+                        {"action": "schedule_day_period", "start": start, "end": end}))
+    return build(chunks(buttons, 2) + [[("Назад к месяцам", SECONDARY, {"action": "show_all_reservations"})]])
+
+
+@memoized
+def view_days(prefix, days):
+    """Дни одной строкой (days — пары (день, занят полностью)) и навигация"""
+    row = [(f"{day:02d} 🔴", NEGATIVE, {"button": f"{prefix}_{day:02d}"}) if fully_booked
+           else (f"{day:02d}", PRIMARY, {"button": f"{prefix}_{day:02d}"})
+           for day, fully_booked in days]
+    navigation = [("Выбрать другой месяц", PRIMARY, {"button": "show_all_reservations"}),
+                  ("Главное меню", SECONDARY, {"button": "main_menu"})]
+    return build(([row] if row else []) + [navigation])
@@ -1,10 +1,11 @@
 #!/usr/bin/env python3
 # clear_db.py - Надежный скрипт для очистки базы данных
 
-import sqlite3
 from datetime import datetime
 import os
 
+from db.connection import get_connection, close_connection
+
 
 def clear_database():
     """Очищает базу данных с правильным управлением транзакциями"""
@@ -12,9 +13,8 @@ def clear_database():
     try:
         print("\nНачало очистки базы данных...")
 
-        # Подключаемся к базе данных с ручным управлением транзакциями
-        conn = sqlite3.connect('reservations.db')
-        conn.execute("PRAGMA journal_mode = WAL")  # Более надежный режим
+        # Соединение из общего менеджера (WAL и прочие PRAGMA уже настроены)
+        conn = get_connection()
         cursor = conn.cursor()
 
         # Получаем список всех пользовательских таблиц
@@ -35,13 +35,9 @@ def clear_database():
                 print(f"Ошибка при очистке таблицы {table}: {e}")
                 conn.rollback()
 
-        # Оптимизация базы данных (требует отдельного соединения)
-        conn.close()
+        # Оптимизация базы данных (вне транзакции: все изменения уже зафиксированы)
         print("Выполняем оптимизацию базы данных...")
-
-        # Новое соединение для VACUUM
-        with sqlite3.connect('reservations.db') as vacuum_conn:
-            vacuum_conn.execute("VACUUM;")
+        conn.execute("VACUUM;")
 
         print(f"\n✅ База данных успешно очищена и оптимизирована {datetime.now()}")
 
@@ -51,7 +47,7 @@ def clear_database():
             conn.rollback()
     finally:
         if conn:
-            conn.close()
+            close_connection()
 
 
 def create_backup():
@@ -6,4 +6,20 @@ load_dotenv()
 TGTOKEN = os.getenv("TG_TOKEN")
 VK_TOKEN = os.getenv("VK_TOKEN")
 
-DATABASE = 'reservations.db'
\ No newline at end of file
+DATABASE = 'reservations.db'
+# Сколько мероприятий может идти одновременно (число столиков/залов): учитывается при проверке
+# пересечений в бронировании, в индексе свободного времени и в календаре
+CAPACITY = int(os.getenv("CAPACITY", 1))
+# Сколько потоков обрабатывают события ВК (события одного пользователя — всегда в одном)
+VK_WORKERS = int(os.getenv("VK_WORKERS", 4))
+# Режим callback-кнопок ВК: нажатие inline-кнопки правит то же сообщение вместо отправки нового.
+# Нужен Bots Long Poll сообщества (VK_GROUP_ID); клиенты без callback-кнопок получают обычные
+VK_CALLBACK_BUTTONS = os.getenv("VK_CALLBACK_BUTTONS", "0") == "1"
+VK_GROUP_ID = int(os.getenv("VK_GROUP_ID", 0))
+# При запуске сначала разобрать накопленные за ночь сообщения (bots.backlog): повторы
+# схлопываются, пользователи с бронированиями идут первыми
+BACKLOG_DRAIN = os.getenv("BACKLOG_DRAIN", "1") == "1"
+# Режим процессов (main, processes): каждый бот в своем процессе, общая база в режиме WAL.
+# BOT_WRITER_PROCESS — все записи в базу через отдельный процесс писателя
+BOT_PROCESSES = os.getenv("BOT_PROCESSES", "0") == "1"
+BOT_WRITER_PROCESS = os.getenv("BOT_WRITER_PROCESS", "0") == "1"
@@ -0,0 +1,255 @@
+import heapq
+import logging
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+
+from db.connection import connection
+from db.events import subscribe
+from config import CAPACITY
+from db.occupancy import DayBitmap, FREE, full_blocks
+from db.timeslots import WORKDAY_START, WORKDAY_END, date_to_day, day_to_date
+
+logger = logging.getLogger(__name__)
+
+# Сколько дней держать в памяти одновременно
+MAX_CACHED_DAYS = 366
+
+# Подсказки свободного времени: сколько вариантов и на сколько дней вперед искать
+SUGGESTION_COUNT = 3
+SUGGESTION_DAYS = 14
+
+MINUTES_PER_DAY = 24 * 60
+
+
+class DayIntervals:
+    """Занятые интервалы одного дня.
+
+    Хранит бронирования {id: (start, end)}, построенные по ним
+    отсортированные и непересекающиеся блоки занятости (starts/ends) — время,
+    когда заняты все capacity мест (db.occupancy.full_blocks), — и
+    поминутную карту этих блоков в рабочем дне (db.occupancy.DayBitmap).
+    Проверки внутри рабочего дня идут по карте, за его пределами — через
+    bisect по блокам. Объект не изменяется: with_interval/without возвращают
+    новый (карта копируется и правится только в затронутом диапазоне),
+    поэтому читатели из других потоков всегда видят целостный снимок.
+    """
+
+    __slots__ = ("entries", "capacity", "starts", "ends", "_bitmap")
+
+    def __init__(self, entries=None, bitmap=None, capacity=CAPACITY):
+        self.entries = dict(entries or {})
+        self.capacity = capacity
+        self._bitmap = bitmap
+        blocks = full_blocks(self.entries.values(), capacity)
+        self.starts = [start for start, _ in blocks]
+        self.ends = [end for _, end in blocks]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return f"DayIntervals({list(zip(self.starts, self.ends))})"
+
+    @property
+    def bitmap(self):
+        """Поминутная карта занятости (строится при первом обращении)"""
+        if self._bitmap is None:
+            self._bitmap = DayBitmap.from_intervals(zip(self.starts, self.ends))
+        return self._bitmap
+
+    def _changed(self, entries, start, end):
+        """Новый снимок с entries; занятость могла измениться только в [start, end)"""
+        intervals = DayIntervals(entries, capacity=self.capacity)
+        if self._bitmap is not None:
+            bitmap = self._bitmap.copy()
+            bitmap.mark(start, end, FREE)
+            for block_start, block_end in zip(intervals.starts, intervals.ends):
+                if block_start < end and block_end > start:
+                    bitmap.mark(max(block_start, start), min(block_end, end))
+            intervals._bitmap = bitmap
+        return intervals
+
+    def with_interval(self, reservation_id, start, end):
+        if reservation_id in self.entries:
+            return self.without(reservation_id).with_interval(reservation_id, start, end)
+        entries = dict(self.entries)
+        entries[reservation_id] = (start, end)
+        return self._changed(entries, start, end)
+
+    def without(self, reservation_id):
+        """Интервалы дня без указанного бронирования (для редактирования)"""
+        if reservation_id not in self.entries:
+            return self
+        entries = dict(self.entries)
+        start, end = entries.pop(reservation_id)
+        return self._changed(entries, start, end)
+
+    def intervals(self):
+        """Бронирования дня [(start, end), ...], отсортированные по началу"""
+        return sorted(self.entries.values())
+
+    def _first_block_ending_after(self, minute):
+        # Индекс первого блока, который заканчивается позже minute
+        return bisect_right(self.ends, minute)
+
+    def is_free(self, start, end):
+        """Свободен ли полуинтервал [start, end)"""
+        if DayBitmap.covers(start, end):
+            return self.bitmap.is_free(start, end)
+        i = self._first_block_ending_after(start)
+        return i == len(self.starts) or self.starts[i] >= end
+
+    def next_free(self, after, duration, step=1, limit=WORKDAY_END, origin=WORKDAY_START):
+        """Начало ближайшего свободного интервала длины duration, не раньше after.
+
+        Начало выравнивается по сетке origin + k * step, интервал должен
+        закончиться не позже limit. Возвращает минуты или None.
+        """
+        if DayBitmap.covers(max(after, origin), limit):
+            return self.bitmap.next_free(after, duration, step, limit, origin)
+        candidate = max(after, origin)
+        candidate = origin + -(-(candidate - origin) // step) * step
+        i = self._first_block_ending_after(candidate)
+        while candidate + duration <= limit:
+            if i == len(self.starts) or self.starts[i] >= candidate + duration:
+                return candidate
+            # Перепрыгиваем мешающий блок целиком
+            candidate = origin + -(-(self.ends[i] - origin) // step) * step
+            i = self._first_block_ending_after(candidate)
+        return None
+
+    def free_gaps(self, day_start=WORKDAY_START, day_end=WORKDAY_END, min_length=1):
+        """Все свободные промежутки дня [(start, end), ...] длиной не меньше min_length"""
+        gaps = []
+        cursor = day_start
+        i = self._first_block_ending_after(day_start)
+        while i < len(self.starts) and self.starts[i] < day_end:
+            if self.starts[i] - cursor >= min_length:
+                gaps.append((cursor, self.starts[i]))
+            cursor = max(cursor, self.ends[i])
+            i += 1
+        if day_end - cursor >= min_length:
+            gaps.append((cursor, day_end))
+        return gaps
+
+
+class AvailabilityIndex:
+    """Кэш DayIntervals по дням.
+
+    День загружается из базы при первом обращении одним запросом по индексу
+    (day, start_minute, end_minute), а дальше обновляется по событиям
+    db.events без повторного чтения. Хранится не больше max_days дней.
+    """
+
+    def __init__(self, max_days=MAX_CACHED_DAYS):
+        self.max_days = max_days
+        self._days = OrderedDict()
+        self._lock = threading.Lock()
+        # Увеличивается при каждом изменении; загрузка, во время которой
+        # что-то изменилось, в кэш не попадает
+        self._generation = 0
+
+    def _load(self, day):
+        with connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id, start_minute, end_minute FROM reservations
+                WHERE day = ? AND start_minute IS NOT NULL
+            """, (day,))
+            return DayIntervals({row[0]: (row[1], row[2]) for row in cursor.fetchall()})
+
+    def day(self, date):
+        """DayIntervals для даты "YYYY-MM-DD" """
+        day = date_to_day(date)
+        with self._lock:
+            intervals = self._days.get(day)
+            if intervals is not None:
+                self._days.move_to_end(day)
+                return intervals
+            generation = self._generation
+
+        intervals = self._load(day)
+
+        with self._lock:
+            if generation == self._generation:
+                self._days[day] = intervals
+                while len(self._days) > self.max_days:
+                    self._days.popitem(last=False)
+        return intervals
+
+    def apply(self, change):
+        """Обработчик db.events: точечно обновляет загруженные дни"""
+        with self._lock:
+            self._generation += 1
+            if change is None:
+                self._days.clear()
+                return
+            if change.old:
+                day = date_to_day(change.old[0])
+                if day in self._days:
+                    self._days[day] = self._days[day].without(change.reservation_id)
+            if change.new and change.new[1] is not None:
+                date, start, end = change.new
+                day = date_to_day(date)
+                if day in self._days:
+                    self._days[day] = self._days[day].with_interval(change.reservation_id, start, end)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._days.clear()
+
+
+# Общий индекс процесса: его используют оба бота
+index = AvailabilityIndex()
+subscribe(index.apply)
+
+
+def get_day_intervals(date, exclude_id=None):
+    """DayIntervals для даты; exclude_id — не учитывать это бронирование"""
+    intervals = index.day(date)
+    if exclude_id is not None:
+        intervals = intervals.without(int(exclude_id))
+    return intervals
+
+
+def suggest_slots(date, start, duration, k=SUGGESTION_COUNT, days=SUGGESTION_DAYS, step=15,
+                  limit=WORKDAY_END, not_before=None):
+    """k ближайших к запрошенному времени свободных вариантов [(date, start_minute), ...].
+
+    Поиск идет от date вперед на days дней по спискам свободных окон
+    (free_gaps) каждого дня; варианты выравниваются по сетке step от начала
+    рабочего дня и упорядочены по расстоянию от date + start. Как только
+    найдено k вариантов, а следующий день заведомо дальше худшего из них,
+    поиск останавливается — обычно просматривается один-два дня.
+    not_before — datetime, раньше которого варианты не предлагаются.
+    """
+    first_day = date_to_day(date)
+    earliest = None
+    if not_before is not None:
+        earliest = not_before.date().toordinal() * MINUTES_PER_DAY + not_before.hour * 60 + not_before.minute
+    requested = first_day * MINUTES_PER_DAY + start
+
+    # Куча худших из лучших: (-расстояние, -момент), на вершине — худший вариант
+    best = []
+    for offset in range(days):
+        day = first_day + offset
+        if len(best) == k and day * MINUTES_PER_DAY + WORKDAY_START - requested > -best[0][0]:
+            break
+
+        date_str = day_to_date(day)
+        for gap_start, gap_end in get_day_intervals(date_str).free_gaps(day_end=limit, min_length=duration):
+            slot = WORKDAY_START + -(-(gap_start - WORKDAY_START) // step) * step
+            for slot in range(slot, gap_end - duration + 1, step):
+                moment = day * MINUTES_PER_DAY + slot
+                if earliest is not None and moment < earliest:
+                    continue
+                item = (-abs(moment - requested), -moment)
+                if len(best) < k:
+                    heapq.heappush(best, item)
+                elif item > best[0]:
+                    heapq.heapreplace(best, item)
+
+    return [(day_to_date(-moment // MINUTES_PER_DAY), -moment % MINUTES_PER_DAY)
+            for _, moment in sorted(best, reverse=True)]
@@ -0,0 +1,120 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from db.db import get_schedule_for_date
+from db.events import subscribe
+
+logger = logging.getLogger(__name__)
+
+# Сколько дат держать в кэше и сколько секунд считать запись свежей.
+# TTL страхует от записей в обход db.db (clear_db.py, другой процесс).
+SCHEDULE_CACHE_SIZE = 256
+SCHEDULE_CACHE_TTL = 300
+
+# Раз в столько обращений счетчики кэша пишутся в лог
+STATS_LOG_EVERY = 1000
+
+
+class _Entry:
+    __slots__ = ("rows", "rendered", "expires")
+
+    def __init__(self, rows, expires):
+        self.rows = rows
+        self.rendered = {}
+        self.expires = expires
+
+
+class ScheduleCache:
+    """Общий кэш расписаний по датам: строки из базы и готовые тексты.
+
+    Записи вытесняются по LRU и по TTL, а при любой записи в базу
+    (db.events) сбрасываются только затронутые даты. Счетчики попаданий
+    и промахов доступны через stats().
+    """
+
+    def __init__(self, loader, max_dates=SCHEDULE_CACHE_SIZE, ttl=SCHEDULE_CACHE_TTL):
+        self.loader = loader
+        self.max_dates = max_dates
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._stats = {"hits": 0, "misses": 0, "render_hits": 0, "render_misses": 0,
+                       "evictions": 0, "expired": 0, "invalidations": 0}
+
+    def _entry(self, date):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(date)
+            if entry is not None and entry.expires <= now:
+                del self._entries[date]
+                self._stats["expired"] += 1
+                entry = None
+            self._stats["hits" if entry is not None else "misses"] += 1
+            log_now = (self._stats["hits"] + self._stats["misses"]) % STATS_LOG_EVERY == 0
+            if entry is not None:
+                self._entries.move_to_end(date)
+            generation = self._generation
+
+        if log_now:
+            logger.info(f"Кэш расписаний: {self.stats()}")
+        if entry is not None:
+            return entry
+
+        entry = _Entry(tuple(self.loader(date)), now + self.ttl)
+
+        with self._lock:
+            # Пока читали базу, дата могла измениться — такую запись не сохраняем
+            if generation == self._generation:
+                self._entries[date] = entry
+                while len(self._entries) > self.max_dates:
+                    self._entries.popitem(last=False)
+                    self._stats["evictions"] += 1
+        return entry
+
+    def rows(self, date):
+        """Бронирования даты (как db.get_schedule_for_date)"""
+        return self._entry(date).rows
+
+    def rendered(self, date, view, render):
+        """Текст представления view для даты; render(rows) вызывается только при промахе"""
+        entry = self._entry(date)
+        text = entry.rendered.get(view)
+        if text is None:
+            text = entry.rendered[view] = render(entry.rows)
+            with self._lock:
+                self._stats["render_misses"] += 1
+        else:
+            with self._lock:
+                self._stats["render_hits"] += 1
+        return text
+
+    def invalidate(self, change):
+        """Обработчик db.events: сбрасывает даты, которых коснулось изменение"""
+        with self._lock:
+            self._generation += 1
+            if change is None:
+                self._stats["invalidations"] += len(self._entries)
+                self._entries.clear()
+                return
+            for date in change.dates:
+                if self._entries.pop(date, None) is not None:
+                    self._stats["invalidations"] += 1
+
+    def clear(self):
+        self.invalidate(None)
+
+    def stats(self):
+        """Счетчики кэша и доля попаданий"""
+        with self._lock:
+            stats = dict(self._stats, size=len(self._entries))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+# Общий кэш процесса для обоих ботов
+schedule_cache = ScheduleCache(get_schedule_for_date)
+subscribe(schedule_cache.invalidate)
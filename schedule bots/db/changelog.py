@@ -0,0 +1,103 @@
+import json
+import logging
+import os
+import threading
+
+from db.connection import connection, close_connection
+from db.events import ReservationChange, publish
+from db.migrations import migrate
+
+logger = logging.getLogger(__name__)
+
+# Как часто процесс проверяет журнал на чужие изменения, секунды
+CHANGE_POLL_INTERVAL = 0.5
+
+# Сколько последних записей журнала хранить; отставший сильнее процесс сбрасывает кэши целиком
+CHANGES_KEPT = 10_000
+
+
+def _encode(interval):
+    return json.dumps(list(interval)) if interval else None
+
+
+def _decode(value):
+    return tuple(json.loads(value)) if value else None
+
+
+def record(cursor, entries):
+    """Пишет изменения [(pid, ReservationChange или None), ...] в журнал в транзакции писателя.
+
+    Нужен, когда с базой работают несколько процессов (main, BOT_PROCESSES):
+    события db.events видны только в своем процессе, а остальные узнают
+    об изменениях из журнала (ChangeFeed). pid — процесс, который уже
+    опубликовал изменение у себя.
+    """
+    if not entries:
+        return
+    cursor.executemany("INSERT INTO reservation_changes (pid, reservation_id, old, new) VALUES (?, ?, ?, ?)",
+                       [(pid, None, None, None) if change is None
+                        else (pid, change.reservation_id, _encode(change.old), _encode(change.new))
+                        for pid, change in entries])
+    cursor.execute("DELETE FROM reservation_changes WHERE seq <= last_insert_rowid() - ?", (CHANGES_KEPT,))
+
+
+class ChangeFeed:
+    """Поток, публикующий в db.events изменения, сделанные другими процессами.
+
+    Раз в interval секунд читает из журнала записи после последней
+    прочитанной (по первичному ключу) и публикует те, что записал не этот
+    процесс. Если журнал успели обрезать, публикуется None — подписчики
+    сбрасывают кэши целиком.
+    """
+
+    def __init__(self, interval=CHANGE_POLL_INTERVAL, name="changefeed"):
+        self.interval = interval
+        self.name = name
+        self.applied = 0
+        self._last = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        migrate()
+        with connection() as conn:
+            self._last = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM reservation_changes").fetchone()[0]
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Ошибка чтения журнала изменений: {e}")
+        close_connection()
+
+    def poll(self):
+        """Публикует новые чужие изменения; возвращает их число"""
+        with connection() as conn:
+            rows = conn.execute("""
+                SELECT seq, pid, reservation_id, old, new FROM reservation_changes
+                WHERE seq > ? ORDER BY seq
+            """, (self._last,)).fetchall()
+        if not rows:
+            return 0
+
+        pid = os.getpid()
+        if rows[0][0] > self._last + 1:
+            # Пропущенные записи уже удалены: что именно изменилось, неизвестно
+            publish(None)
+        published = 0
+        for seq, writer_pid, reservation_id, old, new in rows:
+            if writer_pid != pid:
+                publish(None if reservation_id is None
+                        else ReservationChange(reservation_id, _decode(old), _decode(new)))
+                published += 1
+        self._last = rows[-1][0]
+        self.applied += published
+        return published
@@ -0,0 +1,131 @@
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from config import DATABASE
+
+logger = logging.getLogger(__name__)
+
+# Размер кэша подготовленных выражений для каждого соединения
+STATEMENT_CACHE_SIZE = 256
+
+# Единая настройка соединения: выполняется один раз при его открытии
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -8000",
+)
+
+_local = threading.local()
+_registry_lock = threading.Lock()
+_connections = {}  # thread_id -> соединение, нужно для close_all()
+_generation = 0  # увеличивается в close_all(), чтобы потоки открыли соединения заново
+
+
+def _open_connection():
+    """Открывает и настраивает новое соединение с базой данных"""
+    conn = sqlite3.connect(
+        DATABASE,
+        timeout=5.0,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False,  # закрыть соединение может и другой поток (close_all)
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_connection():
+    """Возвращает переиспользуемое соединение текущего потока.
+
+    Каждый поток (поток ВК-бота, цикл событий Telegram) получает своё
+    соединение, которое открывается один раз и живёт до close_connection().
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "generation", None) != _generation:
+        conn = _open_connection()
+        _local.conn = conn
+        _local.generation = _generation
+        with _registry_lock:
+            _connections[threading.get_ident()] = conn
+        logger.debug(f"Открыто соединение с БД для потока {threading.current_thread().name}")
+    return conn
+
+
+@contextmanager
+def connection():
+    """Контекстный менеджер над соединением потока.
+
+    При успешном выходе фиксирует транзакцию, при исключении откатывает её.
+    Само соединение не закрывается и переиспользуется следующими вызовами.
+    """
+    conn = get_connection()
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+
+
+@contextmanager
+def transaction():
+    """Транзакция записи BEGIN IMMEDIATE над соединением потока.
+
+    Блокировка записи берется сразу, поэтому проверка и последующая запись
+    выполняются атомарно относительно других потоков и процессов. Вложенный
+    вызов превращается в SAVEPOINT внутри уже открытой транзакции.
+    """
+    conn = get_connection()
+    if conn.in_transaction:
+        savepoint = f"sp_{id(object())}"
+        conn.execute(f"SAVEPOINT {savepoint}")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute(f"ROLLBACK TO {savepoint}")
+            conn.execute(f"RELEASE {savepoint}")
+            raise
+        else:
+            conn.execute(f"RELEASE {savepoint}")
+        return
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+
+
+def close_connection():
+    """Закрывает соединение текущего потока"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        return
+    _local.conn = None
+    with _registry_lock:
+        _connections.pop(threading.get_ident(), None)
+    conn.close()
+
+
+def close_all():
+    """Закрывает соединения всех потоков (при остановке приложения)"""
+    global _generation
+    with _registry_lock:
+        connections = list(_connections.values())
+        _connections.clear()
+        _generation += 1
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Не удалось закрыть соединение с БД: {e}")
+    _local.conn = None
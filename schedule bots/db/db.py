@@ -1,32 +1,26 @@
-from datetime import datetime, timedelta
 import re
 import sqlite3
 import logging
 
+from config import CAPACITY
+from db.availability import get_day_intervals
+from db.connection import connection, get_connection
+from db.events import ReservationChange
+from db.migrations import migrate
+from db.occupancy import full_blocks
+from db.timeslots import WORKDAY_START, DEFAULT_DURATION, time_to_minutes, minutes_to_time, date_to_day, overlaps
+from db.writer import writer
+
 logger = logging.getLogger(__name__)
 
 # Инициализация базы данных
 def init_db():
-    conn = sqlite3.connect('reservations.db')
-    cursor = conn.cursor()
-
-    # Создаем таблицу с полями для продолжительности и дополнительной информации
-    cursor.execute('''CREATE TABLE IF NOT EXISTS reservations (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER,
-                        username TEXT,
-                        author_name TEXT,
-                        event_name TEXT, 
-                        date TEXT,
-                        time TEXT,
-                        duration INTEGER)''')  # Добавлено поле для продолжительности
-    conn.commit()
-    conn.close()
+    """Создает схему и применяет недостающие миграции (см. db.migrations)"""
+    migrate()
 
 def get_db_connection():
-    conn = sqlite3.connect('reservations.db')  # или другие параметры подключения
-    conn.row_factory = sqlite3.Row  # опционально
-    return conn
+    """Возвращает переиспользуемое соединение текущего потока (см. db.connection)"""
+    return get_connection()
 
 def is_valid_time(time_str):
     """Проверяет корректность формата времени HH:MM"""
@@ -46,51 +40,165 @@ def is_valid_time(time_str):
     except ValueError:
         return False
 
+class BookingResult:
+    """Результат попытки бронирования.
+
+    Истинен, если запись выполнена; иначе conflict содержит пересекающееся
+    бронирование (словарь с полями таблицы reservations).
+    """
+
+    def __init__(self, success, reservation_id=None, conflict=None):
+        self.success = success
+        self.reservation_id = reservation_id
+        self.conflict = conflict
+
+    def __bool__(self):
+        return self.success
+
+    def __repr__(self):
+        return f"BookingResult(success={self.success}, reservation_id={self.reservation_id}, conflict={self.conflict})"
+
+
+CONFLICT_FIELDS = ("id", "user_id", "username", "author_name", "event_name", "date", "time", "duration")
+
+
+def _find_conflict(cursor, day, start, end, exclude_id=None, capacity=CAPACITY):
+    """Ищет бронирование, из-за которого в [start, end) указанного дня нет свободного места.
+
+    Пересечения допускаются, пока вместе с новым интервалом одновременно
+    идут не больше capacity мероприятий (при capacity = 1 — любое
+    пересечение). Возвращает самое раннее бронирование, пересекающееся с
+    первым полностью занятым отрезком, или None.
+    """
+    query = f"""
+        SELECT {", ".join(CONFLICT_FIELDS)}, start_minute, end_minute FROM reservations
+        WHERE day = ? AND start_minute < ? AND end_minute > ?
+    """
+    params = [day, end, start]
+    if exclude_id is not None:
+        query += " AND id != ?"
+        params.append(exclude_id)
+    query += " ORDER BY start_minute"
+
+    cursor.execute(query, params)
+    rows = cursor.fetchall()
+    if len(rows) < capacity:
+        return None
+    blocks = full_blocks([(max(row[-2], start), min(row[-1], end)) for row in rows], capacity)
+    if not blocks:
+        return None
+    block_start, block_end = blocks[0]
+    for row in rows:
+        if row[-2] < block_end and row[-1] > block_start:
+            return dict(zip(CONFLICT_FIELDS, row))
+
+
+def _validate_duration(duration):
+    try:
+        duration = int(duration)
+    except (ValueError, TypeError):
+        raise ValueError("Некорректная длительность. Используйте число минут")
+    if duration <= 0:
+        raise ValueError("Длительность должна быть положительным числом")
+    return duration
+
+
+def _interval_of(cursor, reservation_id):
+    """(date, start_minute, end_minute) бронирования или None"""
+    cursor.execute("SELECT date, start_minute, end_minute FROM reservations WHERE id = ?", (reservation_id,))
+    row = cursor.fetchone()
+    return tuple(row) if row else None
+
+
 # Функция для добавления бронирования
+def _add_reservation(cursor, user_id, username, author_name, event_name, date, time, duration):
+    """Проверка пересечения и вставка внутри транзакции писателя"""
+    day = date_to_day(date)
+    start = time_to_minutes(time)
+    end = start + duration
+
+    # Проверка на пересечение с существующими бронированиями
+    conflict = _find_conflict(cursor, day, start, end)
+    if conflict:
+        return BookingResult(False, conflict=conflict), ()
+
+    # Добавляем бронирование
+    cursor.execute("""
+        INSERT INTO reservations 
+        (user_id, username, author_name, event_name, date, time, duration) 
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (user_id, username, author_name, event_name, date, time, duration))
+    reservation_id = cursor.lastrowid
+    return BookingResult(True, reservation_id=reservation_id), (ReservationChange(reservation_id, new=(date, start, end)),)
+
 def add_reservation(user_id, username, author_name, event_name, date, time, duration):
-    """Добавляет новое бронирование с проверкой данных"""
+    """Добавляет новое бронирование с проверкой данных.
+
+    Проверка пересечения (start < other_end AND end > other_start) и вставка
+    выполняются писателем (db.writer) в одной транзакции BEGIN IMMEDIATE,
+    поэтому параллельные бронирования из ВК и Telegram не могут занять
+    больше CAPACITY мест в одно время. Возвращает BookingResult.
+    """
     try:
         # Проверяем формат времени
         if not is_valid_time(time):
             raise ValueError("Некорректный формат времени. Используйте HH:MM")
 
         # Проверяем длительность
-        try:
-            duration = int(duration)
-            if duration <= 0:
-                raise ValueError("Длительность должна быть положительным числом")
-        except (ValueError, TypeError):
-            raise ValueError("Некорректная длительность. Используйте число минут")
-
-        with sqlite3.connect('reservations.db') as conn:
-            cursor = conn.cursor()
+        duration = _validate_duration(duration)
 
-            # Проверка на наличие бронирования
-            cursor.execute("""
-                SELECT 1 FROM reservations 
-                WHERE date = ? AND time = ?
-            """, (date, time))
-
-            if cursor.fetchone():
-                return False
-
-            # Добавляем бронирование
-            cursor.execute("""
-                INSERT INTO reservations 
-                (user_id, username, author_name, event_name, date, time, duration) 
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (user_id, username, author_name, event_name, date, time, duration))
-
-            conn.commit()
-            return True
+        return writer.execute(_add_reservation, user_id, username, author_name, event_name, date, time, duration)
 
     except sqlite3.Error as e:
         logger.error(f"Ошибка базы данных: {e}")
-        return False
+        return BookingResult(False)
     except Exception as e:
         logger.error(f"Ошибка при добавлении бронирования: {e}")
         raise
 
+def _reschedule(cursor, reservation_id, date=None, time=None, duration=None):
+    """Перенос внутри уже открытой транзакции: (BookingResult, (ReservationChange,) или ())"""
+    cursor.execute("SELECT date, time, duration, start_minute, end_minute FROM reservations WHERE id = ?",
+                   (reservation_id,))
+    current = cursor.fetchone()
+    if not current:
+        logger.warning(f"Бронирование ID {reservation_id} не найдено в базе.")
+        return BookingResult(False), ()
+
+    date = date or current[0]
+    time = time or current[1]
+    duration = duration or current[2] or DEFAULT_DURATION
+
+    start = time_to_minutes(time)
+    end = start + int(duration)
+    conflict = _find_conflict(cursor, date_to_day(date), start, end, exclude_id=reservation_id)
+    if conflict:
+        return BookingResult(False, reservation_id=reservation_id, conflict=conflict), ()
+
+    cursor.execute("UPDATE reservations SET date = ?, time = ?, duration = ? WHERE id = ?",
+                   (date, time, duration, reservation_id))
+    change = ReservationChange(int(reservation_id), old=(current[0], current[3], current[4]), new=(date, start, end))
+    return BookingResult(True, reservation_id=reservation_id), (change,)
+
+# Функция для переноса бронирования
+def reschedule_reservation(reservation_id, date=None, time=None, duration=None):
+    """Переносит бронирование на новую дату/время/длительность с проверкой пересечений.
+
+    Непереданные поля берутся из текущей записи. Как и add_reservation,
+    выполняется писателем в одной транзакции и возвращает BookingResult.
+    """
+    try:
+        if time is not None and not is_valid_time(time):
+            raise ValueError("Некорректный формат времени. Используйте HH:MM")
+        if duration is not None:
+            duration = _validate_duration(duration)
+
+        return writer.execute(_reschedule, reservation_id, date, time, duration)
+
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка базы данных при переносе бронирования ID {reservation_id}: {e}")
+        return BookingResult(False, reservation_id=reservation_id)
+
 def is_valid_time(time_str):
     """Проверка формата времени HH:MM"""
     try:
@@ -106,21 +214,19 @@ def is_valid_time(time_str):
 
 def is_time_available(date, time, duration, reservations=None):
     """Проверяет доступность временного интервала"""
-    if reservations is None:
-        with sqlite3.connect('reservations.db') as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT time, duration FROM reservations WHERE date = ?", (date,))
-            reservations = cursor.fetchall()
-
     try:
-        requested_start = datetime.strptime(time, "%H:%M")
-        requested_end = requested_start + timedelta(minutes=int(duration))
+        requested_start = time_to_minutes(time)
+        requested_end = requested_start + int(duration)
+
+        if reservations is None:
+            # Занятость дня берется из индекса в памяти (db.availability)
+            return get_day_intervals(date).is_free(requested_start, requested_end)
 
         for booked_time, booked_duration in reservations:
-            booked_start = datetime.strptime(booked_time, "%H:%M")
-            booked_end = booked_start + timedelta(minutes=int(booked_duration))
+            booked_start = time_to_minutes(booked_time)
+            booked_end = booked_start + int(booked_duration)
 
-            if not (requested_end <= booked_start or requested_start >= booked_end):
+            if overlaps(requested_start, requested_end, booked_start, booked_end):
                 return False
 
         return True
@@ -130,81 +236,75 @@ def is_time_available(date, time, duration, reservations=None):
 
 def find_nearest_available_time(time, duration, existing_reservations):
     """Находит ближайшее доступное время"""
-    time_slots = [
-        "05:00", "05:30", "06:00", "06:30", "07:00", "07:30",
-        "08:00", "08:30", "09:00", "09:30", "10:00", "10:30",
-        "11:00", "11:30", "12:00", "12:30", "13:00", "13:30",
-        "14:00", "14:30", "15:00", "15:30", "16:00", "16:30",
-        "17:00", "17:30", "18:00", "18:30", "19:00", "19:30"
-    ]
-
-    requested_start = datetime.strptime(time, "%H:%M")
+    requested_start = time_to_minutes(time)
     duration = int(duration)
 
-    for slot in time_slots:
-        slot_time = datetime.strptime(slot, "%H:%M")
-        if slot_time >= requested_start:
-            is_available = True
-            slot_end = slot_time + timedelta(minutes=duration)
+    booked = [(start, start + int(res_duration))
+              for start, res_duration in ((time_to_minutes(t), d) for t, d in existing_reservations)]
 
-            for res_time, res_duration in existing_reservations:
-                res_start = datetime.strptime(res_time, "%H:%M")
-                res_end = res_start + timedelta(minutes=int(res_duration))
+    # Слоты каждые 30 минут с 05:00 до 19:30
+    for slot in range(WORKDAY_START, 20 * 60, 30):
+        if slot >= requested_start:
+            slot_end = slot + duration
+            if not any(overlaps(slot, slot_end, res_start, res_end) for res_start, res_end in booked):
+                return minutes_to_time(slot)
 
-                if not (slot_end <= res_start or slot_time >= res_end):
-                    is_available = False
-                    break
+    return None
 
-            if is_available:
-                return slot
+def get_intervals_for_date(date, exclude_id=None):
+    """Возвращает занятые интервалы дня [(start_minute, end_minute), ...], отсортированные по началу"""
+    return get_day_intervals(date, exclude_id).intervals()
 
-    return None
+def get_schedule_for_date(date):
+    """Возвращает бронирования дня вместе с интервалами в минутах, отсортированные по началу"""
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, username, author_name, event_name, date, time, duration, start_minute, end_minute
+            FROM reservations
+            WHERE day = ? AND start_minute IS NOT NULL
+            ORDER BY start_minute
+        """, (date_to_day(date),))
+        return cursor.fetchall()
 
 # Функция для получения всех бронирований
 def get_reservations():
-    conn = sqlite3.connect('reservations.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT username, author_name, event_name, date, time, duration FROM reservations")
-    reservations = cursor.fetchall()
-    conn.close()
-    return reservations
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT username, author_name, event_name, date, time, duration FROM reservations")
+        return cursor.fetchall()
 
 # Функция для получения бронирований всех пользователей
 def get_all_reservations():
     """Получает все бронирования в базе данных."""
-    conn = sqlite3.connect('reservations.db')
-    cursor = conn.cursor()
+    with connection() as conn:
+        cursor = conn.cursor()
 
-    cursor.execute("""
-        SELECT username, author_name, event_name, date, time, duration
-        FROM reservations
-    """)
-    reservations = cursor.fetchall()
-    conn.close()
-    return reservations
+        cursor.execute("""
+            SELECT username, author_name, event_name, date, time, duration
+            FROM reservations
+        """)
+        return cursor.fetchall()
 
 # Функция для получения всех бронирований пользователя
 def get_reservations_for_user(user_id):
-    conn = sqlite3.connect('reservations.db')
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, username, author_name, event_name, date, time, duration
-        FROM reservations
-        WHERE user_id = ?
-    """, (user_id,))
-    reservations = cursor.fetchall()
-    conn.close()
-    return reservations
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, username, author_name, event_name, date, time, duration
+            FROM reservations
+            WHERE user_id = ?
+        """, (user_id,))
+        return cursor.fetchall()
 
 # Функция для получения всех бронирований по дате
 def get_reservations_for_date(date):
     """Возвращает список бронирований для указанной даты"""
     try:
-        conn = sqlite3.connect('reservations.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, date, time, duration FROM reservations WHERE date = ?", (date,))
-        results = cursor.fetchall()
-        conn.close()
+        with connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, date, time, duration FROM reservations WHERE date = ?", (date,))
+            results = cursor.fetchall()
 
         # Фильтруем только валидные записи
         valid_results = []
@@ -224,89 +324,112 @@ def get_reservations_for_date(date):
         return []
 
 # Функция для удаления бронирования
+def _delete_reservation(cursor, reservation_id):
+    # Проверяем существование записи перед удалением
+    interval = _interval_of(cursor, reservation_id)
+    if not interval:
+        logger.warning(f"Бронирование ID {reservation_id} не найдено в базе.")
+        return False, ()
+
+    cursor.execute("DELETE FROM reservations WHERE id = ?", (reservation_id,))
+    if cursor.rowcount <= 0:
+        return False, ()
+    return True, (ReservationChange(int(reservation_id), old=interval),)
+
 def delete_reservation(reservation_id):
     """Удаляет бронирование из базы данных."""
     try:
-        conn = sqlite3.connect('reservations.db')
-        cursor = conn.cursor()
-
-        # Проверяем существование записи перед удалением
-        cursor.execute("SELECT * FROM reservations WHERE id = ?", (reservation_id,))
-        reservation = cursor.fetchone()
-        if not reservation:
-            logger.warning(f"Бронирование ID {reservation_id} не найдено в базе.")
-            return False
-
-        cursor.execute("DELETE FROM reservations WHERE id = ?", (reservation_id,))
-        conn.commit()
-        deleted = cursor.rowcount > 0
-        conn.close()
-        return deleted
+        return writer.execute(_delete_reservation, reservation_id)
     except Exception as e:
         logger.error(f"Ошибка удаления бронирования ID {reservation_id}: {e}")
         return False
 
+def _clean_invalid_time_entries(cursor):
+    # Находим записи с некорректным временем
+    cursor.execute("SELECT id, time FROM reservations")
+    to_delete = []
+    for row in cursor.fetchall():
+        if not re.match(r'^\d{2}:\d{2}$', row[1]):
+            to_delete.append(row[0])
+
+    if not to_delete:
+        return 0, ()
+
+    # Удаляем некорректные записи
+    cursor.execute("DELETE FROM reservations WHERE id IN ({})".format(','.join(['?'] * len(to_delete))),
+                   to_delete)
+    # None — изменились сразу все данные (см. db.events)
+    return len(to_delete), (None,)
+
 def clean_invalid_time_entries():
     """Удаляет записи с некорректным форматом времени"""
     try:
-        conn = sqlite3.connect('reservations.db')
-        cursor = conn.cursor()
-
-        # Находим записи с некорректным временем
-        cursor.execute("SELECT id, time FROM reservations")
-        to_delete = []
-        for row in cursor.fetchall():
-            if not re.match(r'^\d{2}:\d{2}$', row[1]):
-                to_delete.append(row[0])
-
-        # Удаляем некорректные записи
-        if to_delete:
-            cursor.execute("DELETE FROM reservations WHERE id IN ({})".format(','.join(['?'] * len(to_delete))),
-                           to_delete)
-            conn.commit()
-            logger.warning(f"Удалено {len(to_delete)} записей с некорректным временем")
-
-        conn.close()
+        deleted = writer.execute(_clean_invalid_time_entries)
+        if deleted:
+            logger.warning(f"Удалено {deleted} записей с некорректным временем")
     except Exception as e:
         logger.error(f"Ошибка очистки БД: {e}")
 
+# Поля, которые можно менять через update_reservation
+UPDATABLE_FIELDS = ("date", "time", "duration", "author_name", "event_name")
+
 # Функция для обновления бронирования
-def update_reservation(reservation_id, field, new_value):
-    # Логика обновления записи в базе данных или другом хранилище
-    # Пример:
+def _update_reservation(cursor, reservation_id, interval_changes, changes):
+    interval = _interval_of(cursor, reservation_id)
+    if not interval:
+        logger.warning(f"Бронирование ID {reservation_id} не найдено в базе.")
+        return False, ()
+
+    updated = (ReservationChange(int(reservation_id), old=interval, new=interval),)
+    if interval_changes:
+        result, updated = _reschedule(cursor, reservation_id, **interval_changes)
+        if not result:
+            return False, ()
+
+    for key, value in changes.items():
+        cursor.execute(f"UPDATE reservations SET {key} = ? WHERE id = ?", (value, reservation_id))
+    return True, updated
+
+def update_reservation(reservation_id, field, new_value=None):
+    """Обновляет поля бронирования.
+
+    Принимает либо имя поля и значение, либо словарь {поле: значение}.
+    Изменение даты, времени или длительности проходит ту же проверку
+    пересечений, что и reschedule_reservation.
+    """
+    changes = dict(field) if isinstance(field, dict) else {field: new_value}
+    unknown = set(changes) - set(UPDATABLE_FIELDS)
+    if unknown:
+        logger.warning(f"Недопустимые поля для обновления бронирования ID {reservation_id}: {unknown}")
+        return False
+
     try:
-        # Пример обновления резервации (можно заменить на реальную логику)
-        # update database query here
-        print(f"Updating reservation {reservation_id}: {field} = {new_value}")
-        return True  # Возвращаем True при успешном обновлении
+        interval_changes = {key: changes.pop(key) for key in ("date", "time", "duration") if key in changes}
+        if interval_changes.get("time") is not None and not is_valid_time(interval_changes["time"]):
+            raise ValueError("Некорректный формат времени. Используйте HH:MM")
+        if interval_changes.get("duration") is not None:
+            interval_changes["duration"] = _validate_duration(interval_changes["duration"])
+
+        return writer.execute(_update_reservation, reservation_id, interval_changes, changes)
     except Exception as e:
-        print(f"Error updating reservation: {str(e)}")
+        logger.error(f"Ошибка обновления бронирования ID {reservation_id}: {e}")
         return False
 
 # Функция для сохранения бронирования
+def _save_reservation(cursor, user_id, username, author_name, event_name, date, time, duration):
+    cursor.execute("""
+        INSERT INTO reservations 
+        (user_id, username, author_name, event_name, date, time, duration) 
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (user_id, username, author_name, event_name, date, time, duration))
+    reservation_id = cursor.lastrowid
+    return reservation_id, (ReservationChange(reservation_id, new=_interval_of(cursor, reservation_id)),)
+
 def save_reservation(user_id, username, author_name, event_name, date, time, duration):
     """Сохраняет бронирование в базе данных."""
-    with sqlite3.connect('reservations.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO reservations 
-            (user_id, username, author_name, event_name, date, time, duration) 
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (user_id, username, author_name, event_name, date, time, duration))
-        conn.commit()
+    writer.execute(_save_reservation, user_id, username, author_name, event_name, date, time, duration)
 
-# Функция для обновления структуры базы данных (если нужно добавить новое поле)
+# Функция для обновления структуры базы данных (оставлена для совместимости)
 def update_db():
-    conn = sqlite3.connect('reservations.db')
-    cursor = conn.cursor()
-
-    try:
-        cursor.execute("ALTER TABLE reservations ADD COLUMN duration INTEGER")
-    except sqlite3.OperationalError:
-        print("Поле 'duration' уже существует.")
-
-    conn.commit()
-    conn.close()
-
-# Вызываем обновление базы данных для добавления поля
-update_db()
\ No newline at end of file
+    """Изменения схемы теперь описываются миграциями в db.migrations"""
+    migrate()
\ No newline at end of file
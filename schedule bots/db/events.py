@@ -0,0 +1,53 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ReservationChange:
+    """Изменение одного бронирования после фиксации транзакции.
+
+    old и new — кортежи (date, start_minute, end_minute) до и после изменения;
+    old равен None для нового бронирования, new — для удаленного.
+    """
+
+    __slots__ = ("reservation_id", "old", "new")
+
+    def __init__(self, reservation_id, old=None, new=None):
+        self.reservation_id = reservation_id
+        self.old = old
+        self.new = new
+
+    @property
+    def dates(self):
+        """Даты, которых касается изменение"""
+        return {interval[0] for interval in (self.old, self.new) if interval}
+
+    def __repr__(self):
+        return f"ReservationChange({self.reservation_id}, old={self.old}, new={self.new})"
+
+
+_listeners = []
+
+
+def subscribe(listener):
+    """Подписывает listener(change) на изменения бронирований.
+
+    change — ReservationChange или None, если изменились сразу все данные
+    (массовая очистка базы).
+    """
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def unsubscribe(listener):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def publish(change):
+    """Уведомляет подписчиков; ошибка одного подписчика не мешает остальным"""
+    for listener in list(_listeners):
+        try:
+            listener(change)
+        except Exception as e:
+            logger.error(f"Ошибка обработчика изменений бронирований {listener}: {e}", exc_info=True)
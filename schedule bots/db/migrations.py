@@ -0,0 +1,176 @@
+import logging
+import threading
+
+from db.connection import get_connection
+
+logger = logging.getLogger(__name__)
+
+
+def _create_reservations(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS reservations (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER,
+                        username TEXT,
+                        author_name TEXT,
+                        event_name TEXT,
+                        date TEXT,
+                        time TEXT,
+                        duration INTEGER)''')
+
+
+def _add_duration(cursor):
+    # Старые базы создавались без поля duration (раньше его добавлял update_db)
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(reservations)")}
+    if "duration" not in columns:
+        cursor.execute("ALTER TABLE reservations ADD COLUMN duration INTEGER")
+
+
+def _add_lookup_indexes(cursor):
+    # Покрывающий индекс для выборок по дню и по (дню, времени)
+    cursor.execute("""CREATE INDEX IF NOT EXISTS idx_reservations_date_time
+                      ON reservations (date, time, duration)""")
+    # Бронирования пользователя ("Мои бронирования")
+    cursor.execute("""CREATE INDEX IF NOT EXISTS idx_reservations_user
+                      ON reservations (user_id, date, time)""")
+
+
+def _start_minute_sql(time):
+    # "HH:MM" / "H:MM" -> минуты от полуночи; для некорректных строк NULL
+    return f"""CASE WHEN {time} GLOB '[0-9][0-9]:[0-5][0-9]' OR {time} GLOB '[0-9]:[0-5][0-9]'
+               THEN CAST(substr({time}, 1, instr({time}, ':') - 1) AS INTEGER) * 60
+                    + CAST(substr({time}, instr({time}, ':') + 1) AS INTEGER)
+               END"""
+
+
+def _interval_assignments(row):
+    # Та же арифметика, что и в db.timeslots: day = date.toordinal(), длительность по умолчанию 60 минут
+    start = _start_minute_sql(f"{row}time")
+    return f"""day = CAST(julianday({row}date) - 1721424.5 AS INTEGER),
+               start_minute = {start},
+               end_minute = ({start}) + COALESCE({row}duration, 60)"""
+
+
+def _add_minute_columns(cursor):
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(reservations)")}
+    for column in ("day", "start_minute", "end_minute"):
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE reservations ADD COLUMN {column} INTEGER")
+
+    # Заполняем новые поля для уже существующих записей
+    cursor.execute(f"UPDATE reservations SET {_interval_assignments('')}")
+
+    # Поддерживаем поля в актуальном состоянии при любой записи
+    cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS reservations_interval_insert
+                       AFTER INSERT ON reservations
+                       BEGIN
+                           UPDATE reservations SET {_interval_assignments('NEW.')} WHERE id = NEW.id;
+                       END""")
+    cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS reservations_interval_update
+                       AFTER UPDATE OF date, time, duration ON reservations
+                       BEGIN
+                           UPDATE reservations SET {_interval_assignments('NEW.')} WHERE id = NEW.id;
+                       END""")
+
+    # Диапазонные выборки по дню и проверка пересечений интервалов
+    cursor.execute("""CREATE INDEX IF NOT EXISTS idx_reservations_day_interval
+                      ON reservations (day, start_minute, end_minute)""")
+
+
+def _create_vk_sessions(cursor):
+    # Сессии ВК-бота (bots.sessions): состояние диалога и данные, data — JSON
+    cursor.execute("""CREATE TABLE IF NOT EXISTS vk_sessions (
+                        user_id INTEGER PRIMARY KEY,
+                        state TEXT,
+                        data TEXT,
+                        updated_at REAL NOT NULL)""")
+
+
+def _create_tg_persistence(cursor):
+    # Состояния ConversationHandler и context.user_data Telegram-бота (bots.tgPersistence)
+    cursor.execute("""CREATE TABLE IF NOT EXISTS tg_conversations (
+                        name TEXT NOT NULL,
+                        key TEXT NOT NULL,
+                        state TEXT NOT NULL,
+                        updated_at REAL NOT NULL,
+                        PRIMARY KEY (name, key))""")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS tg_user_data (
+                        user_id INTEGER PRIMARY KEY,
+                        data TEXT NOT NULL,
+                        updated_at REAL NOT NULL)""")
+
+
+def _create_reservation_changes(cursor):
+    # Журнал изменений бронирований для других процессов (db.changelog); old/new — JSON
+    cursor.execute("""CREATE TABLE IF NOT EXISTS reservation_changes (
+                        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                        pid INTEGER NOT NULL,
+                        reservation_id INTEGER,
+                        old TEXT,
+                        new TEXT)""")
+
+
+# Список миграций: (версия, описание, функция). Новые миграции добавляются только в конец.
+MIGRATIONS = [
+    (1, "Таблица reservations", _create_reservations),
+    (2, "Поле duration", _add_duration),
+    (3, "Индексы по дате/времени и пользователю", _add_lookup_indexes),
+    (4, "Целочисленные поля day/start_minute/end_minute", _add_minute_columns),
+    (5, "Таблица vk_sessions", _create_vk_sessions),
+    (6, "Таблицы tg_conversations и tg_user_data", _create_tg_persistence),
+    (7, "Журнал изменений reservation_changes", _create_reservation_changes),
+]
+
+_migrated = False
+_migrate_lock = threading.Lock()
+
+
+def get_schema_version(conn):
+    """Возвращает текущую версию схемы (0 для пустой базы)"""
+    conn.execute("""CREATE TABLE IF NOT EXISTS schema_version (
+                        version INTEGER PRIMARY KEY,
+                        description TEXT,
+                        applied_at TEXT DEFAULT CURRENT_TIMESTAMP)""")
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate():
+    """Применяет только те миграции, которые еще не записаны в schema_version.
+
+    Каждая миграция выполняется в своей транзакции BEGIN IMMEDIATE, поэтому
+    одновременный старт обоих ботов не применит миграцию дважды. В пределах
+    процесса проверка выполняется один раз.
+    """
+    global _migrated
+    if _migrated:
+        return
+
+    with _migrate_lock:
+        if _migrated:
+            return
+
+        conn = get_connection()
+        if get_schema_version(conn) >= MIGRATIONS[-1][0]:
+            _migrated = True
+            return
+
+        for version, description, apply in MIGRATIONS:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Версию перечитываем под блокировкой: её мог поднять другой процесс
+                if get_schema_version(conn) >= version:
+                    conn.rollback()
+                    continue
+
+                cursor = conn.cursor()
+                apply(cursor)
+                cursor.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                               (version, description))
+                conn.commit()
+                logger.info(f"Применена миграция {version}: {description}")
+            except Exception:
+                conn.rollback()
+                logger.error(f"Ошибка применения миграции {version}: {description}", exc_info=True)
+                raise
+
+        _migrated = True
@@ -0,0 +1,266 @@
+import threading
+from collections import OrderedDict
+from calendar import monthrange
+from datetime import date as _date
+
+from config import CAPACITY
+from db.connection import connection
+from db.events import subscribe
+from db.timeslots import WORKDAY_START, WORKDAY_END, day_to_date
+
+# Рабочий день целиком помещается в 960 минут
+WORKDAY_MINUTES = WORKDAY_END - WORKDAY_START
+
+# День, в котором не осталось свободного окна такой длины, считается полностью занятым
+MIN_FREE_WINDOW = 60
+
+FREE = 0
+BUSY = 1
+
+
+def _align_up(minute, step, origin):
+    # Ближайшая точка сетки origin + k * step, не меньшая minute
+    return origin + -(-(minute - origin) // step) * step
+
+
+class DayBitmap:
+    """Поминутная карта занятости рабочего дня: bytearray из 960 байт (0 — свободно, 1 — занято).
+
+    Проверка интервала — поиск занятого байта в срезе, поиск свободного
+    окна длины d — поиск подстроки из d нулевых байт; оба выполняются
+    через bytearray.find на C, без цикла по бронированиям.
+    """
+
+    __slots__ = ("bits",)
+
+    def __init__(self, bits=None):
+        self.bits = bits if bits is not None else bytearray(WORKDAY_MINUTES)
+
+    @classmethod
+    def from_intervals(cls, intervals):
+        bitmap = cls()
+        for start, end in intervals:
+            bitmap.mark(start, end)
+        return bitmap
+
+    def copy(self):
+        return DayBitmap(bytearray(self.bits))
+
+    def mark(self, start, end, value=BUSY):
+        """Помечает минуты [start, end) (обрезается по рабочему дню)"""
+        start = max(start, WORKDAY_START) - WORKDAY_START
+        end = min(end, WORKDAY_END) - WORKDAY_START
+        if start < end:
+            self.bits[start:end] = bytes((value,)) * (end - start)
+
+    @staticmethod
+    def covers(start, end):
+        """Лежит ли [start, end) внутри рабочего дня"""
+        return WORKDAY_START <= start and end <= WORKDAY_END
+
+    def is_free(self, start, end):
+        return self.bits.find(BUSY, start - WORKDAY_START, end - WORKDAY_START) == -1
+
+    def busy_minutes(self):
+        return self.bits.count(BUSY)
+
+    def next_free(self, after, duration, step=1, limit=WORKDAY_END, origin=WORKDAY_START):
+        """Начало ближайшего свободного окна длины duration (см. DayIntervals.next_free)"""
+        window = bytes(duration)
+        last = min(limit, WORKDAY_END) - WORKDAY_START
+        position = _align_up(max(after, origin), step, origin) - WORKDAY_START
+        while position + duration <= last:
+            found = self.bits.find(window, position, last)
+            if found == -1:
+                return None
+            candidate = _align_up(found + WORKDAY_START, step, origin) - WORKDAY_START
+            if candidate == found or self.bits.find(BUSY, candidate, candidate + duration) == -1:
+                if candidate + duration <= last:
+                    return candidate + WORKDAY_START
+                return None
+            position = candidate
+        return None
+
+
+class DayOccupancy:
+    """Сводка занятости дня для календарных клавиатур.
+
+    booked_minutes — минуты рабочего дня, когда заняты все CAPACITY мест,
+    largest_gap — самое длинное окно, в которое еще можно что-то поставить.
+    """
+
+    __slots__ = ("date", "bookings", "booked_minutes", "largest_gap", "peak")
+
+    def __init__(self, date, bookings=0, booked_minutes=0, largest_gap=WORKDAY_MINUTES, peak=0):
+        self.date = date
+        self.bookings = bookings
+        self.booked_minutes = booked_minutes
+        self.largest_gap = largest_gap
+        self.peak = peak
+
+    @property
+    def fully_booked(self):
+        return self.largest_gap < MIN_FREE_WINDOW
+
+    def __repr__(self):
+        return (f"DayOccupancy({self.date}, bookings={self.bookings}, booked_minutes={self.booked_minutes}, "
+                f"largest_gap={self.largest_gap}, fully_booked={self.fully_booked})")
+
+
+def sweep_day(date, intervals, capacity=CAPACITY):
+    """Заметающая прямая по интервалам дня.
+
+    Интервалы превращаются в события (начало +1, конец -1), которые
+    обходятся по времени; между событиями известно, сколько мероприятий
+    идет одновременно. Минута считается занятой, когда их не меньше
+    capacity. Время работы — O(n log n) от числа бронирований, а не от
+    длительности дня.
+    """
+    events = []
+    for start, end in intervals:
+        start, end = max(start, WORKDAY_START), min(end, WORKDAY_END)
+        if start < end:
+            events.append((start, 1))
+            events.append((end, -1))
+    # При равном времени конец (-1) идет раньше начала (+1): интервалы полуоткрытые
+    events.sort()
+
+    level = peak = booked = largest_gap = 0
+    previous = free_since = WORKDAY_START
+    for minute, delta in events:
+        full = level >= capacity
+        if full:
+            booked += minute - previous
+        previous = minute
+        level += delta
+        peak = max(peak, level)
+        if not full and level >= capacity:
+            largest_gap = max(largest_gap, minute - free_since)
+        elif full and level < capacity:
+            free_since = minute
+    largest_gap = max(largest_gap, WORKDAY_END - free_since)
+
+    return DayOccupancy(date, len(intervals), booked, largest_gap, peak)
+
+
+def full_blocks(intervals, capacity=CAPACITY):
+    """Отрезки [(start, end), ...], в которые одновременно идут не меньше capacity мероприятий.
+
+    Та же заметающая прямая, что в sweep_day, но без обрезки по рабочему
+    дню. Соседние отрезки сливаются, так что при capacity = 1 это просто
+    объединение интервалов.
+    """
+    events = []
+    for start, end in intervals:
+        if start < end:
+            events.append((start, 1))
+            events.append((end, -1))
+    events.sort()
+
+    blocks = []
+    level = 0
+    for minute, delta in events:
+        before, level = level, level + delta
+        if before < capacity <= level:
+            if blocks and blocks[-1][1] == minute:
+                blocks[-1] = (blocks[-1][0], None)  # продолжение предыдущего отрезка
+            else:
+                blocks.append((minute, None))
+        elif level < capacity <= before:
+            blocks[-1] = (blocks[-1][0], minute)
+    return blocks
+
+
+# Сколько сводок по дням держать в памяти одновременно
+MAX_CACHED_DAYS = 366
+
+# LRU-кэш сводок по дням; сбрасывается по событиям db.events. Счетчик изменений
+# не дает сохранить сводку, посчитанную по данным до записи.
+_day_cache = OrderedDict()
+_day_cache_lock = threading.Lock()
+_generation = 0
+
+
+def _invalidate(change):
+    global _generation
+    with _day_cache_lock:
+        _generation += 1
+        if change is None:
+            _day_cache.clear()
+            return
+        for date in change.dates:
+            _day_cache.pop(date, None)
+
+
+subscribe(_invalidate)
+
+
+def _remember(computed):
+    # Вызывается под _day_cache_lock: самые давние сводки вытесняются
+    _day_cache.update(computed)
+    for date in computed:
+        _day_cache.move_to_end(date)
+    while len(_day_cache) > MAX_CACHED_DAYS:
+        _day_cache.popitem(last=False)
+
+
+def get_day_occupancy(date):
+    """Сводка занятости дня (кэшируется до ближайшей записи в этот день)"""
+    with _day_cache_lock:
+        occupancy = _day_cache.get(date)
+        generation = _generation
+        if occupancy is not None:
+            _day_cache.move_to_end(date)
+    if occupancy is not None:
+        return occupancy
+
+    # Интервалы дня берутся из индекса в памяти (импорт здесь: availability импортирует этот модуль)
+    from db.availability import get_day_intervals
+    occupancy = sweep_day(date, list(get_day_intervals(date).entries.values()))
+    with _day_cache_lock:
+        if generation == _generation:
+            _remember({date: occupancy})
+    return occupancy
+
+
+def get_month_occupancy(year, month):
+    """Занятость всех дней месяца: {номер дня: DayOccupancy}.
+
+    Дни, которых еще нет в кэше, считаются по одному диапазонному запросу
+    по индексу (day, start_minute, end_minute) без обращений к базе на
+    каждый день.
+    """
+    year, month = int(year), int(month)
+    days_in_month = monthrange(year, month)[1]
+    first_day = _date(year, month, 1).toordinal()
+    dates = {number: day_to_date(first_day + number - 1) for number in range(1, days_in_month + 1)}
+
+    with _day_cache_lock:
+        occupancy = {number: _day_cache[date] for number, date in dates.items() if date in _day_cache}
+        generation = _generation
+        for number in occupancy:
+            _day_cache.move_to_end(dates[number])
+    if len(occupancy) == days_in_month:
+        return occupancy
+
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT day, start_minute, end_minute FROM reservations
+            WHERE day BETWEEN ? AND ? AND start_minute IS NOT NULL
+        """, (first_day, first_day + days_in_month - 1))
+        rows = cursor.fetchall()
+
+    intervals = {}
+    for day, start, end in rows:
+        intervals.setdefault(day, []).append((start, end))
+
+    computed = {}
+    for number, date in dates.items():
+        if number not in occupancy:
+            computed[date] = occupancy[number] = sweep_day(date, intervals.get(first_day + number - 1, []))
+
+    with _day_cache_lock:
+        if generation == _generation:
+            _remember(computed)
+    return occupancy
@@ -0,0 +1,129 @@
+import asyncio
+import queue
+import threading
+import time
+
+from db import db
+from db.availability import get_day_intervals, suggest_slots
+from db.cache import schedule_cache
+from db.connection import close_connection
+from db.occupancy import get_month_occupancy
+from metrics import histogram
+
+# Сколько запросов может одновременно ждать выполнения; следующие корутины
+# ждут своей очереди на семафоре, не блокируя цикл событий
+DB_QUEUE_SIZE = 256
+
+
+class AsyncRepository:
+    """Асинхронный доступ к базе для обработчиков Telegram.
+
+    Все запросы выполняются в одном выделенном потоке (у него свое
+    соединение из db.connection), а корутина только ждет результат, так
+    что цикл событий PTB не блокируется на диске. Очередь ограничена
+    семафором на max_pending запросов: при переполнении вызывающая
+    корутина ждет, а не растит очередь.
+
+    Время ожидания в очереди и время выполнения пишутся в гистограммы
+    db.queue_wait и db.<операция> (см. metrics).
+    """
+
+    def __init__(self, max_pending=DB_QUEUE_SIZE, name="db-worker"):
+        self.name = name
+        self._queue = queue.SimpleQueue()
+        self._slots = asyncio.Semaphore(max_pending)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._queue_wait = histogram("db.queue_wait")
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            fn, args, kwargs, loop, future, enqueued = item
+            started = time.perf_counter()
+            self._queue_wait.observe(started - enqueued)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                _resolve(loop, _set_exception, future, e)
+            else:
+                _resolve(loop, _set_result, future, result)
+            finally:
+                histogram(f"db.{getattr(fn, '__name__', 'call')}").observe(time.perf_counter() - started)
+        close_connection()
+
+    async def run(self, fn, *args, **kwargs):
+        """Выполняет fn(*args, **kwargs) в потоке базы и возвращает результат"""
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        async with self._slots:
+            future = loop.create_future()
+            self._queue.put((fn, args, kwargs, loop, future, time.perf_counter()))
+            return await future
+
+    def close(self, timeout=5.0):
+        """Дожидается выполнения поставленных запросов и останавливает поток"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    # Операции, которыми пользуются обработчики
+
+    async def add_reservation(self, *args):
+        return await self.run(db.add_reservation, *args)
+
+    async def reschedule_reservation(self, reservation_id, **changes):
+        return await self.run(db.reschedule_reservation, reservation_id, **changes)
+
+    async def update_reservation(self, reservation_id, field, new_value=None):
+        return await self.run(db.update_reservation, reservation_id, field, new_value)
+
+    async def delete_reservation(self, reservation_id):
+        return await self.run(db.delete_reservation, reservation_id)
+
+    async def get_reservations_for_user(self, user_id):
+        return await self.run(db.get_reservations_for_user, user_id)
+
+    async def day_intervals(self, date, exclude_id=None):
+        return await self.run(get_day_intervals, date, exclude_id)
+
+    async def suggest_slots(self, date, start, duration, **options):
+        return await self.run(suggest_slots, date, start, duration, **options)
+
+    async def month_occupancy(self, year, month):
+        return await self.run(get_month_occupancy, year, month)
+
+    async def rendered_schedule(self, date, view, render):
+        return await self.run(schedule_cache.rendered, date, view, render)
+
+
+def _resolve(loop, setter, future, value):
+    try:
+        loop.call_soon_threadsafe(setter, future, value)
+    except RuntimeError:
+        # Цикл событий уже закрыт (остановка бота) — результат никому не нужен
+        pass
+
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future, exc):
+    if not future.done():
+        future.set_exception(exc)
+
+
+# Общий репозиторий для обработчиков Telegram
+repository = AsyncRepository()
@@ -0,0 +1,37 @@
+from datetime import date as _date
+
+# Рабочий день (см. main.is_working_hours): 05:00–21:00, в минутах от полуночи
+WORKDAY_START = 5 * 60
+WORKDAY_END = 21 * 60
+
+# Длительность по умолчанию, если в бронировании она не указана
+DEFAULT_DURATION = 60
+
+
+def time_to_minutes(time_str):
+    """Переводит "HH:MM" в минуты от полуночи"""
+    hour, minute = time_str.split(":")
+    hour, minute = int(hour), int(minute)
+    if not (0 <= hour <= 23 and 0 <= minute <= 59):
+        raise ValueError(f"Некорректное время: {time_str}")
+    return hour * 60 + minute
+
+
+def minutes_to_time(minutes):
+    """Переводит минуты от полуночи в строку "HH:MM" """
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def date_to_day(date_str):
+    """Целочисленный ключ дня для "YYYY-MM-DD" (порядковый номер даты)"""
+    return _date.fromisoformat(date_str).toordinal()
+
+
+def day_to_date(day):
+    """Обратное преобразование ключа дня в "YYYY-MM-DD" """
+    return _date.fromordinal(day).isoformat()
+
+
+def overlaps(start, end, other_start, other_end):
+    """Пересекаются ли полуинтервалы [start, end) и [other_start, other_end)"""
+    return start < other_end and end > other_start
@@ -0,0 +1,305 @@
+import itertools
+import logging
+import os
+import pickle
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from functools import partial
+
+from db.changelog import record
+from db.connection import get_connection, close_connection
+from db.events import publish
+from metrics import histogram
+
+logger = logging.getLogger(__name__)
+
+# Сколько изменений можно объединить в одну транзакцию
+MAX_BATCH = 64
+
+
+class _WriteRequest:
+    __slots__ = ("fn", "args", "future", "origin")
+
+    def __init__(self, fn, args, origin=None):
+        self.fn = fn
+        self.args = args
+        self.future = Future()
+        # pid процесса, от которого пришло изменение (для журнала db.changelog)
+        self.origin = origin or os.getpid()
+
+
+class Writer:
+    """Единственный писатель в базу с групповой фиксацией.
+
+    Изменения (fn(cursor, *args) -> (результат, [ReservationChange, ...]))
+    ставятся в очередь из любых потоков. Поток писателя забирает все, что
+    накопилось (до MAX_BATCH), и выполняет одной транзакцией BEGIN IMMEDIATE:
+    каждое изменение — в своей точке сохранения, так что ошибка одного не
+    откатывает остальные. После COMMIT публикуются события db.events и
+    заполняются Future с результатами.
+
+    Когда с базой работают несколько процессов, изменения дополнительно
+    пишутся в журнал db.changelog (log_changes), а процесс может отдавать
+    их отдельному процессу писателя (connect_remote, serve_remote).
+    """
+
+    def __init__(self, max_batch=MAX_BATCH, name="db-writer"):
+        self.max_batch = max_batch
+        self.name = name
+        self.batches = 0
+        self.requests = 0
+        self.log_changes = False
+        self._remote = None
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._batch_latency = histogram("db.write_batch")
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, fn, *args):
+        """Ставит изменение в очередь; возвращает concurrent.futures.Future"""
+        if self._remote is not None:
+            return self._remote.submit(fn, args)
+        return self._enqueue(_WriteRequest(fn, args))
+
+    def _enqueue(self, request):
+        if threading.current_thread() is self._thread:
+            # Запись из подписчика db.events в потоке писателя: ждать очереди нельзя
+            self._commit_batch([request])
+            return request.future
+        self._ensure_started()
+        self._queue.put(request)
+        return request.future
+
+    def execute(self, fn, *args):
+        """Выполняет изменение и ждет результат (исключение fn пробрасывается)"""
+        return self.submit(fn, *args).result()
+
+    def connect_remote(self, client, requests, responses, writer_link):
+        """Дальше изменения этого процесса выполняет процесс писателя (serve_remote).
+
+        writer_link — конец канала для чтения, другой конец которого есть
+        только у процесса писателя: EOF на нем значит, что писатель умер.
+        """
+        self._remote = _RemoteClient(client, requests, responses, writer_link)
+
+    def close(self, timeout=5.0):
+        """Дописывает очередь и останавливает поток писателя"""
+        if self._remote is not None:
+            self._remote.close(timeout)
+            self._remote = None
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            request = self._queue.get()
+            if request is None:
+                break
+            batch = [request]
+            while len(batch) < self.max_batch:
+                try:
+                    request = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+            self._commit_batch(batch)
+        close_connection()
+
+    def _commit_batch(self, batch):
+        started = time.perf_counter()
+        conn = get_connection()
+        cursor = conn.cursor()
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for request in batch:
+                if not request.future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT write_request")
+                try:
+                    result, changes = request.fn(cursor, *request.args)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write_request")
+                    conn.execute("RELEASE write_request")
+                    outcomes.append((request, None, (), e))
+                else:
+                    conn.execute("RELEASE write_request")
+                    outcomes.append((request, result, changes, None))
+            if self.log_changes:
+                record(cursor, [(request.origin, change) for request, _, changes, _ in outcomes
+                                for change in changes])
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка фиксации пакета из {len(batch)} изменений: {e}")
+            if conn.in_transaction:
+                conn.rollback()
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.requests += len(batch)
+        self._batch_latency.observe(time.perf_counter() - started)
+
+        # Сначала обновляем кэши и индексы, потом отдаем результаты: вызвавший
+        # код сразу видит свои изменения
+        for _, _, changes, _ in outcomes:
+            for change in changes:
+                publish(change)
+        for request, result, _, error in outcomes:
+            if error is not None:
+                request.future.set_exception(error)
+            else:
+                request.future.set_result(result)
+
+
+class _RemoteClient:
+    """Отправляет изменения процессу писателя и ждет ответы.
+
+    Запросы (client, id, fn, args) сериализуются сразу, поэтому ошибка
+    pickle видна вызывающему, а не теряется в потоке очереди. Ответ несет
+    результат и изменения: они публикуются в db.events этого процесса до
+    того, как заполнится Future, — как и у локального писателя.
+
+    Ответа ждут, сколько бы ни шла запись: запрос из очереди писателя все
+    равно может быть зафиксирован. Ожидающие запросы завершаются ошибкой,
+    только когда писатель умер — его конец writer_link закрывается
+    (падение, убийство супервизором по пульсу, перезапуск группы).
+    """
+
+    def __init__(self, client, requests, responses, writer_link):
+        self.client = client
+        self.requests = requests
+        self.responses = responses
+        self.writer_link = writer_link
+        self._ids = itertools.count()
+        self._pending = {}  # id -> Future
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._writer_gone = False
+        self._receiver = threading.Thread(target=self._receive, name=f"{client}-writer-client", daemon=True)
+        self._receiver.start()
+
+    def submit(self, fn, args):
+        future = Future()
+        # pid в id: перезапущенный процесс не примет ответы на запросы своего предшественника
+        request_id = (os.getpid(), next(self._ids))
+        data = pickle.dumps((self.client, request_id, fn, args))
+        with self._lock:
+            if self._writer_gone:
+                future.set_exception(ConnectionError("Процесс писателя остановлен"))
+                return future
+            self._pending[request_id] = future
+        self.requests.put(data)
+        return future
+
+    def _receive(self):
+        while not self._stop.is_set():
+            try:
+                data = self.responses.get(timeout=0.5)
+            except queue.Empty:
+                # Очередь ответов пуста, а писатель закрыл свой конец канала — он умер
+                if self.writer_link.poll():
+                    self._fail_pending("Процесс писателя остановлен")
+                    return
+                continue
+            request_id, result, changes, error = pickle.loads(data)
+            with self._lock:
+                future = self._pending.pop(request_id, None)
+            if request_id[0] != os.getpid():
+                continue  # ответ предшественнику: его изменения придут из журнала (db.changelog)
+            # Публикуем даже без ожидающего Future: из журнала свои изменения процесс не берет
+            for change in changes:
+                publish(change)
+            if future is None:
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _fail_pending(self, reason):
+        with self._lock:
+            self._writer_gone = True
+            futures, self._pending = list(self._pending.values()), {}
+        if not futures:
+            return
+        logger.error(f"{reason}, без ответа осталось изменений: {len(futures)}")
+        # Часть из них могла быть зафиксирована, а в журнале они записаны от имени
+        # этого процесса: сбрасываем кэши целиком
+        publish(None)
+        for future in futures:
+            future.set_exception(ConnectionError(f"{reason}, результат изменения неизвестен"))
+
+    def close(self, timeout=5.0):
+        """Ждет ответы на отправленные запросы и останавливает прием"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and self._receiver.is_alive():
+            with self._lock:
+                if not self._pending:
+                    break
+            time.sleep(0.05)
+        self._stop.set()
+        self._receiver.join(timeout=2.0)
+        self._fail_pending("Писатель не ответил до остановки процесса")
+
+
+def _with_changes(cursor, fn, *args):
+    result, changes = fn(cursor, *args)
+    return (result, list(changes)), changes
+
+
+def _reply(responses, request_id, future):
+    try:
+        result, changes = future.result()
+        error = None
+    except Exception as e:
+        result, changes, error = None, [], e
+    try:
+        data = pickle.dumps((request_id, result, changes, error))
+    except Exception as e:
+        # Исключение или результат не сериализуются — передаем хотя бы текст ошибки
+        data = pickle.dumps((request_id, None, [], RuntimeError(f"{type(error or e).__name__}: {error or e}")))
+    responses.put(data)
+
+
+def serve_remote(requests, responses, stop):
+    """Цикл процесса писателя: выполняет изменения других процессов до stop.
+
+    requests — общая очередь запросов, responses — {client: очередь ответов},
+    stop — threading.Event или multiprocessing.Event. Изменения пишутся в
+    журнал db.changelog, чтобы их увидели все процессы.
+    """
+    writer.log_changes = True
+    while not stop.is_set():
+        try:
+            data = requests.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        client, request_id, fn, args = pickle.loads(data)
+        # Изменение записывается в журнал от имени процесса бота: свои изменения
+        # он уже опубликовал по ответу и из журнала их не возьмет
+        future = writer._enqueue(_WriteRequest(_with_changes, (fn, *args), origin=request_id[0]))
+        future.add_done_callback(partial(_reply, responses[client], request_id))
+    writer.close()
+
+
+# Общий писатель процесса: через него идут все изменения бронирований
+writer = Writer()
@@ -1,77 +1,215 @@
 import asyncio
+import concurrent.futures
+import logging
+import signal
 import threading
-import os
-import sys
-from bots import VkBot
-from config import VK_TOKEN
+import time
+from config import VK_TOKEN, BOT_PROCESSES, BOT_WRITER_PROCESS
 from datetime import datetime, timedelta
+from warmup import warm_up
 import pytz
 
-def is_working_hours():
-    tz = pytz.timezone("Europe/Moscow")
-    now = datetime.now(tz)
-    return 5 <= now.hour < 21
+logger = logging.getLogger(__name__)
 
-def schedule_exit():
-    tz = pytz.timezone("Europe/Moscow")
-    now = datetime.now(tz)
-    stop_time = now.replace(hour=21, minute=0, second=0, microsecond=0)
+TIMEZONE = pytz.timezone("Europe/Moscow")
+START_HOUR = 5
+STOP_HOUR = 21
+# Сколько секунд даем ботам на то, чтобы дописать очереди при остановке
+SHUTDOWN_TIMEOUT = 30
+# За сколько секунд до START_HOUR прогревать кэши; меньше SCHEDULE_CACHE_TTL (db.cache),
+# иначе прогретые расписания устареют к открытию
+WARMUP_LEAD = 120
+# Пауза перед повторным запуском, если боты упали в рабочее время
+RESTART_DELAY = 60
 
-    if now >= stop_time:
-        return  # Уже поздно, бот не работает
+def now():
+    return datetime.now(TIMEZONE)
 
-    delay = (stop_time - now).total_seconds()
-    print(f"⏳ Боты завершат работу через {int(delay // 60)} минут.")
-    threading.Timer(delay, lambda: os._exit(0)).start()
+def is_working_hours(moment=None):
+    moment = moment or now()
+    return START_HOUR <= moment.hour < STOP_HOUR
 
-def schedule_start():
-    tz = pytz.timezone("Europe/Moscow")
-    now = datetime.now(tz)
-    start_time = now.replace(hour=5, minute=0, second=0, microsecond=0)
+def next_opening(moment=None):
+    """Ближайшее начало рабочего дня; None, если рабочее время уже идет"""
+    moment = moment or now()
+    if is_working_hours(moment):
+        return None
+    opening = moment.replace(hour=START_HOUR, minute=0, second=0, microsecond=0)
+    if opening <= moment:
+        opening = TIMEZONE.normalize(opening + timedelta(days=1))
+    return opening
 
-    # Если сейчас уже после 5 утра, запускать сразу
-    if now >= start_time:
-        return
+def closing_time(moment=None):
+    moment = moment or now()
+    return moment.replace(hour=STOP_HOUR, minute=0, second=0, microsecond=0)
 
-    delay = (start_time - now).total_seconds()
-    print(f"⏳ Боты запустятся через {int(delay // 60)} минут.")
-    threading.Timer(delay, lambda: os._exit(0)).start()
+async def sleep_until(moment, shutdown):
+    """Ждет наступления moment по часам; True, если раньше пришел сигнал остановки"""
+    while not shutdown.is_set():
+        remaining = (moment - now()).total_seconds()
+        if remaining <= 0:
+            return False
+        try:
+            await asyncio.wait_for(shutdown.wait(), remaining)
+        except asyncio.TimeoutError:
+            pass  # таймер может сработать чуть раньше часов — проверяем еще раз
+    return True
+
+def in_thread(fn, *args, name):
+    """Выполняет fn в отдельном daemon-потоке и возвращает awaitable с результатом.
+
+    В отличие от asyncio.to_thread, зависший поток не задержит выход из asyncio.run.
+    """
+    future = concurrent.futures.Future()
+
+    def target():
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=target, name=name, daemon=True).start()
+    return asyncio.wrap_future(future)
+
+def day_stop(shutdown):
+    """Событие конца рабочего дня: устанавливается в STOP_HOUR или по сигналу остановки"""
+    stop = asyncio.Event()
+    closing = closing_time()
+    print(f"⏳ Боты завершат работу через {int((closing - now()).total_seconds() // 60)} минут.")
+    day_end = asyncio.create_task(sleep_until(closing, shutdown))
+    day_end.add_done_callback(lambda _: stop.set())
+    return stop, day_end
+
+async def serve(shutdown):
+    """Рабочий день: оба бота принимают события до STOP_HOUR или сигнала остановки.
+
+    Телеграм-бот — задача этого цикла, ВК-бот — поток long poll со своими
+    потоками шардов. При остановке боты перестают принимать события и
+    дописывают очереди, затем закрываются потоки базы; на все дается
+    SHUTDOWN_TIMEOUT секунд. Возвращает False, если телеграм-бот упал раньше времени.
+    """
+    # Модули ботов и базы обычно уже загружены прогревом (warmup.warm_imports)
+    from bots.tgBot import run_bot as run_telegram_bot
+    from bots.vkBot import VkBot
+    from db.repository import repository
+    from db.writer import writer
+
+    stop, day_end = day_stop(shutdown)
+
+    started = time.perf_counter()
+    tg_ready = asyncio.Event()
+    tg_task = asyncio.create_task(run_telegram_bot(stop, tg_ready))
 
-if not is_working_hours():
-    print("⛔ Вне рабочего времени. Бот не запускается.")
-    sys.exit()
+    # Конструктор ВК-бота ходит в сеть (long poll сервер) — не в цикле событий
+    try:
+        vk_bot = await in_thread(VkBot, VK_TOKEN, name="vk-start")
+    except Exception as e:
+        logger.error(f"ВК-бот не запустился: {e}", exc_info=True)
+        vk_bot = None
+    else:
+        threading.Thread(target=vk_bot.run, name="vk-longpoll", daemon=True).start()
+        logger.info(f"ВК-бот запущен за {time.perf_counter() - started:.2f} с")
 
-class TelegramBotRunner:
-    def __init__(self):
-        self.loop = asyncio.new_event_loop()
+    ready = asyncio.create_task(tg_ready.wait())
+    await asyncio.wait([ready, tg_task], return_when=asyncio.FIRST_COMPLETED)
+    if tg_ready.is_set():
+        logger.info(f"Телеграм-бот запущен за {time.perf_counter() - started:.2f} с")
+    else:
+        ready.cancel()
 
-    def _run_bot(self):
-        from bots.tgBot import main
-        main()
+    # Работаем до конца дня, сигнала остановки или падения телеграм-бота
+    stop_wait = asyncio.create_task(stop.wait())
+    await asyncio.wait([stop_wait, tg_task], return_when=asyncio.FIRST_COMPLETED)
+    completed = stop.is_set()
+    if not completed:
+        logger.error("Телеграм-бот остановился, останавливаем и ВК-бота")
+        stop.set()
+    await stop_wait
+    day_end.cancel()
 
-    def run(self):
-        asyncio.set_event_loop(self.loop)
+    logger.info("Остановка: прием событий прекращен, дописываем очереди...")
+    stopping = time.perf_counter()
+    deadline = stopping + SHUTDOWN_TIMEOUT
+
+    async def stop_vk():
+        if vk_bot is not None:
+            await in_thread(vk_bot.stop, name="vk-stop")
+            logger.info(f"ВК-бот остановлен за {time.perf_counter() - stopping:.2f} с")
+
+    async def stop_tg():
         try:
-            self.loop.run_in_executor(None, self._run_bot)
-            self.loop.run_forever()
-        except KeyboardInterrupt:
-            pass
-        finally:
-            self.loop.close()
+            await tg_task
+        except Exception as e:
+            logger.error(f"Ошибка при работе телеграм-бота: {e}")
+        logger.info(f"Телеграм-бот остановлен за {time.perf_counter() - stopping:.2f} с")
 
-def run_vk_bot():
-    bot = VkBot(VK_TOKEN)
-    bot.run()
+    pending = [asyncio.create_task(stop_vk()), asyncio.create_task(stop_tg())]
+    _, not_done = await asyncio.wait(pending, timeout=SHUTDOWN_TIMEOUT)
+    if not_done:
+        logger.error(f"Боты не остановились за {SHUTDOWN_TIMEOUT} с, часть очередей может быть потеряна")
+        tg_task.cancel()
 
-if __name__ == "__main__":
-    print("🚀 Запускаем обоих ботов...")
-    schedule_start()
-    schedule_exit()
+    # Последними — потоки базы: к этому моменту все изменения уже поставлены в очередь писателя.
+    # На следующий день они запустятся заново при первом запросе
+    timeout = max(1.0, deadline - time.perf_counter())
+    await in_thread(repository.close, timeout, name="repository-stop")
+    await in_thread(writer.close, timeout, name="writer-stop")
+    logger.info(f"Остановка завершена за {time.perf_counter() - stopping:.2f} с")
+    return completed
+
+async def serve_processes(shutdown):
+    """Рабочий день в режиме процессов (BOT_PROCESSES): боты в отдельных процессах, см. processes"""
+    import processes
+
+    stop, day_end = day_stop(shutdown)
+    try:
+        return await processes.supervise(stop, now().date(), writer_process=BOT_WRITER_PROCESS)
+    finally:
+        day_end.cancel()
+
+async def daemon():
+    """Резидентный процесс: рабочие дни с START_HOUR до STOP_HOUR, между ними — сон.
 
-    # Запускаем ВК-бота в отдельном потоке
-    vk_thread = threading.Thread(target=run_vk_bot, daemon=True)
-    vk_thread.start()
+    Вне рабочего времени боты остановлены и события не принимают (Telegram
+    и ВК копят их у себя). За WARMUP_LEAD секунд до открытия прогреваются
+    потоки базы, кэши и клавиатуры (см. warmup), чтобы первая волна
+    сообщений не попала на холодные кэши. Процесс завершается по SIGINT/SIGTERM.
 
-    # Запускаем телеграм-бота
-    tg_runner = TelegramBotRunner()
-    tg_runner.run()
+    С BOT_PROCESSES боты работают в дочерних процессах (processes.supervise)
+    и прогревают кэши сами при запуске.
+    """
+    loop = asyncio.get_running_loop()
+    shutdown = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, shutdown.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: остается KeyboardInterrupt
+
+    while not shutdown.is_set():
+        opening = next_opening()
+        if opening is not None:
+            print(f"💤 Вне рабочего времени. Прием событий приостановлен до {opening:%d.%m %H:%M}.")
+            if await sleep_until(opening - timedelta(seconds=WARMUP_LEAD), shutdown):
+                break
+        if not BOT_PROCESSES:
+            try:
+                await warm_up(now().date() if opening is None else opening.date())
+            except Exception as e:
+                logger.warning(f"Прогрев не удался, запускаемся с холодными кэшами: {e}", exc_info=True)
+        if opening is not None and await sleep_until(opening, shutdown):
+            break
+
+        print("🚀 Запускаем обоих ботов...")
+        if not await (serve_processes if BOT_PROCESSES else serve)(shutdown) and not shutdown.is_set():
+            logger.info(f"Повторный запуск через {RESTART_DELAY} с")
+            if await sleep_until(now() + timedelta(seconds=RESTART_DELAY), shutdown):
+                break
+    logger.info("Процесс остановлен")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    try:
+        asyncio.run(daemon())
+    except KeyboardInterrupt:
+        logger.info("Боты остановлены по запросу пользователя")
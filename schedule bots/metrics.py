@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import threading
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# Верхние границы корзин гистограмм, в секундах
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    """Гистограмма задержек с фиксированными корзинами (потокобезопасная)"""
+
+    def __init__(self, name, buckets=BUCKETS):
+        self.name = name
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина — всё, что больше
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        """Верхняя граница корзины, в которую попадает q-й процентиль (0 < q <= 100)"""
+        with self._lock:
+            if not self.count:
+                return 0.0
+            rank = self.count * q / 100
+            seen = 0
+            for i, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank:
+                    return self.buckets[i] if i < len(self.buckets) else self.max
+            return self.max
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+
+    def summary(self):
+        if not self.count:
+            return f"{self.name}: нет данных"
+        mean = self.total / self.count
+        return (f"{self.name}: n={self.count} среднее={mean * 1000:.2f} мс "
+                f"p50≤{self.percentile(50) * 1000:g} мс p95≤{self.percentile(95) * 1000:g} мс "
+                f"p99≤{self.percentile(99) * 1000:g} мс max={self.max * 1000:.2f} мс")
+
+
+_histograms = {}
+_registry_lock = threading.Lock()
+
+
+def histogram(name):
+    """Гистограмма по имени (создается при первом обращении)"""
+    with _registry_lock:
+        if name not in _histograms:
+            _histograms[name] = Histogram(name)
+        return _histograms[name]
+
+
+def report():
+    """Сводка по всем гистограммам, по строке на каждую"""
+    with _registry_lock:
+        histograms = list(_histograms.values())
+    return "\n".join(h.summary() for h in sorted(histograms, key=lambda h: h.name))
+
+
+async def watch_event_loop(name, interval=0.25):
+    """Измеряет задержку цикла событий: насколько позже срока просыпается asyncio.sleep.
+
+    Если обработчики блокируют цикл (например, синхронным запросом к базе),
+    задержка растет на время блокировки.
+    """
+    lag = histogram(name)
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag.observe(max(0.0, loop.time() - started - interval))
@@ -0,0 +1,358 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
+
+# Как часто дочерние процессы шлют пульс и сколько секунд без пульса считать процесс зависшим
+HEARTBEAT_INTERVAL = 1.0
+HEARTBEAT_TIMEOUT = 20.0
+
+# Пауза перед перезапуском упавшего процесса: растет вдвое до RESTART_BACKOFF_MAX и
+# сбрасывается, если процесс проработал STABLE_AFTER секунд
+RESTART_BACKOFF = 1.0
+RESTART_BACKOFF_MAX = 60.0
+STABLE_AFTER = 300.0
+
+# Сколько секунд даем процессам на то, чтобы дописать очереди при остановке
+SHUTDOWN_TIMEOUT = 30
+
+# Раз в столько секунд супервизор пишет в лог метрики процессов
+METRICS_LOG_INTERVAL = 60
+
+# spawn, а не fork: у родителя уже есть потоки, а fork копирует их блокировки
+_context = multiprocessing.get_context("spawn")
+
+LOG_FORMAT = '%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s'
+
+
+# Дочерние процессы. Модули ботов и базы импортируются уже в них: у каждого
+# процесса свои соединения, кэши и потоки, общая только база (WAL).
+# Пульс идет по своему каналу каждого процесса: (pid, процессорное время,
+# насколько опоздал сам пульс).
+
+def _pulse(lag):
+    return os.getpid(), time.process_time(), lag
+
+
+def _configure_logging():
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+
+
+def _prepare(name, remote, today):
+    """Общая настройка процесса бота: куда писать изменения, журнал чужих изменений, прогрев"""
+    _configure_logging()
+    from db.changelog import ChangeFeed
+    from db.writer import writer
+    from warmup import WARMUP_DAYS, warm_caches, warm_keyboards
+
+    if remote is not None:
+        requests, responses, writer_link = remote
+        writer.connect_remote(name, requests, responses, writer_link)
+    else:
+        writer.log_changes = True
+    feed = ChangeFeed()
+    feed.start()
+    try:
+        warm_caches([today + timedelta(days=i) for i in range(WARMUP_DAYS)])
+        warm_keyboards()
+    except Exception as e:
+        logger.warning(f"[{name}] Прогрев не удался: {e}")
+    return feed
+
+
+def _finish(feed):
+    from db.repository import repository
+    from db.writer import writer
+
+    feed.stop()
+    repository.close()
+    writer.close()
+
+
+def run_telegram(heartbeat, remote, today):
+    """Процесс Telegram-бота; пульс идет из цикла событий, поэтому блокировка цикла его останавливает"""
+    feed = _prepare("tg", remote, today)
+    try:
+        asyncio.run(_telegram_main(heartbeat))
+    finally:
+        _finish(feed)
+
+
+async def _telegram_main(heartbeat):
+    from bots.tgBot import run_bot
+
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async def beat():
+        lag = 0.0
+        while True:
+            heartbeat.send(_pulse(lag))
+            started = loop.time()
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            lag = max(0.0, loop.time() - started - HEARTBEAT_INTERVAL)
+
+    beating = asyncio.create_task(beat())
+    try:
+        await run_bot(stop)
+    finally:
+        beating.cancel()
+
+
+def _stalled_shards(stats, previous):
+    """Шарды, у которых есть очередь, но с прошлой проверки не обработано ни одного события"""
+    return [i for i, (now, before) in enumerate(zip(stats, previous))
+            if now["depth"] > 0 and now["processed"] == before["processed"]]
+
+
+def run_vk(heartbeat, remote, today):
+    """Процесс ВК-бота: long poll и шарды в потоках, пульс — из главного потока.
+
+    Пульс не отправляется, пока какой-то шард стоит с непустой очередью
+    дольше HEARTBEAT_TIMEOUT / 2: зависший обработчик приводит к перезапуску.
+    """
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+    feed = _prepare("vk", remote, today)
+
+    from bots.vkBot import VkBot
+    from config import VK_TOKEN
+
+    bot = VkBot(VK_TOKEN)
+    threading.Thread(target=bot.run, name="vk-longpoll", daemon=True).start()
+    try:
+        lag = 0.0
+        previous, checked = bot.dispatcher.stats(), time.monotonic()
+        stalled = False
+        while True:
+            if not stalled:
+                heartbeat.send(_pulse(lag))
+            started = time.monotonic()
+            if stop.wait(HEARTBEAT_INTERVAL):
+                break
+            lag = max(0.0, time.monotonic() - started - HEARTBEAT_INTERVAL)
+
+            if started - checked >= HEARTBEAT_TIMEOUT / 2:
+                stats = bot.dispatcher.stats()
+                shards = _stalled_shards(stats, previous)
+                if shards and not stalled:
+                    logger.error(f"[vk] Шарды {shards} не обрабатывают события, пульс остановлен")
+                stalled = bool(shards)
+                previous, checked = stats, started
+    finally:
+        bot.stop()
+        _finish(feed)
+
+
+def run_writer(heartbeat, requests, responses, links):
+    """Процесс писателя (db.writer.serve_remote): останавливается только по SIGTERM супервизора.
+
+    Ctrl+C в терминале получают все процессы группы; писатель его
+    игнорирует, чтобы боты успели дописать в него свои очереди. links —
+    концы каналов к ботам, которые есть только у писателя: они закрываются
+    с его смертью, и боты узнают, что ответов больше не будет.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    _configure_logging()
+
+    from db.migrations import migrate
+    from db.writer import serve_remote
+
+    migrate()
+
+    def beat():
+        lag = 0.0
+        while True:
+            heartbeat.send(_pulse(lag))
+            started = time.monotonic()
+            if stop.wait(HEARTBEAT_INTERVAL):
+                return
+            lag = max(0.0, time.monotonic() - started - HEARTBEAT_INTERVAL)
+
+    threading.Thread(target=beat, name="writer-heartbeat", daemon=True).start()
+    serve_remote(requests, responses, stop)
+
+
+# Супервизор
+
+class Child:
+    """Дочерний процесс супервизора: запуск, пульс, перезапуски и метрики"""
+
+    def __init__(self, name, target, args, handoff=()):
+        self.name = name
+        self.target = target
+        self.args = args
+        self.handoff = handoff  # концы каналов, которые после запуска должны остаться только у ребенка
+        self.process = None
+        self.heartbeat = None
+        self.started = 0.0
+        self.last_beat = 0.0
+        self.restart_at = None
+        self.backoff = RESTART_BACKOFF
+        self.restarts = 0
+        self.cpu = 0.0  # процессорное время из последнего пульса
+        self.reported_cpu = 0.0
+        self.max_lag = 0.0
+
+    def start(self):
+        self.heartbeat, sender = _context.Pipe(duplex=False)
+        self.process = _context.Process(target=self.target, args=(sender, *self.args), name=f"bot-{self.name}")
+        self.process.start()
+        sender.close()  # конец канала остался только у ребенка: после его смерти recv даст EOFError
+        for connection in self.handoff:
+            connection.close()
+        self.handoff = ()
+        self.started = self.last_beat = time.monotonic()
+        self.cpu = self.reported_cpu = 0.0
+        self.restart_at = None
+        logger.info(f"Процесс {self.name} запущен, pid {self.process.pid}")
+
+    def read_heartbeats(self):
+        try:
+            while self.heartbeat.poll():
+                pid, cpu, lag = self.heartbeat.recv()
+                self.last_beat = time.monotonic()
+                self.cpu = cpu
+                self.max_lag = max(self.max_lag, lag)
+        except (EOFError, OSError):
+            pass  # процесс завершился; это заметит check
+
+    def check(self, now):
+        """Перезапускает упавший процесс; True, если процесс завис и был убит"""
+        if self.restart_at is not None:
+            if now >= self.restart_at:
+                self.restarts += 1
+                self.start()
+            return False
+        if self.process.exitcode is not None:
+            if now - self.started >= STABLE_AFTER:
+                self.backoff = RESTART_BACKOFF
+            logger.error(f"Процесс {self.name} завершился с кодом {self.process.exitcode}, "
+                         f"перезапуск через {self.backoff:g} с")
+            self.restart_at = now + self.backoff
+            self.backoff = min(self.backoff * 2, RESTART_BACKOFF_MAX)
+            return False
+        if now - self.last_beat > HEARTBEAT_TIMEOUT:
+            logger.error(f"Процесс {self.name} не подает пульс {now - self.last_beat:.0f} с, останавливаем")
+            self.process.kill()
+            self.process.join(5)
+            return True
+        return False
+
+    def report(self, interval):
+        """Метрики за интервал: загрузка CPU, максимальная задержка пульса, перезапуски"""
+        cpu = (self.cpu - self.reported_cpu) / interval * 100 if interval else 0.0
+        line = (f"{self.name}: pid {self.process.pid}, CPU {cpu:.0f}%, "
+                f"задержка пульса до {self.max_lag * 1000:.0f} мс, перезапусков {self.restarts}")
+        self.reported_cpu = self.cpu
+        self.max_lag = 0.0
+        return line
+
+    async def stop(self, timeout):
+        if self.process is None or self.process.exitcode is not None:
+            return
+        self.process.terminate()
+        await asyncio.to_thread(self.process.join, timeout)
+        if self.process.exitcode is None:
+            logger.error(f"Процесс {self.name} не остановился за {timeout} с, завершаем принудительно")
+            self.process.kill()
+            await asyncio.to_thread(self.process.join, 5)
+
+
+def _build(today, writer_process):
+    """Процессы ботов (и писателя) с новыми каналами между ними: ([боты], писатель или None)"""
+    if not writer_process:
+        return [Child("tg", run_telegram, (None, today)), Child("vk", run_vk, (None, today))], None
+    requests = _context.Queue()
+    responses = {name: _context.Queue() for name in ("tg", "vk")}
+    # Писатель отдельно не перезапускается (только вся группа), поэтому его концы
+    # каналов родитель закрывает сразу после запуска
+    links = {name: _context.Pipe(duplex=False) for name in ("tg", "vk")}
+    writer_ends = [sender for _, sender in links.values()]
+    writer = Child("writer", run_writer, (requests, responses, writer_ends), handoff=writer_ends)
+    frontends = [Child(name, target, ((requests, responses[name], links[name][0]), today))
+                 for name, target in (("tg", run_telegram), ("vk", run_vk))]
+    return frontends, writer
+
+
+async def _stop_all(frontends, writer):
+    # Сначала боты дописывают свои очереди (в том числе в писателя), затем писатель
+    await asyncio.gather(*(child.stop(SHUTDOWN_TIMEOUT) for child in frontends))
+    if writer is not None:
+        await writer.stop(SHUTDOWN_TIMEOUT)
+
+
+async def supervise(stop, today, writer_process=False):
+    """Рабочий день в режиме процессов: каждый бот — в своем процессе, до установки stop.
+
+    VK и Telegram больше не делят GIL: тяжелая отрисовка или зависший
+    вызов в одном боте не тормозит другой. Общая только база в режиме
+    WAL; об изменениях другого процесса кэши узнают из журнала
+    db.changelog. С writer_process все записи идут через отдельный процесс
+    писателя (db.writer.serve_remote), иначе каждый процесс пишет сам под
+    BEGIN IMMEDIATE.
+
+    Упавший процесс перезапускается с растущей паузой, процесс без пульса
+    дольше HEARTBEAT_TIMEOUT — убивается и перезапускается. Очереди к
+    писателю общие, а убитый процесс мог оставить их поврежденными, поэтому
+    в режиме writer_process после убийства зависшего процесса или падения
+    писателя перезапускается вся группа с новыми очередями.
+    """
+    frontends, writer = _build(today, writer_process)
+    children = frontends + ([writer] if writer else [])
+    for child in ([writer] if writer else []) + frontends:
+        child.start()
+
+    reported = group_started = time.monotonic()
+    group_backoff = RESTART_BACKOFF
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), HEARTBEAT_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        for child in children:
+            child.read_heartbeats()
+        if stop.is_set():
+            break
+
+        now = time.monotonic()
+        killed = [child.name for child in children if child.check(now)]
+        if writer is not None and (killed or writer.restart_at is not None):
+            if now - group_started >= STABLE_AFTER:
+                group_backoff = RESTART_BACKOFF
+            logger.error(f"Перезапуск группы процессов с новыми очередями к писателю через {group_backoff:g} с")
+            await _stop_all(frontends, writer)
+            try:
+                await asyncio.wait_for(stop.wait(), group_backoff)
+                break
+            except asyncio.TimeoutError:
+                pass
+            group_backoff = min(group_backoff * 2, RESTART_BACKOFF_MAX)
+            restarts = {child.name: child.restarts + 1 for child in children}
+            frontends, writer = _build(today, writer_process)
+            children = frontends + [writer]
+            for child in [writer] + frontends:
+                child.restarts = restarts[child.name]
+                child.start()
+            reported = group_started = time.monotonic()
+
+        if now - reported >= METRICS_LOG_INTERVAL:
+            logger.info("Процессы: " + "; ".join(child.report(now - reported) for child in children))
+            reported = now
+
+    logger.info("Остановка процессов: боты дописывают очереди...")
+    stopping = time.perf_counter()
+    await _stop_all(frontends, writer)
+    logger.info(f"Процессы остановлены за {time.perf_counter() - stopping:.2f} с")
+    return True
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Пустая база во временном каталоге (config.DATABASE — относительный путь)"""
+    from db import migrations
+    from db.connection import close_all
+    from db.events import publish
+    from db.writer import writer
+
+    monkeypatch.chdir(tmp_path)
+    close_all()
+    monkeypatch.setattr(migrations, "_migrated", False)
+    publish(None)  # кэши и индекс свободного времени не должны помнить прошлую базу
+    migrations.migrate()
+    yield tmp_path
+    writer.close()
+    close_all()
+    publish(None)
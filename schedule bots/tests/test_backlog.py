@@ -0,0 +1,37 @@
+from types import SimpleNamespace
+
+from bots import backlog
+from bots.tgBot import _key_of
+from bots.vkBot import BacklogMessage
+
+
+def vk(text="", payload=None, user_id=1):
+    return BacklogMessage(user_id, 0, text, payload or {})
+
+
+def kept(messages):
+    groups, dropped = backlog.plan(messages, lambda m: m.user_id, BacklogMessage.key, BacklogMessage.is_view)
+    return [(m.text, m.payload) for _, items in groups for m in items], dropped
+
+
+def test_repeated_presses_collapse():
+    messages = [vk("📌 Бронь")] * 3 + [vk(payload={"button": "hour_10"})] * 2 + [vk("📌 Бронь")]
+    assert kept(messages) == ([("📌 Бронь", {}), ("", {"button": "hour_10"}), ("📌 Бронь", {})], 3)
+
+
+def test_typed_answers_are_kept():
+    # Имя автора и название события совпали — оба ответа нужны диалогу
+    messages = [vk(payload={"button": "duration_60"}), vk("Игорь"), vk("Игорь")]
+    assert kept(messages)[1] == 0
+
+
+def test_telegram_key_only_for_buttons():
+    def update(text=None, data=None):
+        return SimpleNamespace(update_id=1, message=SimpleNamespace(text=text) if text else None,
+                               callback_query=SimpleNamespace(data=data) if data else None)
+
+    assert _key_of(update(data="select_day_5")) == ("callback", "select_day_5")
+    assert _key_of(update(text="📌 Бронь")) == ("text", "📌 Бронь")
+    assert _key_of(update(text="Игорь")) is None
+    updates = [update(text="Игорь"), update(text="Игорь"), update(data="edit_date"), update(data="edit_date")]
+    assert len(backlog.collapse(updates, _key_of)) == 3
@@ -0,0 +1,91 @@
+import pytest
+
+from db.connection import connection
+from db.db import (_find_conflict, add_reservation, get_intervals_for_date, reschedule_reservation,
+                   update_reservation)
+from db.timeslots import date_to_day
+
+DATE = "2030-01-15"
+
+
+def book(time, duration, date=DATE):
+    return add_reservation(1, "user", "Автор", "Событие", date, time, duration)
+
+
+@pytest.fixture
+def booked(database):
+    """Одно бронирование 10:00–11:00"""
+    result = book("10:00", 60)
+    assert result
+    return result.reservation_id
+
+
+@pytest.mark.parametrize("time, duration", [
+    ("11:00", 60),  # начинается ровно в конце
+    ("09:00", 60),  # заканчивается ровно в начале
+    ("08:00", 30),
+])
+def test_touching_intervals_do_not_conflict(booked, time, duration):
+    assert book(time, duration)
+
+
+@pytest.mark.parametrize("time, duration", [
+    ("10:59", 30),  # заходит на последнюю минуту
+    ("09:01", 60),  # заходит на первую минуту
+    ("10:15", 15),  # внутри
+    ("09:00", 180),  # накрывает целиком
+    ("10:00", 60),  # то же время
+])
+def test_overlap_is_rejected_with_conflict(booked, time, duration):
+    result = book(time, duration)
+    assert not result
+    assert result.conflict["id"] == booked
+    assert get_intervals_for_date(DATE) == [(600, 660)]
+
+
+def test_other_day_does_not_conflict(booked):
+    assert book("10:00", 60, date="2030-01-16")
+
+
+def test_reschedule_excludes_itself(booked):
+    # Новый интервал пересекается только с самим переносимым бронированием
+    assert reschedule_reservation(booked, time="10:30")
+    assert get_intervals_for_date(DATE) == [(630, 690)]
+
+
+def test_reschedule_conflicts_with_other_booking(booked):
+    other = book("12:00", 60).reservation_id
+    result = reschedule_reservation(other, time="10:30")
+    assert not result
+    assert result.conflict["id"] == booked
+    assert get_intervals_for_date(DATE) == [(600, 660), (720, 780)]
+
+
+def test_reschedule_to_touching_slot(booked):
+    other = book("12:00", 60).reservation_id
+    assert reschedule_reservation(other, time="11:00")
+    assert reschedule_reservation(other, duration=60, time="09:00")
+
+
+def test_duration_edit_checks_overlap(booked):
+    book("11:00", 60)
+    assert not update_reservation(booked, "duration", 90)
+    assert update_reservation(booked, "duration", 30)
+    assert get_intervals_for_date(DATE) == [(600, 630), (660, 720)]
+
+
+def test_find_conflict_counts_capacity(booked):
+    with connection() as conn:
+        cursor = conn.cursor()
+        day = date_to_day(DATE)
+        # Одно место: любое пересечение — конфликт
+        assert _find_conflict(cursor, day, 630, 690, capacity=1)["id"] == booked
+        # Два места: одно бронирование не мешает, второе в том же времени заполняет день
+        assert _find_conflict(cursor, day, 630, 690, capacity=2) is None
+        conn.execute("""
+            INSERT INTO reservations (user_id, username, author_name, event_name, date, time, duration)
+            VALUES (2, 'user', 'Автор', 'Событие', ?, '10:45', 60)
+        """, (DATE,))
+        assert _find_conflict(cursor, day, 630, 690, capacity=2)["id"] == booked
+        assert _find_conflict(cursor, day, 570, 645, capacity=2) is None
+        conn.rollback()
@@ -0,0 +1,69 @@
+from db.db import add_reservation, delete_reservation
+from db import occupancy
+from db.availability import DayIntervals
+from db.occupancy import WORKDAY_MINUTES, full_blocks, get_day_occupancy, get_month_occupancy, sweep_day
+
+
+def test_empty_day():
+    occupancy = sweep_day("2030-01-15", [])
+    assert (occupancy.booked_minutes, occupancy.largest_gap, occupancy.peak) == (0, WORKDAY_MINUTES, 0)
+    assert not occupancy.fully_booked
+
+
+def test_single_place_day_is_full_without_free_hour():
+    # Свободно только 30 минут в конце дня (20:30–21:00)
+    occupancy = sweep_day("2030-01-15", [(300, 600), (600, 1230)], capacity=1)
+    assert occupancy.booked_minutes == 930
+    assert occupancy.largest_gap == 30
+    assert occupancy.fully_booked
+
+
+def test_capacity_counts_parallel_bookings():
+    intervals = [(300, 600), (600, 1230)]
+    assert sweep_day("2030-01-15", intervals, capacity=2).booked_minutes == 0
+    # Второе место занято с 10:00 до 12:00: полностью заняты только эти два часа
+    occupancy = sweep_day("2030-01-15", intervals + [(600, 720)], capacity=2)
+    assert (occupancy.booked_minutes, occupancy.peak) == (120, 2)
+    assert not occupancy.fully_booked
+
+
+def test_intervals_are_clipped_to_workday():
+    occupancy = sweep_day("2030-01-15", [(0, 360), (1200, 1440)], capacity=1)
+    assert occupancy.booked_minutes == 60 + 60
+
+
+def test_full_blocks():
+    intervals = [(600, 660), (660, 720), (630, 690), (800, 860)]
+    # Одно место: объединение интервалов, соседние сливаются
+    assert full_blocks(intervals, capacity=1) == [(600, 720), (800, 860)]
+    assert full_blocks(intervals, capacity=2) == [(630, 690)]
+    assert full_blocks(intervals, capacity=3) == []
+
+
+def test_day_intervals_use_capacity():
+    day = DayIntervals({1: (600, 660)}, capacity=2)
+    assert day.is_free(600, 660)
+    day = day.with_interval(2, 630, 690)
+    assert not day.is_free(640, 650) and day.is_free(660, 690)
+    assert day.next_free(600, 60, step=15) == 660
+    assert day.without(1).is_free(600, 700)
+
+
+def test_month_occupancy_follows_writes(database):
+    assert not get_month_occupancy(2030, 1)[15].fully_booked
+    result = add_reservation(1, "user", "Автор", "Событие", "2030-01-15", "05:00", WORKDAY_MINUTES)
+    assert result
+    assert get_month_occupancy(2030, 1)[15].fully_booked
+    assert get_day_occupancy("2030-01-15").fully_booked
+    assert delete_reservation(result.reservation_id)
+    assert not get_month_occupancy(2030, 1)[15].fully_booked
+
+
+def test_day_cache_is_bounded(database, monkeypatch):
+    monkeypatch.setattr(occupancy, "MAX_CACHED_DAYS", 40)
+    get_month_occupancy(2030, 1)
+    get_day_occupancy("2030-01-01")  # 1 января становится самым свежим
+    get_month_occupancy(2030, 2)
+    assert len(occupancy._day_cache) == 40
+    assert "2030-01-01" in occupancy._day_cache
+    assert "2030-01-02" not in occupancy._day_cache
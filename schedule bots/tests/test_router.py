@@ -0,0 +1,118 @@
+import pytest
+
+from bots.router import ANY_STATE, Router
+from bots.vkBot import STATES, build_router
+
+
+class RecordingBot:
+    """Вместо VkBot: запоминает вызванные методы и их аргументы"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        def method(*args):
+            self.calls.append((name, args))
+        return method
+
+
+@pytest.fixture(scope="module")
+def router():
+    return build_router()
+
+
+def dispatch(router, text="", payload=None, state=None, user_id=1):
+    bot = RecordingBot()
+    handled = router.dispatch(bot, user_id, text, payload, state)
+    return handled, bot.calls
+
+
+# Маршруты ВК-бота
+
+@pytest.mark.parametrize("text, method", [
+    ("📌 Бронь", "start_reservation"),
+    ("📅 Мои бронирования", "show_my_reservations"),
+    ("начать", "start"),
+    ("START", "start"),  # "start" без учета регистра
+])
+def test_text_commands(router, text, method):
+    assert dispatch(router, text=text, state=STATES['AUTHOR_NAME']) == (True, [(method, (1,))])
+
+
+def test_action_payload(router):
+    assert dispatch(router, payload={"action": "main_menu"}) == (True, [("start", (1,))])
+
+
+def test_action_bound_to_state(router):
+    payload = {"action": "schedule_month_period", "period": "1_4"}
+    assert dispatch(router, payload=payload, state=STATES['SCHEDULE_MONTH_PERIOD']) == \
+        (True, [("process_schedule_month_period", (1, "1_4"))])
+    # В другом состоянии кнопка молча игнорируется
+    assert dispatch(router, payload=payload, state=STATES['MONTH_SELECTION']) == (False, [])
+
+
+def test_exact_button(router):
+    assert dispatch(router, payload={"button": "edit_date"}) == (True, [("process_edit_date", (1,))])
+
+
+def test_prefix_button_passes_argument(router):
+    assert dispatch(router, payload={"button": "cancel_confirm_42"}) == \
+        (True, [("process_cancel_confirmation", (1, "42"))])
+
+
+def test_longest_prefix_wins(router):
+    # hour_period_ длиннее hour_: кнопка периода не уходит в обработчик часа
+    assert dispatch(router, payload={"button": "hour_period_9_12"}, state=STATES['HOUR_PERIOD_SELECTION']) == \
+        (True, [("process_hour_period_selection", (1, {"button": "hour_period_9_12"}))])
+    assert dispatch(router, payload={"button": "hour_10"}, state=STATES['HOUR_SELECTION']) == \
+        (True, [("process_hour_selection", (1, "10"))])
+
+
+def test_prefix_state_and_any_state(router):
+    assert dispatch(router, payload={"button": "select_day_5"}, state=STATES['DAY_SELECTION']) == \
+        (True, [("process_day_selection", (1, "5"))])
+    # Вне DAY_SELECTION срабатывает маршрут для любого состояния
+    handled, calls = dispatch(router, payload={"button": "select_day_5"}, state=STATES['HOUR_SELECTION'])
+    assert handled and calls[0][0] == "send_message"
+
+
+def test_modal_state_takes_everything(router):
+    assert dispatch(router, text="📌 Бронь", state=STATES['EDIT_DAY_SELECTION']) == \
+        (True, [("process_edit_day_selection", (1, "📌 Бронь"))])
+    # Условие when: пустой текст модальному обработчику не достается
+    assert dispatch(router, text="", payload={"button": "edit_date"}, state=STATES['EDIT_DAY_SELECTION']) == \
+        (True, [("process_edit_date", (1,))])
+
+
+def test_free_text_by_state(router):
+    assert dispatch(router, text="Иван", state=STATES['AUTHOR_NAME']) == \
+        (True, [("process_author_name", (1, "Иван"))])
+
+
+def test_fallback_only_without_state(router):
+    handled, calls = dispatch(router, text="что-то")
+    assert handled and calls[-1][0] == "send_message"
+    assert dispatch(router, text="что-то", state=STATES['HOUR_SELECTION']) == (False, [])
+
+
+def test_unknown_button(router):
+    assert dispatch(router, payload={"button": "no_such_button"}) == (False, [])
+
+
+# Router сам по себе
+
+def test_duplicate_route_is_rejected():
+    router = Router()
+    router.button("ok", lambda bot, m: None)
+    router.button("ok", lambda bot, m: None, states="other")
+    with pytest.raises(ValueError):
+        router.button("ok", lambda bot, m: None)
+
+
+def test_state_route_beats_any_state():
+    router = Router()
+    router.prefix("day_", "any", states=ANY_STATE)
+    router.prefix("day_", "selected", states="select")
+    assert router.resolve(1, "", {"button": "day_3"}, "select")[0] == "selected"
+    handler, message = router.resolve(1, "", {"button": "day_3"}, "other")
+    assert (handler, message.button, message.arg) == ("any", "day_3", "3")
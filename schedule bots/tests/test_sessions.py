@@ -0,0 +1,62 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from bots import sessions
+from bots.sessions import SessionStore
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Управляемое time.monotonic для bots.sessions"""
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(sessions, "time", SimpleNamespace(monotonic=lambda: now.value, time=time.time))
+    return now
+
+
+def test_lru_eviction_over_limit(clock):
+    store = SessionStore("vk_sessions", limit=2, persist=False)
+    store.states[1] = "a"
+    store.states[2] = "b"
+    store.states[1]  # 1 становится самой свежей
+    store.states[3] = "c"
+    assert store.stats()["evictions"] == 1
+    assert list(store.states) == [1, 3]
+    assert 2 not in store.states  # вытесненная сессия без базы забыта
+
+
+def test_ttl_expiration(clock):
+    store = SessionStore("vk_sessions", ttl=60, persist=False)
+    store.states[1] = "a"
+    store.states[2] = "b"
+    clock.value += 30
+    store.states[2]
+    clock.value += 45  # 1 не трогали 75 с, 2 — 45 с
+    assert store.states.get(1) is None
+    assert store.states[2] == "b"
+    assert store.stats()["expirations"] == 1
+
+
+def test_expired_sessions_evicted_first(clock):
+    store = SessionStore("vk_sessions", limit=2, ttl=60, persist=False)
+    store.states[1] = "a"
+    clock.value += 61
+    store.states[2] = "b"
+    store.states[3] = "c"
+    stats = store.stats()
+    assert (stats["expirations"], stats["evictions"], stats["size"]) == (1, 0, 2)
+
+
+def test_evicted_session_is_reloaded_from_database(database):
+    store = SessionStore("vk_sessions", limit=1)
+    store.states[1] = "booking"
+    store.data[1] = {"month": 5}
+    store.states[2] = "other"  # вытесняет 1 до записи в базу
+    assert store.states[1] == "booking"  # берется из еще не записанных изменений
+    store.close()
+
+    restarted = SessionStore("vk_sessions")
+    assert restarted.states[1] == "booking"
+    assert restarted.data[1] == {"month": 5}
+    assert restarted.stats()["loads"] == 1
@@ -0,0 +1,79 @@
+import asyncio
+import importlib
+import logging
+import time
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
+
+# Сколько дней, начиная с сегодняшнего, загружать в кэши
+WARMUP_DAYS = 2
+
+# Модули, которые нужны с первого сообщения: при прогреве они импортируются заранее,
+# а сам процесс до прогрева их не загружает
+MODULES = ("bots.tgBot", "bots.vkBot", "db.repository", "db.writer")
+
+
+def _open_writer_connection(cursor):
+    """Пустое изменение: поток писателя запускается и открывает соединение"""
+    return None, ()
+
+
+def warm_imports():
+    for name in MODULES:
+        importlib.import_module(name)
+
+
+def warm_caches(dates):
+    """Загружает дни в индекс свободного времени, расписания в кэш и занятость их месяцев"""
+    from db.availability import index
+    from db.cache import schedule_cache
+    from db.migrations import migrate
+    from db.occupancy import get_month_occupancy
+
+    migrate()
+    for date in dates:
+        key = date.isoformat()
+        index.day(key)
+        schedule_cache.rows(key)
+    for year, month in sorted({(date.year, date.month) for date in dates}):
+        get_month_occupancy(year, month)
+
+
+def warm_keyboards():
+    """Собирает клавиатуры с постоянными аргументами (постоянные клавиатуры собраны при импорте)"""
+    from bots import tgKeyboards, vkKeyboards
+
+    for prefix in ("minute", "edit_minute"):
+        vkKeyboards.minutes(prefix)
+        tgKeyboards.minutes_row(prefix)
+    for prefix in ("duration", "edit_duration"):
+        vkKeyboards.durations(prefix)
+    for prefix in ("month", "edit_month", "select_month"):
+        tgKeyboards.months(prefix)
+
+
+async def warm_up(today):
+    """Прогревает процесс перед открытием: модули ботов, потоки и соединения базы, кэши, клавиатуры.
+
+    today — текущая дата (datetime.date) в часовом поясе ботов. Возвращает
+    время прогрева в секундах.
+    """
+    started = time.perf_counter()
+    # Импорт — в отдельном потоке: цикл событий в это время свободен
+    await asyncio.to_thread(warm_imports)
+    from db.cache import schedule_cache
+    from db.repository import repository
+    from db.writer import writer
+
+    imported = time.perf_counter() - started
+    dates = [today + timedelta(days=i) for i in range(WARMUP_DAYS)]
+    # Кэши общие для процесса; грузим их в потоке репозитория — заодно он откроет свое соединение
+    await repository.run(warm_caches, dates)
+    await asyncio.wrap_future(writer.submit(_open_writer_connection))
+    warm_keyboards()
+    elapsed = time.perf_counter() - started
+    logger.info(f"Прогрев за {elapsed:.2f} с (импорт {imported:.2f} с): "
+                f"дни {', '.join(date.isoformat() for date in dates)}, "
+                f"кэш расписаний {schedule_cache.stats()['size']} дат")
+    return elapsed